@@ -0,0 +1,83 @@
+"""
+Value counts of ``calcs``, next to the pandas calls they replace
+"""
+import pandas as pd
+import pytest
+from pubdsutils.calcs import bin_edges, contingency_table, value_counts_comb, \
+    value_counts_comb_df
+
+COLUMNS = ['country', 'device', 'product_id', 'customer_id']
+COMBINATIONS = ['country', 'category', ('country', 'category'),
+                ('country', 'product_id'), ('category', 'product_id')]
+
+
+def _two_value_counts(s, bins=None):
+    return pd.concat([s.value_counts(normalize=True, bins=bins),
+                      s.value_counts(bins=bins)],
+                     axis=1, keys=['Ratio', 'Count'])
+
+
+def _apart(df, cols):
+    result = {}
+    for key in cols:
+        if isinstance(key, tuple):
+            counts = df.groupby(list(key)).size()
+            result[key] = pd.concat([counts / counts.sum(), counts], axis=1,
+                                    keys=['Ratio', 'Count'])
+        else:
+            result[key] = _two_value_counts(df[key])
+    return result
+
+
+@pytest.mark.benchmark(group='value_counts_comb')
+@pytest.mark.parametrize('col', COLUMNS)
+def bench_value_counts_comb(benchmark, orders, col):
+    benchmark(value_counts_comb, orders[col])
+
+
+@pytest.mark.benchmark(group='value_counts_comb')
+@pytest.mark.parametrize('col', COLUMNS)
+def bench_two_value_counts(benchmark, orders, col):
+    benchmark(_two_value_counts, orders[col])
+
+
+@pytest.mark.benchmark(group='value_counts_comb-bins')
+def bench_value_counts_comb_bins(benchmark, orders):
+    benchmark(value_counts_comb, orders['price'], bins=20)
+
+
+@pytest.mark.benchmark(group='value_counts_comb-bins')
+def bench_value_counts_comb_edges(benchmark, orders):
+    edges = bin_edges(orders['price'], 20)
+    benchmark(value_counts_comb, orders['price'], bins=edges)
+
+
+@pytest.mark.benchmark(group='value_counts_comb-bins')
+def bench_two_value_counts_bins(benchmark, orders):
+    benchmark(_two_value_counts, orders['price'], bins=20)
+
+
+@pytest.mark.benchmark(group='value_counts_comb-weights')
+def bench_value_counts_comb_weights(benchmark, orders):
+    benchmark(value_counts_comb, orders['country'], weights=orders['price'])
+
+
+@pytest.mark.benchmark(group='value_counts_comb-weights')
+def bench_groupby_sum(benchmark, orders):
+    benchmark(lambda: orders['price'].groupby(orders['country']).sum())
+
+
+@pytest.mark.benchmark(group='value_counts_comb_df')
+def bench_value_counts_comb_df(benchmark, orders):
+    benchmark(value_counts_comb_df, orders, COMBINATIONS)
+
+
+@pytest.mark.benchmark(group='value_counts_comb_df')
+def bench_apart(benchmark, orders):
+    benchmark(_apart, orders, COMBINATIONS)
+
+
+@pytest.mark.benchmark(group='contingency_table')
+def bench_contingency_table(benchmark, orders):
+    pytest.importorskip('scipy')
+    benchmark(contingency_table, orders, 'customer_id', 'product_id')
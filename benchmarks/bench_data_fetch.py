@@ -0,0 +1,99 @@
+"""
+Hashing and writing snapshots with ``persist_df``, and ``bulk_insert`` into
+SQLite
+"""
+import os
+import shutil
+import sqlite3
+from hashlib import sha256
+import pytest
+from pubdsutils.data_fetch import bulk_insert, hash_df, persist_df, \
+    _db_records
+
+ROUNDS = 5
+
+
+def _json_hash(df):
+    return sha256(df.to_json().encode()).hexdigest()
+
+
+@pytest.mark.benchmark(group='hash')
+def bench_hash_df(benchmark, orders):
+    benchmark(hash_df, orders)
+
+
+@pytest.mark.benchmark(group='hash')
+@pytest.mark.max_rows(1e6)
+def bench_json_hash(benchmark, orders):
+    benchmark(_json_hash, orders)
+
+
+@pytest.mark.benchmark(group='persist_df')
+@pytest.mark.parametrize('fmt', ['pickle', 'parquet', 'feather'])
+def bench_persist_df(benchmark, orders, tmp_path, fmt):
+    if fmt != 'pickle':
+        pytest.importorskip('pyarrow')
+    path = str(tmp_path) + os.sep
+
+    def clear():
+        shutil.rmtree(path)
+        os.mkdir(path)
+
+    benchmark.pedantic(persist_df, args=(orders, path), kwargs={'fmt': fmt},
+                       setup=clear, rounds=ROUNDS)
+
+
+@pytest.fixture
+def scores(orders, tmp_path):
+    """Rows to insert and a function creating a new table for them"""
+    df = orders[['order_id', 'price', 'device']]
+    db = str(tmp_path / 'bench.sqlite')
+    tables = []
+
+    def connect():
+        return sqlite3.connect(db, timeout=60)
+
+    def create():
+        table = 'scores_{}'.format(len(tables))
+        tables.append(table)
+        with connect() as conn:
+            conn.execute("CREATE TABLE {} (order_id INTEGER, price REAL, "
+                         "device TEXT)".format(table))
+        return (table,), {}
+    return df, connect, create
+
+
+def _row_by_row(df, connect, table):
+    conn = connect()
+    cursor = conn.cursor()
+    for record in _db_records(df):
+        cursor.execute(
+            "INSERT INTO {} VALUES (?, ?, ?)".format(table), record)
+        conn.commit()
+    conn.close()
+
+
+@pytest.mark.benchmark(group='bulk_insert')
+@pytest.mark.max_rows(1e6)
+def bench_bulk_insert(benchmark, scores):
+    df, connect, create = scores
+    benchmark.pedantic(lambda table: bulk_insert(df, connect, table),
+                       setup=create, rounds=ROUNDS)
+
+
+@pytest.mark.benchmark(group='bulk_insert')
+@pytest.mark.max_rows(1e6)
+def bench_bulk_insert_staging(benchmark, scores):
+    df, connect, create = scores
+    benchmark.pedantic(
+        lambda table: bulk_insert(df, connect, table,
+                                  staging_table=table + '_staging'),
+        setup=create, rounds=ROUNDS)
+
+
+@pytest.mark.benchmark(group='bulk_insert')
+@pytest.mark.max_rows(1e4)
+def bench_row_by_row(benchmark, scores):
+    df, connect, create = scores
+    benchmark.pedantic(lambda table: _row_by_row(df, connect, table),
+                       setup=create, rounds=ROUNDS)
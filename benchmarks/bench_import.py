@@ -0,0 +1,29 @@
+"""
+Cold imports of the modules, each in a fresh interpreter
+"""
+import re
+import subprocess
+import sys
+import pytest
+
+MODULES = ['calcs', 'data_fetch', 'email', 'features_engineering',
+           'instrumentation', 'preprocessing', 'profiling']
+ROUNDS = 5
+
+
+def _import_time(module):
+    """Cumulative import time in seconds, as reported by -X importtime"""
+    output = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+        stderr=subprocess.PIPE, check=True).stderr.decode()
+    pattern = r'^import time:\s*\d+ \|\s*(\d+) \| {}$'.format(
+        re.escape(module))
+    return int(re.search(pattern, output, re.MULTILINE).group(1)) / 1e6
+
+
+@pytest.mark.benchmark(group='import')
+@pytest.mark.parametrize('module', MODULES)
+def bench_import(benchmark, module):
+    module = 'pubdsutils.' + module
+    benchmark.extra_info['import_seconds'] = benchmark.pedantic(
+        _import_time, args=(module,), rounds=ROUNDS)
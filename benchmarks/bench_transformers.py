@@ -0,0 +1,49 @@
+"""
+Fitting and transforming with every transformer
+"""
+import numpy as np
+import pytest
+from pubdsutils import features_engineering as fe
+from pubdsutils import preprocessing as pp
+
+TRANSFORMERS = [
+    lambda: fe.RatioBetweenColumns(numer='discount', denom='price'),
+    lambda: fe.RatioColumnToConst(col='price', const=1.19),
+    lambda: fe.RatioColumnToValue(col='price', func='mean'),
+    lambda: fe.RatioColumnToValue(col='price', func='median'),
+    lambda: fe.DaysFromLaterToEarly(start='ordered_at', end='shipped_at'),
+    lambda: fe.DayOfTheWeekForColumn(col='ordered_at'),
+    lambda: fe.HourOfTheDayForColumn(col='ordered_at'),
+    lambda: fe.SelectColumns(cols=['order_id', 'price', 'country']),
+    lambda: pp.RemoveConstantColumns(),
+    lambda: pp.ColumnsOneHotEncoder(cols=['quantity'], n_values=10),
+    lambda: pp.StandardizeFloatCols(cols=['price']),
+    lambda: pp.LabelEncodingColoumns(cols=['device', 'condition']),
+]
+IDS = ['RatioBetweenColumns', 'RatioColumnToConst', 'RatioColumnToValue-mean',
+       'RatioColumnToValue-median', 'DaysFromLaterToEarly',
+       'DayOfTheWeekForColumn', 'HourOfTheDayForColumn', 'SelectColumns',
+       'RemoveConstantColumns', 'ColumnsOneHotEncoder',
+       'StandardizeFloatCols', 'LabelEncodingColoumns']
+
+
+@pytest.mark.benchmark(group='fit')
+@pytest.mark.parametrize('make', TRANSFORMERS, ids=IDS)
+def bench_fit(benchmark, orders, make):
+    benchmark(lambda: make().fit(orders))
+
+
+@pytest.mark.benchmark(group='transform')
+@pytest.mark.parametrize('make', TRANSFORMERS, ids=IDS)
+def bench_transform(benchmark, orders, make):
+    transformer = make().fit(orders)
+    result = benchmark(transformer.transform, orders)
+    assert len(result) == len(orders)
+
+
+@pytest.mark.benchmark(group='fit_on_sample')
+def bench_fit_on_sample(benchmark, orders):
+    sample = orders.sample(frac=0.1, random_state=np.random.RandomState(0))
+    transformer = fe.RatioColumnToValue(col='price', func='median')
+    benchmark(transformer.fit_on_sample, sample,
+              population_size=len(orders))
@@ -0,0 +1,58 @@
+"""
+Options and fixtures of the benchmark suite, see the README
+"""
+import os
+import pytest
+from datagen import make_orders
+
+BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         'baselines')
+_orders = {}
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        '--rows', default='1e4',
+        help='Comma separated sizes of the order data, e.g. 1e4,1e6,1e7 '
+             '(default: 1e4)')
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_configure(config):
+    # Keep the runs along with the suite, wherever pytest is run from
+    if config.getoption('benchmark_storage') == 'file://./.benchmarks':
+        config.option.benchmark_storage = 'file://' + BASELINES
+
+
+def pytest_generate_tests(metafunc):
+    if 'orders' in metafunc.fixturenames:
+        sizes = [int(float(size))
+                 for size in metafunc.config.getoption('rows').split(',')]
+        metafunc.parametrize('orders', sizes, indirect=True,
+                             scope='session', ids=_size_id)
+
+
+@pytest.fixture(scope='session')
+def orders(request):
+    """The order data of a size, generated once per session"""
+    if request.param not in _orders:
+        _orders.clear()
+        _orders[request.param] = make_orders(request.param)
+    return _orders[request.param]
+
+
+@pytest.fixture(autouse=True)
+def _max_rows(request):
+    """Skip the benchmarks marked ``max_rows(n)`` for more than n rows"""
+    marker = request.node.get_closest_marker('max_rows')
+    callspec = getattr(request.node, 'callspec', None)
+    if marker and callspec and callspec.params['orders'] > marker.args[0]:
+        pytest.skip('more than {} rows'.format(_size_id(marker.args[0])))
+
+
+def _size_id(n_rows):
+    """E.g. 1e4 for 10000"""
+    exponent = len(str(n_rows)) - 1
+    if n_rows == 10 ** exponent:
+        return '1e{}'.format(exponent)
+    return str(n_rows)
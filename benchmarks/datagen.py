@@ -0,0 +1,86 @@
+"""
+Synthetic order data for the benchmarks
+
+The columns mimic an e-commerce order table: skewed customer and product
+popularity, categoricals of uneven frequencies, log-normal prices, missing
+discounts and shipping dates, and a constant column.
+"""
+import numpy as np
+import pandas as pd
+
+CATEGORIES = ['phone', 'tablet', 'laptop', 'console', 'game', 'watch',
+              'camera', 'headphones', 'book', 'dvd']
+COUNTRIES = ['DE', 'FR', 'NL', 'AT', 'BE', 'ES', 'IT']
+COUNTRY_WEIGHTS = [0.55, 0.15, 0.1, 0.08, 0.05, 0.04, 0.03]
+DEVICES = ['web', 'ios', 'android']
+DEVICE_WEIGHTS = [0.5, 0.3, 0.2]
+CONDITIONS = ['A', 'B', 'C']
+
+
+def make_orders(n_rows, seed=0):
+    """
+    Orders of two years
+
+    Parameters
+    ----------
+    n_rows : int
+    seed : int (default 0)
+
+    Returns
+    -------
+    pandas.DataFrame
+        With the columns:
+
+        - ``order_id``: unique int
+        - ``customer_id`` and ``product_id``: ints of Pareto distributed
+          popularity
+        - ``category`` and ``country``: categoricals, the category
+          determined by the product
+        - ``device`` and ``condition``: strings (object)
+        - ``price``: log-normal float, rounded to cents
+        - ``quantity``: geometric int between 1 and 9
+        - ``discount``: float, NaN for 80% of the orders
+        - ``ordered_at`` and ``shipped_at``: datetimes, the latter 1.5 days
+          later on average and NaT for 2% of the orders
+        - ``shop``: constant string
+    """
+    rng = np.random.RandomState(seed)
+    n_customers = max(n_rows // 5, 1)
+    n_products = max(min(n_rows // 20, 50000), 1)
+    product_id = _popularity(rng, n_rows, n_products)
+    category_weights = 1. / np.arange(1, len(CATEGORIES) + 1)
+    product_category = rng.choice(
+        len(CATEGORIES), n_products,
+        p=category_weights / category_weights.sum())
+    price = rng.lognormal(3.5, 0.9, n_rows).round(2)
+    discount = (price * rng.beta(1, 9, n_rows)).round(2)
+    discount[rng.rand(n_rows) < 0.8] = np.nan
+    ordered_at = pd.Timestamp('2017-01-01') + pd.to_timedelta(
+        rng.randint(0, 2 * 365 * 24 * 3600, n_rows), unit='s')
+    shipped_at = ordered_at + pd.to_timedelta(
+        rng.exponential(36 * 3600, n_rows).astype(np.int64), unit='s')
+    shipped_at = shipped_at.where(rng.rand(n_rows) >= 0.02)
+    return pd.DataFrame({
+        'order_id': np.arange(n_rows),
+        'customer_id': _popularity(rng, n_rows, n_customers),
+        'product_id': product_id,
+        'category': pd.Categorical.from_codes(
+            product_category[product_id], CATEGORIES),
+        'country': pd.Categorical.from_codes(
+            rng.choice(len(COUNTRIES), n_rows, p=COUNTRY_WEIGHTS),
+            COUNTRIES),
+        'device': rng.choice(DEVICES, n_rows, p=DEVICE_WEIGHTS).astype(
+            object),
+        'condition': rng.choice(CONDITIONS, n_rows).astype(object),
+        'price': price,
+        'quantity': np.minimum(rng.geometric(0.7, n_rows), 9),
+        'discount': discount,
+        'ordered_at': ordered_at,
+        'shipped_at': shipped_at,
+        'shop': 'rebuy',
+    })
+
+
+def _popularity(rng, n_rows, n_ids):
+    """Ids in ``range(n_ids)``, the lower ones the more frequent"""
+    return (rng.pareto(1.2, n_rows) * n_ids / 50).astype(np.int64) % n_ids
@@ -1,3 +1,6 @@
+import math
+
+
 def _is_cols_subset_of_df_cols(cols, df):
     """Utility function checking if column(s) in `cols` is/are a subset of the
     the columns of `df`
@@ -30,3 +33,18 @@ def _is_cols_input_valid(cols):
             "to a column name")
     else:
         return True
+
+
+def _finite_population_correction(n, population_size):
+    """Utility function computing the factor by which the standard error of
+    a statistic shrinks when the sample of size `n` was drawn without
+    replacement from `population_size` rows. If `population_size` is `None`
+    the population is assumed to be infinite.
+    """
+    if population_size is None:
+        return 1.
+    if population_size < n:
+        raise ValueError("population_size is smaller than the sample")
+    if population_size <= 1:
+        return 0.
+    return math.sqrt((population_size - n) / (population_size - 1))
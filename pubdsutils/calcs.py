@@ -1,15 +1,21 @@
+import numpy as np
 import pandas as pd
+from pandas.api.types import is_numeric_dtype
+import pubdsutils as pdu
 
 
 def value_counts_comb(s, sort=True, ascending=False,
-                      bins=None, dropna=True):
+                      bins=None, dropna=True, weights=None):
     """
     A wrapper of value_counts which returns both the counts and the
     normalized view.
 
     The resulting object will be in descending order so that the
     first element is the most frequently-occurring element.
-    Excludes NA values by default.
+    Excludes NA values by default. The values are counted once (by
+    factorizing them, or by searching their bins), and the ratios are
+    derived from the counts. Ties are in the order of appearance (NaN
+    included), of the categories (NaN last), or of the bins.
 
     Parameters
     ----------
@@ -20,19 +26,718 @@ def value_counts_comb(s, sort=True, ascending=False,
         Sort by values
     ascending : boolean, default False
         Sort in ascending order
-    bins : integer, optional
+    bins : integer or array-like, optional
         Rather than count values, group them into half-open bins,
-        a convenience for pd.cut, only works with numeric data
+        a convenience for pd.cut, only works with numeric data. Either the
+        number of bins or the bin edges, e.g. as returned by
+        :func:`bin_edges` to bin several Series alike.
     dropna : boolean, default True
         Don't include counts of NaN.
+    weights : array-like, optional
+        Weights of the rows (of the same length as ``s``); ``Count`` is then
+        the sum of the weights of a value, and ``Ratio`` its share of the
+        total weight
 
     Returns
     -------
     counts : DataFrame
     """
-    res_norm = s.value_counts(sort=sort, ascending=ascending,
-                              normalize=True, bins=bins, dropna=dropna)
-    res_regu = s.value_counts(sort=sort, ascending=ascending,
-                              normalize=False, bins=bins, dropna=dropna)
-    result = pd.concat([res_norm, res_regu], axis=1, keys=['Ratio', 'Count'])
+    if weights is not None:
+        weights = np.asarray(weights, dtype=np.float64)
+        if len(weights) != len(s):
+            raise ValueError('weights must have the same length as s')
+    if bins is not None:
+        return _binned_counts(s, bins, dropna, weights, sort, ascending)
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        # As value_counts, all categories in their order, then NaN
+        counts, index = _column_counts(
+            s.cat.codes.values,
+            pd.CategoricalIndex(s.cat.categories, dtype=s.dtype), dropna,
+            weights, in_order=False)
+    else:
+        counts, index = _column_counts(*pd.factorize(s, sort=False),
+                                       dropna=dropna, weights=weights)
+    return _sorted_frame(counts, index, sort, ascending)
+
+
+def bin_edges(s, bins):
+    """
+    The edges of ``bins`` equal-width bins as used by pd.cut
+
+    The range of ``s`` is split into ``bins`` bins, the lowest edge lowered
+    by 0.1% of the range. The edges can be passed to
+    :func:`value_counts_comb` to bin other Series the same way.
+
+    Parameters
+    ----------
+    s : pandas.Series
+        Numeric data
+    bins : int
+        Number of bins
+
+    Returns
+    -------
+    numpy.ndarray
+    """
+    if bins < 1:
+        raise ValueError('bins should be a positive integer')
+    if not len(s):
+        raise ValueError('Cannot cut empty array')
+    mn, mx = float(np.nanmin(s.values)), float(np.nanmax(s.values))
+    if np.isinf(mn) or np.isinf(mx):
+        raise ValueError('Cannot compute bins when the data contains '
+                         'infinity')
+    if mn == mx:
+        mn -= 0.001 * abs(mn) if mn != 0 else 0.001
+        mx += 0.001 * abs(mx) if mx != 0 else 0.001
+        return np.linspace(mn, mx, bins + 1, endpoint=True)
+    edges = np.linspace(mn, mx, bins + 1, endpoint=True)
+    edges[0] -= (mx - mn) * 0.001
+    return edges
+
+
+def _binned_counts(s, bins, dropna, weights, sort, ascending):
+    """value_counts_comb of the values in right-closed bins"""
+    if not is_numeric_dtype(s) or isinstance(s.dtype, pd.CategoricalDtype):
+        raise TypeError('bins argument only works with numeric data.')
+    edges = bin_edges(s, bins) if np.ndim(bins) == 0 else np.asarray(bins)
+    if (np.diff(edges.astype(np.float64)) < 0).any():
+        raise ValueError('bins must increase monotonically.')
+    # The labels as formatted by pd.cut, including the lowest value
+    index = pd.IntervalIndex(pd.cut(pd.Series([], dtype=np.float64), edges,
+                                    include_lowest=True).cat.categories)
+
+    values = s.values.astype(np.float64)
+    ids = np.searchsorted(edges, values, side='left')
+    ids[values == edges[0]] = 1
+    valid = (ids > 0) & (ids < len(edges))
+    counts = np.bincount(ids[valid] - 1,
+                         None if weights is None else weights[valid],
+                         minlength=len(index))
+    if weights is None:
+        total = len(s)
+    else:
+        total = weights.sum()
+        counts = counts.astype(np.float64)
+    if dropna and not counts.any():
+        counts, index = counts[:0], index[:0]
+    # As value_counts(normalize=True), binned ratios are relative to all rows
+    return _sorted_frame(counts, index, sort, ascending, total)
+
+
+def value_counts_comb_df(df, cols=None, sort=True, ascending=False,
+                         dropna=True):
+    """
+    :func:`value_counts_comb` of several columns and column combinations
+
+    Every column is factorized once, also if it is part of several
+    combinations, and the combinations are counted on the integer codes.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+    cols : list (optional)
+        Columns, and tuples of columns to count the combinations of. If None,
+        all columns of ``df``.
+    sort : boolean, default True
+        Sort by counts, ties in the order of appearance
+    ascending : boolean, default False
+        Sort in ascending order
+    dropna : boolean, default True
+        Don't include counts of NaN, i.e. of combinations with a NaN
+
+    Returns
+    -------
+    dict
+        Maps each entry of ``cols`` (lists as tuples) to a DataFrame as
+        returned by :func:`value_counts_comb`, whose index is named after the
+        column(s); a MultiIndex for combinations. Unlike ``value_counts``,
+        unobserved categories of categorical columns are not listed.
+    """
+    if cols is None:
+        cols = list(df.columns)
+    factorized = {}
+    result = {}
+    for key in cols:
+        combo = list(key) if isinstance(key, (tuple, list)) else [key]
+        pdu._is_cols_subset_of_df_cols(combo, df)
+        for col in combo:
+            if col not in factorized:
+                factorized[col] = pd.factorize(df[col], sort=False)
+        if len(combo) == 1:
+            counts, index = _column_counts(*factorized[combo[0]], dropna)
+            index = index.rename(combo[0])
+        else:
+            counts, index = _combination_counts(
+                [factorized[col][0] for col in combo],
+                [factorized[col][1] for col in combo], combo, dropna)
+        result[tuple(key) if isinstance(key, list) else key] = \
+            _sorted_frame(counts, index, sort, ascending)
     return result
+
+
+def contingency_table(df, row, col, dropna=True, output='sparse',
+                      sort=True, ascending=False):
+    """
+    Joint counts of two columns, without densifying them as pd.crosstab
+
+    Both columns are factorized, the pairs of codes combined into a single
+    integer and counted; only the observed pairs are stored.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+    row : str
+        Column whose values are the rows of the table
+    col : str
+        Column whose values are the columns of the table
+    dropna : boolean, default True
+        Don't include counts of pairs with a NaN; otherwise NaN is the last
+        label
+    output : 'sparse' or 'frame' (default 'sparse')
+        Return a sparse matrix and its labels, or a long-format frame
+    sort : boolean, default True
+        With ``output='frame'``, sort by counts, ties in the order of
+        appearance
+    ascending : boolean, default False
+        With ``output='frame'``, sort in ascending order
+
+    Returns
+    -------
+    tuple or DataFrame
+        With ``output='sparse'``, a ``scipy.sparse.csr_matrix`` of counts
+        together with the sorted labels of its rows and of its columns (as
+        pandas.Index). With ``output='frame'``, the observed pairs as
+        returned by :func:`value_counts_comb_df` for ``(row, col)``.
+    """
+    pdu._is_cols_subset_of_df_cols([row, col], df)
+    if output not in ('sparse', 'frame'):
+        raise ValueError("output has to be 'sparse' or 'frame'")
+    codes, labels = [], []
+    for name in (row, col):
+        col_codes, uniques = pd.factorize(df[name], sort=True)
+        uniques = pd.Index(uniques, name=name)
+        if not dropna and (col_codes < 0).any():
+            col_codes = np.where(col_codes < 0, len(uniques), col_codes)
+            uniques = _take_labels(uniques,
+                                   np.r_[np.arange(len(uniques)), -1])
+        codes.append(col_codes)
+        labels.append(uniques)
+    if dropna:
+        valid = (codes[0] >= 0) & (codes[1] >= 0)
+        codes = [col_codes[valid] for col_codes in codes]
+
+    n_cols = len(labels[1])
+    group_codes, pairs = pd.factorize(codes[0].astype(np.int64) * n_cols +
+                                      codes[1])
+    counts = np.bincount(group_codes, minlength=len(pairs))
+    rows, cols = pairs // n_cols, pairs % n_cols
+
+    if output == 'frame':
+        index = pd.MultiIndex.from_arrays(
+            [labels[0].take(rows), labels[1].take(cols)], names=[row, col])
+        return _sorted_frame(counts, index, sort, ascending)
+    import scipy.sparse
+
+    matrix = scipy.sparse.coo_matrix(
+        (counts, (rows, cols)), shape=(len(labels[0]), n_cols)).tocsr()
+    return matrix, labels[0], labels[1]
+
+
+class ValueCountsAccumulator(object):
+    """
+    Exact value counts of a Series given in chunks
+
+    Every chunk is factorized and counted with ``np.bincount``, and the
+    counts are added up by value. Accumulators of different chunks, e.g.
+    from parallel workers, can be merged. They can be pickled, or converted
+    to a Series of counts (:meth:`to_series`) and back.
+
+    .. code-block:: python
+
+        counts = ValueCountsAccumulator()
+        for chunk in pd.read_sql(query, conn, chunksize=100000):
+            counts.update(chunk['country'])
+        counts.to_frame()  # as value_counts_comb(all rows)
+
+    Attributes
+    ----------
+    dropna : boolean, default True
+        Don't include counts of NaN in :meth:`to_frame`
+    n_rows : int
+        Number of rows counted, including NaN
+    """
+
+    def __init__(self, dropna=True):
+        self.dropna = dropna
+        self.n_rows = 0
+        # The values in order of appearance, and their counts
+        self._index = pd.Index([])
+        self._counts = np.zeros(0, dtype=np.int64)
+        self._n_nan = 0
+        # Number of values which appeared before NaN
+        self._nan_position = None
+
+    def update(self, chunk):
+        """
+        Count the values of a chunk
+
+        Parameters
+        ----------
+        chunk : pandas.Series or array-like
+
+        Returns
+        -------
+        self
+        """
+        codes, uniques = pd.factorize(chunk, sort=False)
+        counts = np.bincount(codes + 1, minlength=len(uniques) + 1)
+        self._add(pd.Index(uniques), counts[1:], counts[0],
+                  _nan_position(codes))
+        return self
+
+    def merge(self, other):
+        """
+        Add the counts of another accumulator
+
+        Parameters
+        ----------
+        other : ValueCountsAccumulator
+
+        Returns
+        -------
+        self
+        """
+        self._add(other._index, other._counts, other._n_nan,
+                  other._nan_position)
+        return self
+
+    def _add(self, index, counts, n_nan, nan_position=None):
+        self.n_rows += counts.sum() + n_nan
+        self._n_nan += n_nan
+        if not len(self._index):
+            if self._nan_position is None:
+                self._nan_position = nan_position
+            self._index, self._counts = index, counts.astype(np.int64)
+            return
+        positions = self._index.get_indexer(index)
+        known = positions >= 0
+        if self._nan_position is None and nan_position is not None:
+            # After the known values and the new ones before NaN
+            self._nan_position = len(self._index) + \
+                np.count_nonzero(~known[:nan_position])
+        self._counts[positions[known]] += counts[known]
+        if not known.all():
+            self._index = self._index.append(index[~known])
+            self._counts = np.concatenate([self._counts, counts[~known]])
+
+    def to_frame(self, sort=True, ascending=False):
+        """
+        The counts as returned by :func:`value_counts_comb`
+
+        Parameters
+        ----------
+        sort : boolean, default True
+            Sort by counts, ties in the order of appearance
+        ascending : boolean, default False
+            Sort in ascending order
+
+        Returns
+        -------
+        counts : DataFrame
+        """
+        counts, index = _with_nan(self._counts, self._n_nan, self._index,
+                                  self.dropna, self._nan_position)
+        return _sorted_frame(counts, index, sort, ascending)
+
+    def to_series(self):
+        """
+        The counts (of NaN too), indexed by the values
+
+        Returns
+        -------
+        pandas.Series
+        """
+        counts, index = _with_nan(self._counts, self._n_nan, self._index,
+                                  False, self._nan_position)
+        return pd.Series(counts, index=index, name='Count')
+
+    @classmethod
+    def from_series(cls, counts, dropna=True):
+        """
+        Accumulator of counts as returned by :meth:`to_series`
+
+        Parameters
+        ----------
+        counts : pandas.Series
+            Counts indexed by unique values
+        dropna : boolean, default True
+            See :class:`ValueCountsAccumulator`
+
+        Returns
+        -------
+        ValueCountsAccumulator
+        """
+        accumulator = cls(dropna)
+        is_nan = counts.index.isna()
+        accumulator._add(counts.index[~is_nan],
+                         counts.values[~is_nan].astype(np.int64),
+                         counts.values[is_nan].sum(),
+                         np.argmax(is_nan) if is_nan.any() else None)
+        return accumulator
+
+
+def _column_counts(codes, uniques, dropna, weights=None, in_order=True):
+    """
+    Counts (or summed weights) of factorized values, and their index; NaN at
+    its first appearance if the codes are in order of appearance, else last
+    """
+    counts = np.bincount(codes + 1, weights, minlength=len(uniques) + 1)
+    return _with_nan(counts[1:], counts[0], pd.Index(uniques), dropna,
+                     _nan_position(codes) if in_order else None)
+
+
+def _nan_position(codes):
+    """
+    Number of values before the first NaN (-1) of codes in order of
+    appearance, None without NaN
+    """
+    missing = codes < 0
+    if not missing.any():
+        return None
+    first = np.argmax(missing)
+    return int(codes[:first].max()) + 1 if first else 0
+
+
+def _with_nan(counts, n_nan, index, dropna, position=None):
+    """Insert the count of NaN at ``position`` (default last), if any"""
+    if dropna or n_nan == 0:
+        return counts, index
+    if position is None:
+        position = len(index)
+    return np.insert(counts, position, n_nan), _take_labels(
+        index, np.insert(np.arange(len(index)), position, -1))
+
+
+def _combination_counts(codes, uniques, names, dropna):
+    """Counts of combinations of factorized values, and their MultiIndex"""
+    if dropna:
+        valid = np.logical_and.reduce([col_codes >= 0 for col_codes in codes])
+        codes = [col_codes[valid] for col_codes in codes]
+
+    # Codes shifted by one such that NaN (-1) is 0, combined pairwise
+    group_codes = codes[0] + 1
+    for col_codes, col_uniques in zip(codes[1:], uniques[1:]):
+        group_codes, _ = pd.factorize(
+            group_codes * (len(col_uniques) + 1) + col_codes + 1)
+    counts = np.bincount(group_codes)
+
+    # The first row of every group, as codes are in order of appearance
+    seen = np.maximum.accumulate(group_codes)
+    first = np.flatnonzero(np.r_[True, seen[1:] > seen[:-1]]) \
+        if len(group_codes) else group_codes
+    labels = [_take_labels(col_uniques, col_codes[first])
+              for col_codes, col_uniques in zip(codes, uniques)]
+    return counts, pd.MultiIndex.from_arrays(labels, names=names)
+
+
+def _take_labels(uniques, codes):
+    """The labels of factorized codes, NaN for -1"""
+    uniques = pd.Index(uniques)
+    if (codes < 0).any():
+        return uniques.take(codes, allow_fill=True, fill_value=np.nan)
+    return uniques.take(codes)
+
+
+def _sorted_frame(counts, index, sort, ascending, total=None):
+    """Ratio/Count frame, stably sorted by the counts"""
+    if sort:
+        order = np.argsort(counts if ascending else -counts,
+                           kind='mergesort')
+        counts, index = counts[order], index[order]
+    return _ratio_count_frame(counts, index,
+                              counts.sum() if total is None else total)
+
+
+def _ratio_count_frame(counts, index, total):
+    """The Ratio and Count columns of :func:`value_counts_comb`"""
+    return pd.DataFrame({'Ratio': counts / total, 'Count': counts},
+                        index=index, columns=['Ratio', 'Count'])
+
+
+def _hashes(values):
+    """64-bit hashes of the non-NaN values, the same in every process"""
+    s = values if isinstance(values, pd.Series) else pd.Series(values)
+    return pd.util.hash_pandas_object(s.dropna(), index=False).values
+
+
+class HyperLogLog(object):
+    """
+    Approximate number of distinct values (as ``nunique``) in fixed memory
+
+    The values are hashed to 64 bits; the first ``p`` bits select one of
+    ``2 ** p`` registers, which keeps the maximal rank of the lowest set bit
+    among the remaining bits. The relative standard error of :meth:`count`
+    is ``1.04 / sqrt(2 ** p)``, e.g. 0.8% for the default ``p=14`` which
+    takes 16 kB. Small cardinalities are estimated by linear counting and are
+    nearly exact.
+
+    Sketches with the same ``p`` can be merged, e.g. from chunks processed
+    in parallel, and pickled. NaN is not counted.
+
+    Attributes
+    ----------
+    p : int (default 14)
+        Precision, between 4 and 18
+    registers : numpy.ndarray
+    """
+
+    def __init__(self, p=14):
+        if not 4 <= p <= 18:
+            raise ValueError('p has to be between 4 and 18')
+        self.p = p
+        self.registers = np.zeros(2 ** p, dtype=np.uint8)
+
+    @property
+    def relative_error(self):
+        """Relative standard error of :meth:`count`"""
+        return 1.04 / np.sqrt(len(self.registers))
+
+    def update(self, values):
+        """
+        Add values
+
+        Parameters
+        ----------
+        values : pandas.Series or array-like
+
+        Returns
+        -------
+        self
+        """
+        hashes = _hashes(values)
+        if not len(hashes):
+            return self
+        n_bits = 64 - self.p
+        index = (hashes >> np.uint64(n_bits)).astype(np.int64)
+        rest = hashes & np.uint64(2 ** n_bits - 1)
+        lowest = rest & (~rest + np.uint64(1))
+        ranks = np.where(
+            rest == 0, n_bits + 1,
+            np.log2(np.maximum(lowest, 1).astype(np.float64)) + 1
+        ).astype(np.uint8)
+        # Maximal rank per register, in place
+        np.maximum.at(self.registers, index, ranks)
+        return self
+
+    def merge(self, other):
+        """
+        Add the values of another sketch with the same ``p``
+
+        Returns
+        -------
+        self
+        """
+        if other.p != self.p:
+            raise ValueError('Only sketches with the same p can be merged')
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def count(self):
+        """
+        Estimated number of distinct values
+
+        Returns
+        -------
+        int
+        """
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(
+            np.exp2(-self.registers.astype(np.float64)))
+        zeros = np.count_nonzero(self.registers == 0)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * np.log(m / zeros)
+        return int(round(estimate))
+
+
+class CountMinSketch(object):
+    """
+    Approximate counts of values in fixed memory
+
+    ``depth`` rows of ``width`` counters; every value increments one counter
+    per row, chosen by a hash of the value. The count of a value is estimated
+    by the minimum of its counters, which is never smaller than the true
+    count, and larger by at most ``e / width * n_rows`` (0.07% of the rows
+    for the default width) with probability ``1 - exp(-depth)`` (99.3% for
+    the default depth).
+
+    Sketches with the same dimensions can be merged and pickled. NaN is not
+    counted.
+
+    Attributes
+    ----------
+    width : int (default 4096)
+    depth : int (default 5)
+    n_rows : int
+        Number of values counted
+    table : numpy.ndarray
+        The counters, of shape ``(depth, width)``
+    """
+
+    def __init__(self, width=4096, depth=5):
+        self.width = width
+        self.depth = depth
+        self.n_rows = 0
+        self.table = np.zeros((depth, width), dtype=np.int64)
+
+    def _columns(self, hashes):
+        """Counter of each hash per row, by double hashing"""
+        low = hashes & np.uint64(0xffffffff)
+        high = hashes >> np.uint64(32)
+        for row in range(self.depth):
+            yield ((low + np.uint64(row) * high) %
+                   np.uint64(self.width)).astype(np.int64)
+
+    def update(self, values):
+        """
+        Count values
+
+        Parameters
+        ----------
+        values : pandas.Series or array-like
+
+        Returns
+        -------
+        self
+        """
+        hashes = _hashes(values)
+        self.n_rows += len(hashes)
+        for row, columns in enumerate(self._columns(hashes)):
+            self.table[row] += np.bincount(columns, minlength=self.width)
+        return self
+
+    def merge(self, other):
+        """
+        Add the counts of another sketch with the same dimensions
+
+        Returns
+        -------
+        self
+        """
+        if (other.width, other.depth) != (self.width, self.depth):
+            raise ValueError('Only sketches with the same width and depth '
+                             'can be merged')
+        self.table += other.table
+        self.n_rows += other.n_rows
+        return self
+
+    def query(self, values):
+        """
+        Estimated counts
+
+        Parameters
+        ----------
+        values : array-like
+            Values to look up (not NaN)
+
+        Returns
+        -------
+        numpy.ndarray
+            Upper bounds of the counts of ``values``
+        """
+        hashes = _hashes(values)
+        return np.min([self.table[row, columns] for row, columns
+                       in enumerate(self._columns(hashes))], axis=0)
+
+
+class HeavyHitters(object):
+    """
+    The most frequent values in fixed memory (Misra-Gries summary)
+
+    At most ``k`` values are tracked. Every chunk is counted exactly and
+    added to the tracked counts; if more than ``k`` values result, the
+    ``k + 1``-th largest count is subtracted from all counts and only the
+    positive ones are kept. A tracked count underestimates the true count
+    by at most ``error``, which is bounded by ``n_rows / (k + 1)``; hence
+    every value more frequent than that is tracked.
+
+    Summaries can be merged (with the same guarantee) and pickled. NaN is
+    not counted.
+
+    Attributes
+    ----------
+    k : int (default 100)
+        Number of tracked values
+    n_rows : int
+        Number of values counted
+    error : int
+        Maximal underestimation of the tracked counts
+    """
+
+    def __init__(self, k=100):
+        self.k = k
+        self.n_rows = 0
+        self.error = 0
+        self._counts = pd.Series([], dtype=np.int64)
+
+    def update(self, values):
+        """
+        Count values
+
+        Parameters
+        ----------
+        values : pandas.Series or array-like
+
+        Returns
+        -------
+        self
+        """
+        counts, index = _column_counts(*pd.factorize(values, sort=False),
+                                       dropna=True)
+        self.n_rows += counts.sum()
+        self._add(pd.Series(counts, index=index))
+        return self
+
+    def merge(self, other):
+        """
+        Add the counts of another summary
+
+        Returns
+        -------
+        self
+        """
+        self.n_rows += other.n_rows
+        self.error += other.error
+        self._add(other._counts)
+        return self
+
+    def _add(self, counts):
+        counts = self._counts.add(counts, fill_value=0)
+        if len(counts) > self.k:
+            threshold = np.partition(counts.values, -self.k - 1)[-self.k - 1]
+            counts = counts[counts > threshold] - threshold
+            self.error += int(threshold)
+        self._counts = counts.astype(np.int64)
+
+    def to_frame(self, n=None):
+        """
+        The tracked values, as :func:`value_counts_comb`
+
+        Parameters
+        ----------
+        n : int (optional)
+            Number of most frequent values to return
+
+        Returns
+        -------
+        counts : DataFrame
+            Lower bounds of the counts, and the ratios of all rows; the true
+            counts are at most larger by ``error``
+        """
+        counts = self._counts.iloc[np.argsort(-self._counts.values,
+                                              kind='mergesort')]
+        if n is not None:
+            counts = counts.iloc[:n]
+        return _ratio_count_frame(counts.values, counts.index,
+                                  max(self.n_rows, 1))
@@ -1,7 +1,25 @@
+import os
+import sys
+import json
+import numbers
+import queue
+import sqlite3
+import asyncio
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+import numpy as np
 import pandas as pd
 from hashlib import sha256
-import pymssql
+from datetime import date, datetime
+from decimal import Decimal
 import configparser
+from pubdsutils.instrumentation import instrumented
+
+# Number of rows hashed at once by ``hash_df``; bounds the extra memory
+# needed for fingerprinting to one block of ``uint64`` per column.
+HASH_BLOCK_ROWS = 1000000
 
 
 def mssql_connector_from_ini(ini_file):
@@ -9,7 +27,8 @@ def mssql_connector_from_ini(ini_file):
     Prepare MSSQL connector using an INI file
 
     Read configurations from an INI file and construct a connector
-    to an MS SQL server.
+    to an MS SQL server. Requires ``pymssql`` (``pip install
+    pubdsutils[mssql]``).
 
     Following is an example of the config file as ``.ini``.
 
@@ -39,20 +58,109 @@ def mssql_connector_from_ini(ini_file):
     """
     config = configparser.ConfigParser()
     config.read(ini_file)
+    return _connect_mssql(config['Base'])
+
+
+def connector_from_ini(ini_file):
+    """
+    Connect to the database described by an INI file
+
+    The ``driver`` of the ``Base`` section selects the driver, by default
+    ``mssql`` (see :func:`mssql_connector_from_ini`). Further drivers are
+    added with :func:`register_driver`. ``sqlite`` connects to the file
+    ``database``:
+
+    .. code-block:: ini
+
+        [Base]
+        driver = sqlite
+        database = path/to/file.sqlite
+
+    Parameters
+    ----------
+    ini_file : str
+        Path to the INI file
+
+    Returns
+    -------
+    DB-API connection
+    """
+    config = configparser.ConfigParser()
+    config.read(ini_file)
+    section = config['Base']
+    return _get_driver(section.get('driver', 'mssql'))(section)
+
+
+def register_driver(name, connect):
+    """
+    Register a database driver for :func:`connector_from_ini`
+
+    Drivers can also be provided by other packages, as entry points of the
+    group ``pubdsutils.drivers`` named after the driver; these are loaded on
+    first use:
 
+    .. code-block:: python
+
+        setup(...,
+              entry_points={'pubdsutils.drivers': [
+                  'postgres = mypackage.drivers:connect_postgres']})
+
+    Parameters
+    ----------
+    name : str
+        Value of ``driver`` in the INI files
+    connect : callable
+        Function of the ``Base`` section of the INI file (a mapping of str)
+        returning a new DB-API connection; the driver module should be
+        imported within it, so that it is only required once used
+    """
+    _DRIVERS[name] = connect
+
+
+def _get_driver(name):
+    if name not in _DRIVERS:
+        for entry_point in _entry_points('pubdsutils.drivers'):
+            if entry_point.name == name:
+                register_driver(name, entry_point.load())
+    if name not in _DRIVERS:
+        raise ValueError("Unknown driver {!r}, register it with "
+                         "register_driver".format(name))
+    return _DRIVERS[name]
+
+
+def _entry_points(group):
+    """The installed entry points of ``group``"""
     try:
-        port = config['Base']['port']
-    except KeyError:
-        port = str(1433)
-
-    conn = pymssql.connect(
-        config['Base']['server'],
-        config['Base']['domain'] + '\\' + config['Base']['username'],
-        config['Base']['password'],
-        port=port)
-    return conn
+        from importlib.metadata import entry_points
+    except ImportError:  # Python < 3.8
+        from importlib_metadata import entry_points
+    entry_points = entry_points()
+    if hasattr(entry_points, 'select'):
+        return entry_points.select(group=group)
+    return entry_points.get(group, [])
+
+
+def _connect_mssql(section):
+    try:
+        import pymssql
+    except ImportError:
+        raise ImportError("The mssql driver requires pymssql, install it "
+                          "with pip install pubdsutils[mssql]")
+    return pymssql.connect(
+        section['server'],
+        section['domain'] + '\\' + section['username'],
+        section['password'],
+        port=section.get('port', str(1433)))
+
+
+def _connect_sqlite(section):
+    return sqlite3.connect(section['database'], check_same_thread=False)
 
 
+_DRIVERS = {'mssql': _connect_mssql, 'sqlite': _connect_sqlite}
+
+
+@instrumented
 def from_sql_sever(config_file, query=None):
     """
     Fetch data from MS SQL
@@ -84,11 +192,588 @@ def from_sql_sever(config_file, query=None):
     return df
 
 
-def persist_df(df, path=None, sql=None, prefix='raw_df'):
+class ConnectionPool(object):
+    """
+    Bounded pool of DB-API connections
+
+    Connections are created on demand, up to ``size`` at a time, and reused
+    once returned to the pool. A connection raising an error is closed
+    instead of being returned. The pool can be shared between threads;
+    the connections must then allow being used from a thread other than the
+    one which created them.
+
+    .. code-block:: python
+
+        with ConnectionPool('config.ini', size=4) as pool:
+            with pool.connection() as conn:
+                pd.read_sql(query, conn)
+
+    Attributes
+    ----------
+    connect : str or callable
+        Either the path of a configuration file as used by
+        :func:`~pubdsutils.data_fetch.connector_from_ini` or a function
+        without arguments returning a new DB-API connection
+    size : int (default 4)
+        Maximal number of connections
     """
-    Pickles a DataFrame and assigns hash to the filename
 
-    Optionally, can also include the related SQL query
+    def __init__(self, connect, size=4):
+        self.connect = connect
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _new_connection(self):
+        if isinstance(self.connect, str):
+            return connector_from_ini(self.connect)
+        return self.connect()
+
+    @contextmanager
+    def connection(self):
+        """Context manager lending a connection of the pool"""
+        self._slots.acquire()
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self._new_connection()
+            try:
+                yield conn
+            except BaseException:
+                conn.close()
+                raise
+            self._idle.put(conn)
+        finally:
+            self._slots.release()
+
+    def read_sql(self, query, **kwargs):
+        """``pandas.read_sql`` using a connection of the pool"""
+        with self.connection() as conn:
+            return pd.read_sql(query, conn, **kwargs)
+
+    def close(self):
+        """Close the idle connections"""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+async def fetch_as_completed(queries, pool, max_concurrency=None):
+    """
+    Run several queries concurrently and yield the results as they complete
+
+    The blocking DB-API calls are executed in a thread pool; at most
+    ``max_concurrency`` queries are running at the same time. The total
+    wall time hence approaches the one of the slowest query rather than the
+    sum of all.
+
+    .. code-block:: python
+
+        async for key, df in fetch_as_completed(queries, pool):
+            ...
+
+    Parameters
+    ----------
+    queries : dict or list
+        Valid SQL queries as strings. For a list, the keys are the positions
+        of the queries.
+    pool : ConnectionPool
+        Pool providing the connections
+    max_concurrency : int (optional)
+        Maximal number of concurrent queries. Defaults to the size of the
+        pool.
+
+    Yields
+    ------
+    tuple
+        Key of the query and the resulting ``pandas.DataFrame``
+    """
+    if not isinstance(queries, dict):
+        queries = dict(enumerate(queries))
+    if max_concurrency is None:
+        max_concurrency = pool.size
+    loop = asyncio.get_event_loop()
+    semaphore = asyncio.Semaphore(max_concurrency)
+    executor = ThreadPoolExecutor(max_concurrency)
+
+    async def fetch(key, query):
+        async with semaphore:
+            df = await loop.run_in_executor(executor, pool.read_sql, query)
+        return key, df
+
+    tasks = [asyncio.ensure_future(fetch(key, query))
+             for key, query in queries.items()]
+    try:
+        for task in asyncio.as_completed(tasks):
+            yield await task
+    finally:
+        for task in tasks:
+            task.cancel()
+        executor.shutdown(wait=False)
+
+
+def fetch_many(queries, connect, max_concurrency=4):
+    """
+    Run several queries concurrently and return all results
+
+    Blocking counterpart of :func:`fetch_as_completed`, for use outside of
+    an event loop.
+
+    Parameters
+    ----------
+    queries : dict or list
+        Valid SQL queries as strings
+    connect : ConnectionPool, str or callable
+        Pool to use, or the argument to create a :class:`ConnectionPool`
+        of size ``max_concurrency`` from
+    max_concurrency : int (default 4)
+        Maximal number of concurrent queries
+
+    Returns
+    -------
+    dict or list
+        The resulting DataFrames, keyed like ``queries``
+    """
+    if isinstance(connect, ConnectionPool):
+        pool = connect
+    else:
+        pool = ConnectionPool(connect, size=max_concurrency)
+    keys = list(queries.keys()) if isinstance(queries, dict) else \
+        list(range(len(queries)))
+
+    async def collect():
+        return {key: df async for key, df in
+                fetch_as_completed(queries, pool, max_concurrency)}
+
+    loop = asyncio.new_event_loop()
+    try:
+        results = loop.run_until_complete(collect())
+    finally:
+        loop.close()
+        if pool is not connect:
+            pool.close()
+    if isinstance(queries, dict):
+        return {key: results[key] for key in keys}
+    return [results[key] for key in keys]
+
+
+# SQL differing between the supported databases. The dialect is deduced from
+# the module of the DB-API driver; drivers not listed use ``ansi``.
+_SQL_DIALECTS = {
+    'mssql': {
+        'quote': '[{}]',
+        'create_empty_copy': 'SELECT * INTO {new} FROM {table} WHERE 1 = 0',
+    },
+    'ansi': {
+        'quote': '"{}"',
+        'create_empty_copy':
+            'CREATE TABLE {new} AS SELECT * FROM {table} WHERE 1 = 0',
+    },
+}
+_SQL_DIALECTS['mssql']['sample'] = \
+    'ABS(CHECKSUM(NEWID())) % 1000000 < {threshold}'
+_SQL_DIALECTS['sqlite'] = dict(
+    _SQL_DIALECTS['ansi'], sample='ABS(RANDOM() % 1000000) < {threshold}')
+_DRIVER_DIALECTS = {'pymssql': 'mssql', 'sqlite3': 'sqlite'}
+_PLACEHOLDERS = {'qmark': '?', 'format': '%s', 'pyformat': '%s'}
+
+
+def bulk_insert(df, connect, table, batch_size=10000, n_jobs=1,
+                staging_table=None, replace=False):
+    """
+    Write a DataFrame to a database table in batches
+
+    The rows are sent using parameterized ``executemany`` calls of
+    ``batch_size`` rows each. With ``n_jobs > 1`` the batches are distributed
+    over several connections which insert in parallel.
+
+    If ``staging_table`` is given, the rows are first loaded into this
+    (newly created) table, having the same columns as ``table``. Only once
+    all rows are loaded, they are copied to ``table`` with a single
+    ``INSERT ... SELECT`` in one transaction and the staging table is
+    dropped. Therefore, a failed load leaves ``table`` untouched, at the
+    cost of writing every row twice. Without staging, every batch is
+    committed on its own.
+
+    Works with any DB-API driver using the ``qmark``, ``format`` or
+    ``pyformat`` parameter style (e.g. ``pymssql`` or ``sqlite3``).
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        Rows to write; column names have to match those of ``table``. The
+        index is not written.
+    connect : str or callable
+        Either the path of a configuration file as used by
+        :func:`~pubdsutils.data_fetch.connector_from_ini` or a function
+        without arguments returning a new DB-API connection
+    table : str
+        Name of the (existing) target table
+    batch_size : int (default 10000)
+        Number of rows per ``executemany`` call
+    n_jobs : int (default 1)
+        Number of connections inserting in parallel
+    staging_table : str (optional)
+        Name of the staging table. It must not exist.
+    replace : boolean, default False
+        If True, the rows already in ``table`` are deleted
+
+    Returns
+    -------
+    int
+        Number of inserted rows
+    """
+    if isinstance(connect, str):
+        config_file = connect
+
+        def connect():
+            return connector_from_ini(config_file)
+
+    conn = connect()
+    try:
+        dialect = _SQL_DIALECTS[_dialect(conn)]
+        target = table
+        if staging_table is not None:
+            _execute(conn, dialect['create_empty_copy'].format(
+                new=staging_table, table=table))
+            target = staging_table
+        elif replace:
+            _execute(conn, "DELETE FROM {}".format(table))
+
+        insert = "INSERT INTO {} ({}) VALUES ({})".format(
+            target,
+            ', '.join(dialect['quote'].format(col) for col in df.columns),
+            ', '.join([_PLACEHOLDERS[_paramstyle(conn)]] * df.shape[1]))
+        starts = range(0, len(df), batch_size)
+        try:
+            if n_jobs == 1:
+                _insert_batches(conn, insert, df, starts, batch_size)
+            else:
+                with ThreadPoolExecutor(n_jobs) as executor:
+                    futures = [
+                        executor.submit(_insert_batches, None, insert, df,
+                                        starts[i::n_jobs], batch_size,
+                                        connect)
+                        for i in range(n_jobs)]
+                    for future in futures:
+                        future.result()
+        except BaseException:
+            if staging_table is not None:
+                _execute(conn, "DROP TABLE {}".format(staging_table))
+            raise
+
+        if staging_table is not None:
+            cursor = conn.cursor()
+            if replace:
+                cursor.execute("DELETE FROM {}".format(table))
+            cursor.execute("INSERT INTO {} SELECT * FROM {}".format(
+                table, staging_table))
+            cursor.execute("DROP TABLE {}".format(staging_table))
+            conn.commit()
+    finally:
+        conn.close()
+    return len(df)
+
+
+def _insert_batches(conn, insert, df, starts, batch_size, connect=None):
+    """Insert the batches of ``df`` starting at ``starts``"""
+    own_conn = conn is None
+    if own_conn:
+        conn = connect()
+    try:
+        cursor = conn.cursor()
+        for start in starts:
+            cursor.executemany(
+                insert, _db_records(df.iloc[start:start + batch_size]))
+            conn.commit()
+    finally:
+        if own_conn:
+            conn.close()
+
+
+def _db_records(df):
+    """Rows of ``df`` as tuples of Python objects; missing values are None"""
+    columns = []
+    for col in range(df.shape[1]):
+        s = df.iloc[:, col]
+        if pd.api.types.is_datetime64_any_dtype(s):
+            # A copy, as recent pandas return a read-only view of a Series
+            values = np.array(s.dt.to_pydatetime(), dtype=object)
+        else:
+            values = s.values.astype(object)
+        values[s.isnull().values] = None
+        columns.append(values)
+    return list(zip(*columns))
+
+
+def _execute(conn, sql):
+    conn.cursor().execute(sql)
+    conn.commit()
+
+
+def _driver(conn):
+    """Top level module of the DB-API driver of ``conn``"""
+    return sys.modules[type(conn).__module__.split('.')[0]]
+
+
+def _dialect(conn):
+    return _DRIVER_DIALECTS.get(_driver(conn).__name__, 'ansi')
+
+
+def _paramstyle(conn):
+    paramstyle = getattr(_driver(conn), 'paramstyle', 'qmark')
+    if paramstyle not in _PLACEHOLDERS:
+        raise ValueError(
+            "Unsupported parameter style ({})".format(paramstyle))
+    return paramstyle
+
+
+def fetch_sample(conn, query, n=None, frac=None, method='reservoir',
+                 server_frac=None, chunksize=100000, random_state=None,
+                 **kwargs):
+    """
+    Fetch a uniform random sample of the result of a query
+
+    The result set is streamed in chunks of ``chunksize`` rows and sampled
+    on the fly, hence memory is bounded by the size of the sample and of a
+    chunk:
+
+    - ``reservoir``: exactly ``n`` rows (or all rows, if there are fewer)
+      drawn without replacement
+    - ``bernoulli``: every row is kept with probability ``frac``; the size of
+      the sample is random
+
+    With ``server_frac``, the database already discards rows at random
+    (each row is kept with probability ``server_frac``) so that fewer rows
+    are transferred. Supported for MS SQL and SQLite.
+
+    Parameters
+    ----------
+    conn : str or connection
+        Either the path of a configuration file as used by
+        :func:`~pubdsutils.data_fetch.connector_from_ini` or a DB-API
+        connection
+    query : str
+        valid SQL query as a string
+    n : int (optional)
+        Size of the sample for ``reservoir``
+    frac : float (optional)
+        Sampling probability for ``bernoulli``
+    method : str (default ``reservoir``)
+        Either ``reservoir`` or ``bernoulli``
+    server_frac : float (optional)
+        Sampling probability applied by the database
+    chunksize : int (default 100000)
+        Number of rows fetched per batch
+    random_state : int or numpy.random.RandomState (optional)
+        Seed of the client side sampling
+    **kwargs :
+        passed to pandas.read_sql()
+
+    Returns
+    -------
+    pandas.DataFrame
+    """
+    if method == 'reservoir' and n is None:
+        raise ValueError("n must be provided for reservoir sampling")
+    elif method == 'bernoulli' and frac is None:
+        raise ValueError("frac must be provided for bernoulli sampling")
+    elif method not in ('reservoir', 'bernoulli'):
+        raise ValueError(
+            "Unsupported method ({}). Can be either reservoir or "
+            "bernoulli".format(method))
+    if not isinstance(random_state, np.random.RandomState):
+        random_state = np.random.RandomState(random_state)
+
+    with _closing_connection(conn) as conn:
+        if server_frac is not None:
+            dialect = _SQL_DIALECTS[_dialect(conn)]
+            if 'sample' not in dialect:
+                raise ValueError("Server side sampling is not supported")
+            query = "SELECT * FROM ({}) AS base WHERE {}".format(
+                query, dialect['sample'].format(
+                    threshold=int(round(server_frac * 1000000))))
+
+        chunks = _non_empty(pd.read_sql(query, conn, chunksize=chunksize,
+                                        **kwargs),
+                            lambda: pd.read_sql(query, conn, **kwargs))
+        if method == 'bernoulli':
+            return pd.concat(
+                [chunk[random_state.random_sample(len(chunk)) < frac]
+                 for chunk in chunks], ignore_index=True)
+
+        # Reservoir sampling: the rows having the n smallest of uniformly
+        # distributed random keys are a uniform sample of size n
+        sample, keys = None, np.array([])
+        for chunk in chunks:
+            sample = chunk if sample is None else pd.concat([sample, chunk])
+            keys = np.concatenate(
+                [keys, random_state.random_sample(len(chunk))])
+            if len(keys) > n:
+                keep = np.sort(np.argpartition(keys, n)[:n])
+                sample, keys = sample.iloc[keep], keys[keep]
+        return sample.reset_index(drop=True)
+
+
+class _FrameHasher(object):
+    """
+    Incremental content fingerprint of a DataFrame
+
+    The frame can be fed in consecutive row chunks using :meth:`update`; the
+    digest only depends on the concatenated content and not on the way it
+    was chunked. Every column (and the index) is hashed separately using
+    ``pandas.util.hash_pandas_object`` and the per-column digests are
+    combined with the schema (column names and dtypes) of the first chunk.
+    """
+
+    def __init__(self, block_rows=HASH_BLOCK_ROWS):
+        self.block_rows = block_rows
+        self.n_rows = 0
+        self._schema = None
+        self._hashers = None
+
+    def update(self, df):
+        schema = _frame_schema(df)
+        if self._schema is None:
+            self._schema = schema
+            self._hashers = [sha256() for _ in range(df.shape[1] + 1)]
+        elif [col for col, _ in schema['columns']] != \
+                [col for col, _ in self._schema['columns']]:
+            raise ValueError("All chunks must have the same columns")
+
+        for start in range(0, len(df), self.block_rows):
+            stop = start + self.block_rows
+            self._hashers[0].update(_value_hashes(df.index[start:stop]))
+            for i in range(df.shape[1]):
+                self._hashers[i + 1].update(
+                    _value_hashes(df.iloc[start:stop, i]))
+        self.n_rows += len(df)
+        return self
+
+    def hexdigest(self):
+        if self._schema is None:
+            raise ValueError("Nothing was hashed")
+        digest = sha256(json.dumps(self._schema).encode())
+        for hasher in self._hashers:
+            digest.update(hasher.digest())
+        return digest.hexdigest()
+
+
+def _value_hashes(values):
+    """
+    ``hash_pandas_object`` of a Series or an Index, without the index
+
+    Object values are hashed by their ``str``, hence the hash of the kind of
+    each value (see :func:`_type_kind`) is mixed in, such that e.g. ``1``
+    and ``'1'`` differ. Missing values are of one kind. Columns of strings
+    are hashed once per distinct value; the ``str`` and the kind of other
+    values are computed value by value.
+    """
+    if values.dtype != object:
+        return pd.util.hash_pandas_object(values, index=False).values
+    values = np.asarray(values, dtype=object)
+    codes, uniques = pd.factorize(values)
+    missing = codes < 0
+    if pd.api.types.infer_dtype(uniques, skipna=True) in ('string', 'empty'):
+        hashes = np.full(len(values), _NULL_HASH, dtype=np.uint64)
+        hashes[~missing] = pd.util.hash_array(
+            np.asarray(uniques, dtype=object),
+            categorize=False)[codes[~missing]]
+        kinds = np.where(missing, _kind_hash('null'), _kind_hash('str'))
+    else:
+        # Not by the distinct values, as e.g. 1 and True are equal
+        type_codes, types = pd.factorize(
+            np.array([type(value) for value in values], dtype=object))
+        kinds = np.array([_kind_hash(_type_kind(cls)) for cls in types],
+                         dtype=np.uint64)[type_codes]
+        kinds[missing] = _kind_hash('null')
+        hashes = pd.util.hash_array(values.astype(str).astype(object),
+                                    categorize=False)
+        hashes[missing] = _NULL_HASH
+    return hashes * np.uint64(31) + kinds
+
+
+# Hash of missing values by ``hash_array``
+_NULL_HASH = np.iinfo(np.uint64).max
+
+
+def _type_kind(cls):
+    """Name of a type, the same for Python and numpy scalars"""
+    if issubclass(cls, str):
+        return 'str'
+    if issubclass(cls, bytes):
+        return 'bytes'
+    if issubclass(cls, (bool, np.bool_)):
+        return 'bool'
+    if issubclass(cls, numbers.Integral):
+        return 'int'
+    if issubclass(cls, (float, np.floating)):
+        return 'float'
+    return cls.__name__
+
+
+def _kind_hash(kind):
+    return pd.util.hash_array(np.array([kind], dtype=object))[0]
+
+
+def _frame_schema(df):
+    """Column names and dtypes of ``df`` as a JSON serializable dict"""
+    return {
+        'columns': [
+            [str(col), str(dtype)] for col, dtype in df.dtypes.items()],
+        'index': str(df.index.dtype),
+    }
+
+
+def hash_df(df):
+    """
+    Content fingerprint of a DataFrame
+
+    A SHA-256 digest over the schema and the values of ``df`` (including the
+    index). Two frames get the same digest if they have the same column
+    names, dtypes and index dtype, and equal values in each column and the
+    index, where values of object columns are equal if they have the same
+    type and ``str`` (e.g. ``1`` and ``'1'`` differ, ``1`` and
+    ``numpy.int64(1)`` don't) and all missing values (``None``, ``NaN``) are
+    equal. Columns are hashed in blocks of ``HASH_BLOCK_ROWS`` rows, hence
+    the extra memory is bounded and, unlike hashing ``df.to_json()``, does not
+    grow with the size of the frame.
+
+    The digest is stable across runs and processes (``hash_pandas_object``
+    uses a fixed key), but may change between pandas versions.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        Frame to fingerprint
+
+    Returns
+    -------
+    str
+        Hexadecimal digest
+    """
+    return _FrameHasher().update(df).hexdigest()
+
+
+@instrumented
+def persist_df(df, path=None, sql=None, prefix='raw_df', fmt='pickle',
+               compression=None, row_group_size=None, catalog=None,
+               meta=None):
+    """
+    Persists a DataFrame and assigns hash to the filename
+
+    The hash is computed by :func:`hash_df`.
+    Optionally, can also include the related SQL query.
+    Use :func:`load_df` to read the file back.
 
     Parameters
     ----------
@@ -100,15 +785,1185 @@ def persist_df(df, path=None, sql=None, prefix='raw_df'):
         be stored alongside the pickle.
     prefix : str (default ``raw_df``)
         Prefix of pickels
+    fmt : str (default ``pickle``)
+        One of ``pickle``, ``parquet`` or ``feather`` (Arrow IPC).
+        The columnar formats require ``pyarrow``.
+    compression : str (optional)
+        Compression codec. For ``pickle`` one of ``gzip``, ``bz2``, ``xz``
+        or ``zip``; for ``parquet`` any codec supported by pyarrow (defaults
+        to ``snappy``); for ``feather`` either ``lz4`` or ``zstd``.
+        Uncompressed feather files can be memory-mapped by :func:`load_df`.
+    row_group_size : int (optional)
+        Number of rows per row group (``parquet``) or record batch
+        (``feather``). Row groups can be loaded selectively.
+    catalog : SnapshotCatalog (optional)
+        If provided, the snapshot is registered in the catalog. If a snapshot
+        with the same hash is already registered, nothing is written: its
+        file is registered again with ``sql``, ``prefix`` and ``meta``, and
+        its filename is returned.
+    meta : dict (optional)
+        Further JSON serializable metadata stored in ``catalog``
+
+    Returns
+    -------
+    str
+        Filename of the persisted DataFrame
+    """
+    df_hash = hash_df(df)
+    if catalog is not None:
+        existing = catalog.by_hash(df_hash)
+        if existing is not None:
+            return _register_alias(catalog, existing, prefix, sql, meta)
+    created_at = datetime.now()
+    base_filename = _base_filename(path, prefix, created_at, df_hash)
+    filename = base_filename + _persist_extension(fmt, compression)
+    _write_df(df, filename, fmt, compression, row_group_size)
+    _register_snapshot(filename, base_filename, df_hash, prefix, sql,
+                       _frame_schema(df), len(df), created_at, catalog, meta)
+    return filename
+
+
+class BackgroundPersister(object):
     """
-    df_hash = sha256(df.to_json().encode()).hexdigest()
+    Persist DataFrames off the critical path
+
+    Hashing and writing (see :func:`persist_df`) are carried out by a
+    background thread, so that the calling pipeline only pays for handing
+    the DataFrame over. :meth:`submit` returns a future holding the final
+    filename. At most ``max_backlog`` DataFrames wait to be written at any
+    time; further submissions block until a write completes, bounding the
+    memory held by pending snapshots.
+
+    .. code-block:: python
+
+        with BackgroundPersister(path='snapshots/', fmt='parquet') as writer:
+            future = writer.submit(df, sql=query)
+            ...  # continue working with df
+        future.result()  # filename
+
+    Attributes
+    ----------
+    max_backlog : int (default 2)
+        Maximal number of DataFrames submitted but not yet written
+    copy : boolean, default True
+        Submit a (deep) copy of the DataFrame, such that the caller can keep
+        modifying it. If False, the DataFrame is handed off and must not be
+        modified until written.
+    **persist_kwargs :
+        Default arguments of :func:`persist_df`
+    """
+
+    def __init__(self, max_backlog=2, copy=True, **persist_kwargs):
+        self.max_backlog = max_backlog
+        self.copy = copy
+        self.persist_kwargs = persist_kwargs
+        self._executor = ThreadPoolExecutor(1)
+        self._backlog = threading.BoundedSemaphore(max_backlog)
+        self._lock = threading.Lock()
+        self._submitted = []
+
+    def submit(self, df, **kwargs):
+        """
+        Schedule persisting ``df``
+
+        Parameters
+        ----------
+        df : pandas.DataFrame
+            DataFrame to persist
+        **kwargs :
+            passed to :func:`persist_df`, overriding the defaults
+
+        Returns
+        -------
+        concurrent.futures.Future
+            Resolves to the filename of the persisted DataFrame
+        """
+        self._backlog.acquire()
+        try:
+            if self.copy:
+                df = df.copy()
+            future = self._executor.submit(
+                persist_df, df, **dict(self.persist_kwargs, **kwargs))
+        except BaseException:
+            self._backlog.release()
+            raise
+        with self._lock:
+            self._submitted.append(future)
+        future.add_done_callback(lambda _: self._backlog.release())
+        return future
+
+    def flush(self):
+        """
+        Wait until all submitted DataFrames are written
+
+        Returns
+        -------
+        list
+            Filenames of the DataFrames submitted since the last flush. If a
+            write failed, its exception is raised.
+        """
+        with self._lock:
+            submitted, self._submitted = self._submitted, []
+        wait(submitted)
+        return [future.result() for future in submitted]
+
+    def close(self):
+        """Flush and stop the background thread"""
+        try:
+            self.flush()
+        finally:
+            self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _base_filename(path, prefix, created_at, df_hash):
+    """Filename of a snapshot without the extension"""
     base_filename = '{}_{}_{}'.format(
         prefix,
-        pd.datetime.now().isoformat().replace(":", "-").replace(".", "-"),
+        created_at.isoformat().replace(":", "-").replace(".", "-"),
         df_hash)
     if path is not None:
         base_filename = path + base_filename
-    df.to_pickle(base_filename + '.pickle')
+    return base_filename
+
+
+def _register_snapshot(filename, base_filename, df_hash, prefix, sql, schema,
+                       n_rows, created_at, catalog, meta=None):
+    """Write the SQL file of a snapshot and record it in the catalog"""
     if sql is not None:
         with open(base_filename + ".sql", "w") as sql_file:
             print(sql, file=sql_file)
+    if catalog is not None:
+        catalog.register(filename, df_hash, prefix=prefix, sql=sql,
+                         schema=schema, n_rows=n_rows, created_at=created_at,
+                         meta=meta)
+
+
+def _register_alias(catalog, existing, prefix, sql, meta=None):
+    """
+    Register the file of an identical snapshot for ``sql`` and ``prefix``;
+    returns its filename
+    """
+    catalog.register(existing['filename'], existing['hash'], prefix=prefix,
+                     sql=sql, schema=existing['schema'],
+                     n_rows=existing['n_rows'], meta=meta)
+    return existing['filename']
+
+
+_PICKLE_COMPRESSION_EXT = {'gzip': '.gz', 'bz2': '.bz2', 'xz': '.xz',
+                           'zip': '.zip'}
+
+
+def _persist_extension(fmt, compression):
+    """File extension of a persisted DataFrame"""
+    if fmt == 'pickle':
+        if compression is None:
+            return '.pickle'
+        if compression not in _PICKLE_COMPRESSION_EXT:
+            raise ValueError(
+                "Unsupported compression for pickle ({})".format(compression))
+        return '.pickle' + _PICKLE_COMPRESSION_EXT[compression]
+    elif fmt in ('parquet', 'feather'):
+        return '.' + fmt
+    raise ValueError(
+        "Unsupported format ({}). Can be either pickle, parquet or "
+        "feather".format(fmt))
+
+
+def _write_df(df, filename, fmt, compression, row_group_size):
+    if fmt == 'pickle':
+        df.to_pickle(filename, compression=compression)
+        return
+
+    import pyarrow as pa
+
+    table = pa.Table.from_pandas(df)
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+        pq.write_table(table, filename, row_group_size=row_group_size,
+                       compression=compression or 'snappy')
+    else:
+        import pyarrow.feather as feather
+        feather.write_feather(table, filename,
+                              compression=compression or 'uncompressed',
+                              chunksize=row_group_size)
+
+
+def load_df(filename, columns=None, row_groups=None, memory_map=True):
+    """
+    Loads a DataFrame persisted by :func:`persist_df`
+
+    The format is deduced from the extension of ``filename``.
+    For the columnar formats only the requested columns and row groups are
+    read from disk. The index of the DataFrame is always restored.
+
+    Parameters
+    ----------
+    filename : str
+        File written by :func:`persist_df`
+    columns : list (optional)
+        Columns to load. If ``None``, all the columns are loaded.
+    row_groups : list (optional)
+        Indices of the row groups (``parquet``) or record batches
+        (``feather``) to load. Not supported for pickles.
+    memory_map : boolean, default True
+        Memory-map the file instead of reading it. Uncompressed feather files
+        are then loaded with (nearly) no copying.
+
+    Returns
+    -------
+    pandas.DataFrame
+    """
+    if '.pickle' in os.path.basename(filename):
+        if row_groups is not None:
+            raise ValueError("Row groups are not supported for pickles")
+        df = pd.read_pickle(filename)
+        if columns is not None:
+            df = df[columns]
+        return df
+
+    import pyarrow as pa
+
+    if filename.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        parquet_file = pq.ParquetFile(filename, memory_map=memory_map)
+        if row_groups is None:
+            table = parquet_file.read(columns=columns,
+                                      use_pandas_metadata=True)
+        else:
+            table = parquet_file.read_row_groups(
+                row_groups, columns=columns, use_pandas_metadata=True)
+            sizes = [parquet_file.metadata.row_group(i).num_rows
+                     for i in range(parquet_file.num_row_groups)]
+            return _restore_range_index(
+                table.to_pandas(), parquet_file.schema_arrow, sizes,
+                row_groups)
+        return table.to_pandas()
+    elif filename.endswith('.feather'):
+        source = pa.memory_map(filename) if memory_map else pa.OSFile(filename)
+        reader = pa.ipc.open_file(source)
+        if row_groups is None:
+            table = reader.read_all()
+        else:
+            table = pa.Table.from_batches(
+                [reader.get_batch(i) for i in row_groups],
+                schema=reader.schema)
+        if columns is not None:
+            table = table.select(list(columns) + [
+                col for col in _arrow_index_columns(table.schema)
+                if col not in columns])
+        df = table.to_pandas(split_blocks=True)
+        if row_groups is not None:
+            sizes = [reader.get_batch(i).num_rows
+                     for i in range(reader.num_record_batches)]
+            df = _restore_range_index(df, reader.schema, sizes, row_groups)
+        return df
+    raise ValueError("Unknown format of {}".format(filename))
+
+
+def _arrow_index_columns(schema):
+    """Names of the columns holding the pandas index of an Arrow table"""
+    if schema.pandas_metadata is None:
+        return []
+    return [col for col in schema.pandas_metadata['index_columns']
+            if isinstance(col, str)]
+
+
+def _restore_range_index(df, schema, sizes, row_groups):
+    """
+    Re-label rows loaded from a subset of row groups
+
+    A ``RangeIndex`` is stored as metadata only, hence pyarrow numbers the
+    rows of a partial read from 0. Use the sizes of the row groups to assign
+    the labels the rows had in the persisted frame.
+    """
+    metadata = schema.pandas_metadata
+    if metadata is None or len(metadata['index_columns']) != 1:
+        return df
+    index = metadata['index_columns'][0]
+    if isinstance(index, str) or index['kind'] != 'range':
+        return df
+    offsets = np.cumsum([0] + sizes)
+    positions = np.concatenate(
+        [np.arange(offsets[i], offsets[i + 1]) for i in row_groups] or
+        [np.array([], dtype=np.int64)])
+    labels = index['start'] + positions * index['step']
+    df.index = pd.Index(labels, name=index['name'])
+    return df
+
+
+def fetch_incremental(conn, query, watermark_col, catalog, key=None,
+                      path=None, prefix='raw_df', fmt='pickle',
+                      compression=None, **kwargs):
+    """
+    Fetch only the rows added since the last snapshot of a query
+
+    The latest snapshot of ``query`` is looked up in ``catalog``. Its
+    metadata holds the watermark, that is, the largest value of
+    ``watermark_col`` (a timestamp or a monotonic ID) fetched so far. Only
+    rows beyond the watermark are queried; they are appended to the
+    snapshot (or, if ``key`` is given, upserted) and the result is
+    persisted using :func:`persist_df` with the new watermark. Without a
+    previous snapshot, the complete result of ``query`` is fetched.
+
+    With ``key``, rows having a watermark equal to the stored one are fetched
+    again, so rows committed after the previous fetch with the same
+    timestamp are not missed.
+
+    Parameters
+    ----------
+    conn : str or connection
+        Either the path of a configuration file as used by
+        :func:`~pubdsutils.data_fetch.connector_from_ini` or a DB-API
+        connection
+    query : str
+        valid SQL query as a string. It is wrapped as a sub-query, hence it
+        must not contain an ``ORDER BY`` clause for MS SQL.
+    watermark_col : str
+        Column of the result which only grows for new or updated rows, of
+        numbers, strings, timestamps, dates, decimals or bytes
+    catalog : SnapshotCatalog
+        Catalog of the snapshots
+    key : list (optional)
+        Columns identifying a row. If given, fetched rows replace the rows
+        of the snapshot having the same key.
+    path, prefix, fmt, compression :
+        Passed to :func:`persist_df`
+    **kwargs :
+        passed to pandas.read_sql()
+
+    Returns
+    -------
+    str
+        Filename of the snapshot
+    """
+    with _closing_connection(conn) as conn:
+        latest = catalog.latest(sql=query)
+        if latest is None or latest['meta'] is None or \
+                latest['meta'].get('watermark_col') != watermark_col:
+            df = pd.read_sql(query, conn, **kwargs)
+        else:
+            delta = pd.read_sql(
+                "SELECT * FROM ({}) AS base WHERE {} {} {}".format(
+                    query,
+                    _SQL_DIALECTS[_dialect(conn)]['quote'].format(
+                        watermark_col),
+                    '>' if key is None else '>=',
+                    _PLACEHOLDERS[_paramstyle(conn)]),
+                conn, params=(_load_watermark(latest['meta']),), **kwargs)
+            if len(delta) == 0:
+                return latest['filename']
+            df = pd.concat([load_df(latest['filename']), delta],
+                           ignore_index=True, sort=False)
+            if key is not None:
+                df = df.drop_duplicates(subset=key, keep='last').reset_index(
+                    drop=True)
+        meta = None
+        if len(df) > 0:
+            meta = _dump_watermark(watermark_col, df[watermark_col].max())
+        return persist_df(df, path=path, sql=query, prefix=prefix, fmt=fmt,
+                          compression=compression, catalog=catalog, meta=meta)
+
+
+def _dump_watermark(watermark_col, watermark):
+    """
+    Snapshot metadata holding a watermark
+
+    Timestamps, dates, decimals and bytes (e.g. ``rowversion``) are stored as
+    strings; other types have to be JSON serializable.
+    """
+    if isinstance(watermark, (pd.Timestamp, np.datetime64, datetime)):
+        watermark, watermark_type = \
+            pd.Timestamp(watermark).isoformat(), 'datetime'
+    elif isinstance(watermark, date):
+        watermark, watermark_type = watermark.isoformat(), 'date'
+    elif isinstance(watermark, Decimal):
+        watermark, watermark_type = str(watermark), 'decimal'
+    elif isinstance(watermark, bytes):
+        watermark, watermark_type = watermark.hex(), 'bytes'
+    else:
+        if isinstance(watermark, np.generic):
+            watermark = watermark.item()
+        if not isinstance(watermark, (int, float, str)):
+            raise ValueError("Unsupported watermark type ({})".format(
+                type(watermark).__name__))
+        watermark_type = type(watermark).__name__
+    return {'watermark_col': watermark_col, 'watermark': watermark,
+            'watermark_type': watermark_type}
+
+
+def _load_watermark(meta):
+    """Query parameter of the watermark stored in ``meta``"""
+    watermark = meta['watermark']
+    if meta['watermark_type'] == 'datetime':
+        return pd.Timestamp(watermark).to_pydatetime()
+    if meta['watermark_type'] == 'date':
+        return datetime.strptime(watermark, '%Y-%m-%d').date()
+    if meta['watermark_type'] == 'decimal':
+        return Decimal(watermark)
+    if meta['watermark_type'] == 'bytes':
+        return bytes.fromhex(watermark)
+    return watermark
+
+
+def fetch_to_file(conn, query, path=None, prefix='raw_df', fmt='parquet',
+                  compression=None, chunksize=100000, catalog=None):
+    """
+    Stream the result of a query to a file
+
+    The result set is fetched in batches of ``chunksize`` rows and every
+    batch is appended as a row group (``parquet``) or record batch
+    (``feather``) to the file, so the complete result is never held in
+    memory. The hash of the content is computed incrementally and is equal to
+    the one :func:`persist_df` would have assigned to the whole DataFrame
+    (with a default index). The file is named, and optionally accompanied by
+    the SQL file and registered in ``catalog``, like in :func:`persist_df`.
+
+    The dtypes of a column may differ between batches: integer columns are
+    read as floats in batches with NULLs, and columns of only NULLs as
+    objects. The schema of the file is that of the first batch, where a
+    column of only NULLs takes the type of its first batch with values and
+    an integer column becomes floating point once it has fractional values.
+    The batches written so far are then rewritten with the new schema (at
+    most once per column). The hash is computed as of the dtypes of the
+    complete result, i.e. those of ``load_df`` of the file, and does not
+    depend on ``chunksize``.
+
+    Parameters
+    ----------
+    conn : str or connection
+        Either the path of a configuration file as used by
+        :func:`~pubdsutils.data_fetch.connector_from_ini` or a DB-API
+        connection
+    query : str
+        valid SQL query as a string
+    path : str or None (default)
+        If not None should be a path including a trailing ``/``
+    prefix : str (default ``raw_df``)
+        Prefix of the file
+    fmt : str (default ``parquet``)
+        Either ``parquet`` or ``feather``
+    compression : str (optional)
+        Compression codec, see :func:`persist_df`
+    chunksize : int (default 100000)
+        Number of rows fetched per batch
+    catalog : SnapshotCatalog (optional)
+        Catalog in which the file is registered. If a snapshot with the same
+        hash is already registered, the new file is discarded.
+
+    Returns
+    -------
+    str
+        Filename of the written file
+    """
+    if fmt not in ('parquet', 'feather'):
+        raise ValueError(
+            "Unsupported format ({}). Can be either parquet or "
+            "feather".format(fmt))
+    import pyarrow as pa
+
+    with _closing_connection(conn) as conn:
+        created_at = datetime.now()
+        tmp_filename = _base_filename(path, prefix, created_at, 'partial') + \
+            '.' + fmt + '.tmp'
+        hasher = None
+        writer = None
+        try:
+            chunks = pd.read_sql(query, conn, chunksize=chunksize)
+            for chunk in _non_empty(chunks, lambda: pd.read_sql(query, conn)):
+                if hasher is None:
+                    hasher = _ResultHasher(chunk.columns)
+                    schema = pa.Schema.from_pandas(chunk,
+                                                   preserve_index=False)
+                    writer = _arrow_writer(tmp_filename, schema, fmt,
+                                           compression)
+                else:
+                    widened = _widened_schema(schema, chunk)
+                    if not widened.equals(schema):
+                        writer.close()
+                        writer = None
+                        writer = _rewrite_arrow(tmp_filename, widened, fmt,
+                                                compression)
+                        schema = widened
+                chunk.index = pd.RangeIndex(hasher.n_rows,
+                                            hasher.n_rows + len(chunk))
+                hasher.update(chunk, schema)
+                writer.write_table(pa.Table.from_pandas(
+                    chunk, schema=schema, preserve_index=False))
+        except BaseException:
+            if writer is not None:
+                writer.close()
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
+            raise
+        writer.close()
+
+        df_hash = hasher.hexdigest()
+        if catalog is not None:
+            existing = catalog.by_hash(df_hash)
+            if existing is not None:
+                os.remove(tmp_filename)
+                return _register_alias(catalog, existing, prefix, query)
+        base_filename = _base_filename(path, prefix, created_at, df_hash)
+        filename = base_filename + '.' + fmt
+        os.replace(tmp_filename, filename)
+        _register_snapshot(filename, base_filename, df_hash, prefix, query,
+                           hasher._schema, hasher.n_rows, created_at, catalog)
+        return filename
+
+
+def _widened_schema(schema, chunk):
+    """
+    Arrow schema of the file once ``chunk`` is appended: columns of only
+    NULLs so far take the type of the chunk, and integer columns become
+    floating point if the chunk has fractional values
+    """
+    import pyarrow as pa
+
+    chunk_schema = pa.Schema.from_pandas(chunk, preserve_index=False)
+    for i, (field, new) in enumerate(zip(schema, chunk_schema)):
+        if field.type == pa.null():
+            widen = new.type != pa.null()
+        else:
+            widen = (pa.types.is_integer(field.type) and
+                     pa.types.is_floating(new.type) and
+                     (chunk.iloc[:, i].dropna() % 1 != 0).any())
+        if widen:
+            schema = schema.set(i, new)
+    return schema
+
+
+def _rewrite_arrow(filename, schema, fmt, compression):
+    """
+    Rewrite the row groups or record batches of ``filename`` cast to
+    ``schema``, returning the writer to append further ones
+    """
+    import pyarrow as pa
+
+    old_filename = filename + '.old'
+    os.replace(filename, old_filename)
+    try:
+        if fmt == 'parquet':
+            import pyarrow.parquet as pq
+            parquet_file = pq.ParquetFile(old_filename)
+            tables = (parquet_file.read_row_group(i)
+                      for i in range(parquet_file.num_row_groups))
+        else:
+            reader = pa.ipc.open_file(pa.OSFile(old_filename))
+            tables = (pa.Table.from_batches([reader.get_batch(i)])
+                      for i in range(reader.num_record_batches))
+        writer = _arrow_writer(filename, schema, fmt, compression)
+        try:
+            for table in tables:
+                writer.write_table(table.cast(schema))
+        except BaseException:
+            writer.close()
+            raise
+    finally:
+        os.remove(old_filename)
+    return writer
+
+
+class _ResultHasher(_FrameHasher):
+    """
+    :class:`_FrameHasher` of a query result fetched in chunks, as of the
+    dtypes of the complete result
+
+    Every column is hashed as of its type in the arrow schema of the file,
+    like :func:`load_df` converts it: NULLs before the first value of a
+    column are hashed once its type is known, and columns whose dtype
+    changes if they have NULLs (integers become floats and booleans objects)
+    are hashed both ways until the first NULL.
+    """
+
+    def __init__(self, columns, block_rows=HASH_BLOCK_ROWS):
+        super(_ResultHasher, self).__init__(block_rows)
+        self._columns = list(columns)
+        self._hashers = [sha256() for _ in range(len(self._columns) + 1)]
+        # Hashes as of the dtype without NULLs, while there were none
+        self._plain = [sha256() for _ in self._columns]
+        self._types = [None] * len(self._columns)
+        self._has_null = [False] * len(self._columns)
+        self._leading_nulls = [0] * len(self._columns)
+
+    def update(self, df, schema):
+        for start in range(0, len(df), self.block_rows):
+            block = df.iloc[start:start + self.block_rows]
+            self._hashers[0].update(_value_hashes(block.index))
+            for i, field in enumerate(schema):
+                self._update_column(i, block.iloc[:, i], field.type)
+        self.n_rows += len(df)
+        return self
+
+    def _update_column(self, i, values, arrow_type):
+        import pyarrow as pa
+
+        if arrow_type == pa.null():
+            self._leading_nulls[i] += len(values)
+            return
+        self._types[i] = arrow_type
+        dtype, null_dtype = _loaded_dtypes(arrow_type)
+        if self._leading_nulls[i]:
+            self._hash_nulls(self._hashers[i + 1], self._leading_nulls[i],
+                             arrow_type)
+            self._has_null[i] = True
+            self._leading_nulls[i] = 0
+        self._has_null[i] |= bool(values.isna().any())
+        self._hashers[i + 1].update(
+            _value_hashes(_as_dtype(values, null_dtype)))
+        if dtype != null_dtype and not self._has_null[i]:
+            self._plain[i].update(_value_hashes(_as_dtype(values, dtype)))
+
+    def _hash_nulls(self, hasher, n, arrow_type):
+        import pyarrow as pa
+
+        for start in range(0, n, self.block_rows):
+            nulls = pa.nulls(min(self.block_rows, n - start), arrow_type)
+            hasher.update(_value_hashes(pd.Series(nulls.to_pandas())))
+
+    def hexdigest(self):
+        import pyarrow as pa
+
+        hashers = [self._hashers[0]]
+        columns = []
+        for i, col in enumerate(self._columns):
+            hasher = self._hashers[i + 1]
+            if self._types[i] is None:
+                # Only NULLs, loaded as objects
+                dtype = np.dtype(object)
+                hasher = hasher.copy()
+                self._hash_nulls(hasher, self._leading_nulls[i], pa.null())
+            else:
+                dtype, null_dtype = _loaded_dtypes(self._types[i])
+                if dtype == null_dtype or self._has_null[i]:
+                    dtype = null_dtype
+                else:
+                    hasher = self._plain[i]
+            hashers.append(hasher)
+            columns.append([str(col), str(dtype)])
+        self._schema = {'columns': columns, 'index': 'int64'}
+        digest = sha256(json.dumps(self._schema).encode())
+        for hasher in hashers:
+            digest.update(hasher.digest())
+        return digest.hexdigest()
+
+
+def _loaded_dtypes(arrow_type):
+    """dtypes of an arrow column as loaded without and with NULLs"""
+    import pyarrow as pa
+
+    return (pd.Series(pa.array([], arrow_type).to_pandas()).dtype,
+            pd.Series(pa.nulls(1, arrow_type).to_pandas()).dtype)
+
+
+def _as_dtype(values, dtype):
+    return values if values.dtype == dtype else values.astype(dtype)
+
+
+def _connection(conn):
+    """Connection from either a configuration file or a connection"""
+    if isinstance(conn, str):
+        return connector_from_ini(conn)
+    return conn
+
+
+@contextmanager
+def _closing_connection(conn):
+    """
+    Connection of :func:`_connection`, closed on exit if it was opened from
+    a configuration file
+    """
+    opened = _connection(conn)
+    try:
+        yield opened
+    finally:
+        if opened is not conn:
+            opened.close()
+
+
+def _non_empty(chunks, fetch_empty):
+    """
+    Iterate over ``chunks``; if there are none, yield the (empty) result of
+    ``fetch_empty`` so that the columns are known.
+    """
+    empty = True
+    for chunk in chunks:
+        empty = False
+        yield chunk
+    if empty:
+        yield fetch_empty()
+
+
+def _arrow_writer(filename, schema, fmt, compression):
+    import pyarrow as pa
+
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+        return pq.ParquetWriter(filename, schema,
+                                compression=compression or 'snappy')
+    return pa.ipc.new_file(
+        filename, schema,
+        options=pa.ipc.IpcWriteOptions(compression=compression))
+
+
+class SnapshotCatalog(object):
+    """
+    Index of the snapshots written by :func:`persist_df`
+
+    The catalog is a SQLite database recording, for every persisted
+    DataFrame, its hash, prefix, SQL, schema, number of rows, file size and
+    creation time. It enables finding the latest snapshot of a query or
+    an identical snapshot without scanning or loading files. A file can be
+    registered several times, once per prefix and SQL producing it.
+
+    .. code-block:: python
+
+        catalog = SnapshotCatalog('snapshots/catalog.sqlite')
+        persist_df(df, path='snapshots/', sql=query, catalog=catalog)
+        load_df(catalog.latest(sql=query)['filename'])
+
+    Attributes
+    ----------
+    filename : str
+        Path of the SQLite database. Created if it doesn't exist.
+    """
+
+    _COLUMNS = ['filename', 'hash', 'prefix', 'sql', 'sql_hash', 'schema',
+                'n_rows', 'size', 'created_at', 'meta']
+
+    def __init__(self, filename):
+        self.filename = filename
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS snapshots ("
+                "filename TEXT NOT NULL, hash TEXT NOT NULL, "
+                "prefix TEXT NOT NULL, sql TEXT, sql_hash TEXT, "
+                "schema TEXT NOT NULL, n_rows INTEGER NOT NULL, "
+                "size INTEGER NOT NULL, created_at TEXT NOT NULL, meta TEXT)")
+            conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS snapshots_key "
+                         "ON snapshots (filename, prefix, "
+                         "IFNULL(sql_hash, ''))")
+            conn.execute("CREATE INDEX IF NOT EXISTS snapshots_hash "
+                         "ON snapshots (hash)")
+            conn.execute("CREATE INDEX IF NOT EXISTS snapshots_sql "
+                         "ON snapshots (sql_hash, created_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS snapshots_prefix "
+                         "ON snapshots (prefix, created_at)")
+
+    def _connect(self):
+        # A connection per operation keeps the catalog usable from several
+        # threads and processes.
+        conn = sqlite3.connect(self.filename, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return _ClosingConnection(conn)
+
+    def register(self, filename, df_hash, prefix, schema, n_rows, sql=None,
+                 created_at=None, meta=None):
+        """
+        Record a persisted snapshot
+
+        Registering a file again with the same ``prefix`` and ``sql``
+        replaces its entry.
+
+        Parameters
+        ----------
+        filename : str
+            File holding the snapshot
+        df_hash : str
+            Hash of the snapshot as computed by :func:`hash_df`
+        prefix : str
+            Prefix used when persisting
+        schema : dict
+            Columns and dtypes of the snapshot
+        n_rows : int
+            Number of rows
+        sql : str (optional)
+            SQL which generated the snapshot
+        created_at : datetime (optional)
+            Creation time. Defaults to now.
+        meta : dict (optional)
+            Further JSON serializable metadata
+        """
+        if created_at is None:
+            created_at = datetime.now()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO snapshots ({}) VALUES ({})".format(
+                    ', '.join(self._COLUMNS),
+                    ', '.join('?' * len(self._COLUMNS))),
+                (filename, df_hash, prefix, sql, _sql_hash(sql),
+                 json.dumps(schema), n_rows, os.path.getsize(filename),
+                 created_at.isoformat(),
+                 None if meta is None else json.dumps(meta)))
+
+    def by_hash(self, df_hash):
+        """
+        Snapshot having the hash ``df_hash``
+
+        Entries whose file no longer exists are dropped from the catalog.
+
+        Returns
+        -------
+        dict or None
+        """
+        return self._first_existing(
+            "SELECT * FROM snapshots WHERE hash = ? "
+            "ORDER BY created_at DESC", (df_hash,))
+
+    def latest(self, sql=None, prefix=None):
+        """
+        Most recent snapshot of the query ``sql`` and/or with ``prefix``
+
+        Returns
+        -------
+        dict or None
+        """
+        conditions, params = self._conditions(sql=sql, prefix=prefix)
+        return self._first_existing(
+            "SELECT * FROM snapshots{} ORDER BY created_at DESC".format(
+                conditions), params)
+
+    def entries(self, sql=None, prefix=None):
+        """
+        All the registered snapshots, newest first
+
+        Returns
+        -------
+        pandas.DataFrame
+        """
+        conditions, params = self._conditions(sql=sql, prefix=prefix)
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT * FROM snapshots{} ORDER BY created_at DESC".format(
+                    conditions), params).fetchall()
+        return pd.DataFrame([self._to_dict(row) for row in rows],
+                            columns=self._COLUMNS)
+
+    def remove(self, filename):
+        """Remove a snapshot, its SQL file and its catalog entries"""
+        for name in [filename, _sql_filename(filename)]:
+            if os.path.exists(name):
+                os.remove(name)
+        with self._connect() as conn:
+            conn.execute("DELETE FROM snapshots WHERE filename = ?",
+                         (filename,))
+
+    def cleanup(self, keep_last=None, max_age=None):
+        """
+        Retention based removal of snapshots
+
+        An entry expires if it is not among the ``keep_last`` most recent
+        entries of its prefix, or if it is older than ``max_age``. Files are
+        removed once all their entries expired.
+
+        Parameters
+        ----------
+        keep_last : int (optional)
+            Number of snapshots to keep per prefix
+        max_age : datetime.timedelta (optional)
+            Maximal age of a snapshot
+
+        Returns
+        -------
+        list
+            Filenames of the removed snapshots
+        """
+        entries = self.entries()
+        expired = pd.Series(False, index=entries.index)
+        if keep_last is not None:
+            expired |= entries.groupby('prefix').cumcount() >= keep_last
+        if max_age is not None:
+            expired |= pd.to_datetime(entries['created_at']) < \
+                datetime.now() - max_age
+        kept = set(entries.loc[~expired, 'filename'])
+        removed = [filename for filename
+                   in entries.loc[expired, 'filename'].unique()
+                   if filename not in kept]
+        for filename in removed:
+            self.remove(filename)
+        with self._connect() as conn:
+            conn.executemany(
+                "DELETE FROM snapshots WHERE filename = ? AND prefix = ? "
+                "AND IFNULL(sql_hash, '') = ?",
+                [(row.filename, row.prefix, row.sql_hash or '')
+                 for row in entries[expired].itertuples()
+                 if row.filename in kept])
+        return removed
+
+    @staticmethod
+    def _conditions(sql=None, prefix=None):
+        conditions, params = [], []
+        if sql is not None:
+            conditions.append("sql_hash = ?")
+            params.append(_sql_hash(sql))
+        if prefix is not None:
+            conditions.append("prefix = ?")
+            params.append(prefix)
+        if not conditions:
+            return '', ()
+        return ' WHERE ' + ' AND '.join(conditions), tuple(params)
+
+    def _first_existing(self, query, params):
+        with self._connect() as conn:
+            rows = conn.execute(query, params).fetchall()
+        for row in rows:
+            if os.path.exists(row['filename']):
+                return self._to_dict(row)
+            self.remove(row['filename'])
+        return None
+
+    @staticmethod
+    def _to_dict(row):
+        entry = dict(zip(row.keys(), row))
+        entry['schema'] = json.loads(entry['schema'])
+        if entry['meta'] is not None:
+            entry['meta'] = json.loads(entry['meta'])
+        return entry
+
+
+class _ClosingConnection(object):
+    """Commits (or rolls back) and closes a SQLite connection on exit"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self.conn.__enter__()
+
+    def __exit__(self, *exc_info):
+        try:
+            return self.conn.__exit__(*exc_info)
+        finally:
+            self.conn.close()
+
+
+def _sql_hash(sql):
+    return None if sql is None else sha256(sql.encode()).hexdigest()
+
+
+def _sql_filename(filename):
+    """Name of the SQL file written by :func:`persist_df` for ``filename``"""
+    base_filename = filename
+    for ext in ['.parquet', '.feather'] + [
+            '.pickle' + ext for ext in _PICKLE_COMPRESSION_EXT.values()] + [
+            '.pickle']:
+        if filename.endswith(ext):
+            base_filename = filename[:-len(ext)]
+            break
+    return base_filename + '.sql'
+
+
+class ChunkStore(object):
+    """
+    Deduplicating storage of DataFrame snapshots
+
+    Every column (and the index) of a snapshot is split into chunks of
+    ``chunk_rows`` rows. Each chunk is stored once under the hash of its
+    content, and a manifest per snapshot lists the chunks to reassemble it
+    from. Snapshots sharing rows -- e.g. daily snapshots of a query whose
+    historic rows don't change and new rows are appended -- share the
+    chunks of these rows, and storing a snapshot only writes the chunks
+    which are new.
+
+    Layout of ``root``: ``chunks/<hh>/<hash>.pickle`` and
+    ``manifests/<name>.json``.
+
+    .. code-block:: python
+
+        store = ChunkStore('snapshots/')
+        name = store.put(df)
+        store.load(name, columns=['price'])
+
+    Attributes
+    ----------
+    root : str
+        Directory of the store. Created if it doesn't exist.
+    chunk_rows : int (default 100000)
+        Number of rows per chunk
+    """
+
+    def __init__(self, root, chunk_rows=100000):
+        self.root = root
+        self.chunk_rows = chunk_rows
+        for directory in ['chunks', 'manifests']:
+            os.makedirs(os.path.join(root, directory), exist_ok=True)
+
+    def put(self, df, name=None):
+        """
+        Store a snapshot
+
+        Parameters
+        ----------
+        df : pandas.DataFrame
+            Snapshot to store. Column names must be JSON serializable.
+        name : str (optional)
+            Name of the snapshot. Defaults to the creation time and the hash
+            of ``df`` (see :func:`hash_df`). An existing snapshot with the
+            same name is replaced.
+
+        Returns
+        -------
+        str
+            Name of the snapshot
+        """
+        created_at = datetime.now()
+        df_hash = hash_df(df)
+        if name is None:
+            name = '{}_{}'.format(
+                created_at.isoformat().replace(":", "-").replace(".", "-"),
+                df_hash)
+        manifest = {
+            'name': name,
+            'hash': df_hash,
+            'created_at': created_at.isoformat(),
+            'n_rows': len(df),
+            'chunk_rows': self.chunk_rows,
+            'index': self._put_chunks(df.index),
+            'columns': [],
+        }
+        for i, col in enumerate(df.columns):
+            chunks = self._put_chunks(df.iloc[:, i])
+            chunks['name'] = col
+            manifest['columns'].append(chunks)
+        tmp_filename = self._manifest_filename(name) + '.tmp'
+        with open(tmp_filename, 'w') as manifest_file:
+            json.dump(manifest, manifest_file)
+        os.replace(tmp_filename, self._manifest_filename(name))
+        return name
+
+    def _put_chunks(self, values):
+        """Store the chunks of a column or an index; returns their hashes"""
+        hashes = []
+        for start in range(0, len(values), self.chunk_rows):
+            chunk = values[start:start + self.chunk_rows]
+            if isinstance(chunk, pd.Series):
+                chunk = chunk.reset_index(drop=True)
+            chunk_hash = sha256(repr(chunk.dtype).encode())
+            chunk_hash.update(_value_hashes(chunk))
+            chunk_hash = chunk_hash.hexdigest()
+            filename = self._chunk_filename(chunk_hash)
+            if not os.path.exists(filename):
+                os.makedirs(os.path.dirname(filename), exist_ok=True)
+                pd.to_pickle(chunk, filename + '.tmp')
+                os.replace(filename + '.tmp', filename)
+            hashes.append(chunk_hash)
+        return {'dtype': str(values.dtype), 'chunks': hashes}
+
+    def _chunk_filename(self, chunk_hash):
+        return os.path.join(self.root, 'chunks', chunk_hash[:2],
+                            chunk_hash + '.pickle')
+
+    def _manifest_filename(self, name):
+        return os.path.join(self.root, 'manifests', name + '.json')
+
+    def manifest(self, name):
+        """The manifest of the snapshot ``name`` as a dict"""
+        with open(self._manifest_filename(name)) as manifest_file:
+            return json.load(manifest_file)
+
+    def names(self):
+        """Names of the stored snapshots, oldest first"""
+        manifests = [self.manifest(filename[:-len('.json')]) for filename in
+                     os.listdir(os.path.join(self.root, 'manifests'))
+                     if filename.endswith('.json')]
+        return [manifest['name'] for manifest in
+                sorted(manifests, key=lambda m: m['created_at'])]
+
+    def iter_chunks(self, name, columns=None):
+        """
+        Lazily reassemble a snapshot chunk by chunk
+
+        Only the chunks of the requested columns are read, one row chunk at a
+        time, hence memory is bounded by the size of a chunk.
+
+        Parameters
+        ----------
+        name : str
+            Name of the snapshot
+        columns : list (optional)
+            Columns to load. If ``None``, all the columns are loaded.
+
+        Yields
+        ------
+        pandas.DataFrame
+            Consecutive rows of the snapshot
+        """
+        manifest = self.manifest(name)
+        entries = manifest['columns']
+        if columns is not None:
+            by_name = {entry['name']: entry for entry in entries}
+            missing = [col for col in columns if col not in by_name]
+            if missing:
+                raise KeyError("Unknown columns {}".format(missing))
+            entries = [by_name[col] for col in columns]
+        for i, index_hash in enumerate(manifest['index']['chunks']):
+            data = OrderedDict(
+                (entry['name'],
+                 pd.read_pickle(self._chunk_filename(entry['chunks'][i])))
+                for entry in entries)
+            df = pd.DataFrame(data, columns=list(data))
+            df.index = pd.read_pickle(self._chunk_filename(index_hash))
+            yield df
+
+    def load(self, name, columns=None):
+        """
+        Load a snapshot
+
+        Parameters
+        ----------
+        name : str
+            Name of the snapshot
+        columns : list (optional)
+            Columns to load. If ``None``, all the columns are loaded.
+
+        Returns
+        -------
+        pandas.DataFrame
+        """
+        chunks = list(self.iter_chunks(name, columns=columns))
+        if not chunks:
+            manifest = self.manifest(name)
+            entries = [entry for entry in manifest['columns']
+                       if columns is None or entry['name'] in columns]
+            return pd.DataFrame({
+                entry['name']: pd.Series([], dtype=entry['dtype'])
+                for entry in entries},
+                columns=[entry['name'] for entry in entries])
+        return pd.concat(chunks) if len(chunks) > 1 else chunks[0]
+
+    def remove(self, name):
+        """
+        Remove the manifest of a snapshot
+
+        Its chunks are removed by :meth:`gc` once no other snapshot
+        references them.
+        """
+        os.remove(self._manifest_filename(name))
+
+    def gc(self):
+        """
+        Remove the chunks not referenced by any snapshot
+
+        Returns
+        -------
+        int
+            Number of removed chunks
+        """
+        referenced = set()
+        for name in self.names():
+            manifest = self.manifest(name)
+            for entry in [manifest['index']] + manifest['columns']:
+                referenced.update(entry['chunks'])
+        removed = 0
+        chunks_dir = os.path.join(self.root, 'chunks')
+        for directory in os.listdir(chunks_dir):
+            for filename in os.listdir(os.path.join(chunks_dir, directory)):
+                if filename[:-len('.pickle')] not in referenced:
+                    os.remove(os.path.join(chunks_dir, directory, filename))
+                    removed += 1
+        return removed
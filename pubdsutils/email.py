@@ -1,9 +1,20 @@
+import io
+import os
+import time
+import uuid
+import zlib
+import email
+import queue
+import struct
 import logging
+import threading
 import configparser
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from pubdsutils.instrumentation import instrumented
+
+# smtplib (with ssl) and email.mime are imported on use, to keep the import of
+# this module fast
 
 logger = logging.getLogger(__name__)
 
@@ -34,10 +45,20 @@ def set_email_server(config_ini):
     """
 
     logger.info('Setting server email')
+    return _connect(_read_config(config_ini))
+
+
+def _read_config(config_ini):
     with open(config_ini, 'r') as cfg_file:
         # config = yaml.load(cfg_file)
         config = configparser.ConfigParser()
         config.read_file(cfg_file)
+    return config
+
+
+def _connect(config):
+    """Connected (and logged in) smtp client using the ``server`` section"""
+    import smtplib
     EMAIL_HOST = config['server']['EMAIL_HOST']
     EMAIL_HOST_USER = config['server']['EMAIL_HOST_USER']
     EMAIL_HOST_PASSWORD = config['server']['EMAIL_HOST_PASSWORD']
@@ -54,10 +75,18 @@ def set_email_server(config_ini):
     return s
 
 
-def send_df(df, config_ini, **kwargs):
+@instrumented
+def send_df(df, config_ini, session=None, compress=None,
+            attachment_format='csv', max_attachment_size=None,
+            max_message_size=None, chunk_rows=10000, **kwargs):
     """
     Send a pandas.DataFrame per email as an attached CSV
 
+    By default the whole frame is attached as a single CSV. Large frames can
+    be compressed, sent as Parquet and split by size instead; in that case
+    the attachments are generated chunk by chunk, so that at most one email
+    (and never the full CSV) is held in memory.
+
     Parameters
     ----------
     estimate : pandas.DataFrame
@@ -76,20 +105,194 @@ def send_df(df, config_ini, **kwargs):
             TO = send.to@foo.bar[, another@foo.bar]
             BODY = Body of the message. NO LINE BREAKS!
             FILENAME = foo.csv # note the .csv!
+    session : SMTPSession (optional)
+        If provided, the email is sent through the session's connection and
+        its configuration is used instead of ``config_ini``.
+    compress : None, 'gzip' or 'zip' (default None)
+        Compress the CSV attachments, e.g. ``foo.csv.gz`` or ``foo.zip``
+    attachment_format : 'csv' or 'parquet' (default 'csv')
+        With 'parquet' the attachments are ``foo.parquet`` files; requires
+        ``pyarrow`` and ignores ``compress`` and ``**kwargs``
+    max_attachment_size : int (optional)
+        Maximal size of an attachment in bytes (before the base64 encoding of
+        the email, which adds a third). Larger data is split into several
+        attachments ``foo_part1.csv``, ``foo_part2.csv``, ... each with the
+        CSV header.
+    max_message_size : int (optional)
+        Maximal total size of the attachments of one email in bytes. If they
+        exceed it, they are spread over several emails whose subjects are
+        suffixed with ``(part 1)``, ``(part 2)``, ...
+    chunk_rows : int (default 10000)
+        Number of rows serialized at once when compressing or splitting
     **kwargs :
         passed to pandas.DataFrame.to_csv()
     """
 
     logger.info('Preparing and sending email')
 
-    server = set_email_server(config_ini)
+    options = dict(compress=compress, attachment_format=attachment_format,
+                   max_attachment_size=max_attachment_size,
+                   max_message_size=max_message_size, chunk_rows=chunk_rows)
+    if session is not None:
+        session.send_df(df, **options, **kwargs)
+        return
+
+    config = _read_config(config_ini)
+    server = None
+    try:
+        for msg in _df_messages(df, config, **options, **kwargs):
+            if server is None:
+                server = _connect(config)
+            server.send_message(msg)
+    finally:
+        if server is not None:
+            server.quit()
+
+
+def send_df_by_group(df, config_ini, by, recipients, session=None,
+                     pool=None, missing='skip', **kwargs):
+    """
+    Send each group of a pandas.DataFrame to its own recipients
+
+    The frame is partitioned once by the group indices, and the emails are
+    sent through a single :class:`SMTPSession` (or ``pool``), i.e. with a
+    single login. Each email is built as in :func:`send_df`, with the group
+    appended to the subject, once the previous ones are being sent, so that
+    only a few of them are held in memory.
+
+    .. code-block:: python
 
-    config = configparser.ConfigParser()
-    config.read(config_ini)
+        send_df_by_group(df, 'email.ini', by='country',
+                         recipients={'DE': 'de@foo.bar',
+                                     'FR': ['fr@foo.bar', 'eu@foo.bar']})
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        Data to be sent
+    config_ini : str
+        Path and filename of INI file, as described in :func:`send_df`. The
+        ``TO`` of the ``content`` section is replaced by ``recipients``.
+    by : str or list of str
+        Column(s) to group by
+    recipients : dict
+        Mapping of a group (a tuple for several columns) to the recipients of
+        its rows, either a str (comma-separated) or a list of str
+    session : SMTPSession (optional)
+        Session to send through; its configuration is used instead of
+        ``config_ini``
+    pool : SMTPSessionPool (optional)
+        Pool to send through in parallel, instead of a single session
+    missing : 'skip' or 'raise' (default 'skip')
+        What to do with groups that have no recipients
+    **kwargs :
+        passed to :func:`send_df`, e.g. ``compress``, or to
+        pandas.DataFrame.to_csv()
 
+    Raises
+    ------
+    ValueError
+        If ``missing='raise'`` and a group has no recipients
+    """
+    if missing not in ('skip', 'raise'):
+        raise ValueError("missing has to be 'skip' or 'raise'")
+    indices = df.groupby(by, sort=False).indices
+    unknown = [group for group in indices if group not in recipients]
+    if unknown and missing == 'raise':
+        raise ValueError('No recipients for the groups {}'.format(unknown))
+    for group in unknown:
+        logger.warning('Skipping group {} without recipients'.format(group))
+
+    if session is not None:
+        config = session.config
+    elif pool is not None:
+        config = _read_config(pool.config_ini)
+    else:
+        config = _read_config(config_ini)
+
+    def messages():
+        for group, index in indices.items():
+            if group in unknown:
+                continue
+            to = recipients[group]
+            content = {key.upper(): value
+                       for key, value in config['content'].items()}
+            content['TO'] = to if isinstance(to, str) else ', '.join(to)
+            content['SUBJECT'] = '{} - {}'.format(
+                content['SUBJECT'],
+                ' / '.join(map(str, group)) if isinstance(group, tuple)
+                else group)
+            yield from _df_messages(df.take(index), {'content': content},
+                                    **kwargs)
+
+    logger.info('Preparing and sending emails for {} groups'.format(
+        len(indices) - len(unknown)))
+    if pool is not None:
+        pool.send_many(messages())
+        return
+    own_session = session is None
+    if own_session:
+        session = SMTPSession(config_ini)
+    try:
+        for msg in messages():
+            session.send(msg)
+    finally:
+        if own_session:
+            session.close()
+
+
+def _df_messages(df, config, compress=None, attachment_format='csv',
+                 max_attachment_size=None, max_message_size=None,
+                 chunk_rows=10000, **kwargs):
+    """
+    Yield the emails of :func:`send_df` as described by the ``content``
+    section, one after the other
+    """
+    if compress not in (None, 'gzip', 'zip'):
+        raise ValueError("compress has to be None, 'gzip' or 'zip'")
+    if attachment_format not in ('csv', 'parquet'):
+        raise ValueError("attachment_format has to be 'csv' or 'parquet'")
+
+    filename = config['content']['FILENAME']
+    simple = (compress is None and attachment_format == 'csv' and
+              max_attachment_size is None and max_message_size is None)
+    if simple:
+        from email.mime.text import MIMEText
+        attachment = MIMEText(df.to_csv(**kwargs))
+        attachment.add_header('Content-Disposition', 'attachment',
+                              filename=filename)
+        yield _message(config, [attachment])
+        return
+
+    if attachment_format == 'parquet':
+        filename = os.path.splitext(filename)[0] + '.parquet'
+        contents = _parquet_parts(df, max_attachment_size, chunk_rows)
+    else:
+        contents = _csv_parts(df, max_attachment_size, compress,
+                              os.path.basename(filename), chunk_rows,
+                              **kwargs)
+        if compress == 'gzip':
+            filename += '.gz'
+        elif compress == 'zip':
+            filename = os.path.splitext(filename)[0] + '.zip'
+
+    attachments = _attachments(contents, filename, attachment_format,
+                               compress, kwargs.get('encoding') or 'utf-8')
+    messages = _group_by_size(attachments, max_message_size)
+    for number, (group, is_last) in enumerate(_lookahead(messages), 1):
+        suffix = '' if number == 1 and is_last else \
+            ' (part {})'.format(number)
+        yield _message(config, [attachment for attachment, _ in group],
+                       suffix)
+
+
+def _message(config, attachments, suffix=''):
+    """Email with the ``content`` section's headers and body"""
+    from email.mime.text import MIMEText
+    from email.mime.multipart import MIMEMultipart
     sending_ts = datetime.now()
     sub = config['content']['SUBJECT'] + " / Generated on " + \
-        sending_ts.strftime('%Y-%m-%d %H:%M:%S')
+        sending_ts.strftime('%Y-%m-%d %H:%M:%S') + suffix
 
     msg = MIMEMultipart('alternative')
     msg['From'] = config['content']['FROM']
@@ -99,11 +302,584 @@ def send_df(df, config_ini, **kwargs):
     body = config['content']['BODY']
     msg.attach(MIMEText(body, 'plain'))
 
-    filename = config['content']['FILENAME']
-    attachment = MIMEText(df.to_csv(**kwargs))
-    attachment.add_header('Content-Disposition', 'attachment',
-                          filename=filename)
-    msg.attach(attachment)
+    for attachment in attachments:
+        msg.attach(attachment)
+    return msg
+
+
+def _attachments(contents, filename, attachment_format, compress,
+                 encoding='utf-8'):
+    """
+    Yield a MIME part and its size for each content of bytes (CSV text in
+    ``encoding``)
+    """
+    from email.mime.text import MIMEText
+    from email.mime.application import MIMEApplication
+    for number, (content, is_last) in enumerate(_lookahead(contents), 1):
+        part_name = filename
+        if not (number == 1 and is_last):
+            name, ext = filename.split('.', 1) if '.' in filename else \
+                (filename, '')
+            part_name = '{}_part{}{}'.format(name, number,
+                                             '.' + ext if ext else '')
+        if attachment_format == 'parquet':
+            attachment = MIMEApplication(content)
+        elif compress is not None:
+            attachment = MIMEApplication(content, compress)
+        else:
+            attachment = MIMEText(content.decode(encoding), 'csv',
+                                  encoding)
+        attachment.add_header('Content-Disposition', 'attachment',
+                              filename=part_name)
+        yield attachment, len(content)
+
+
+def _group_by_size(attachments, max_size):
+    """Yield lists of attachments whose sizes sum up to at most max_size"""
+    group, size = [], 0
+    for attachment in attachments:
+        if group and max_size is not None and \
+                size + attachment[1] > max_size:
+            yield group
+            group, size = [], 0
+        group.append(attachment)
+        size += attachment[1]
+    yield group
+
+
+def _lookahead(iterable):
+    """Yield each item together with whether it is the last one"""
+    iterator = iter(iterable)
+    try:
+        previous = next(iterator)
+    except StopIteration:
+        return
+    for item in iterator:
+        yield previous, False
+        previous = item
+    yield previous, True
+
+
+def _row_chunks(df, chunk_rows, serialize, max_size):
+    """
+    Serialize the frame chunk by chunk, halving chunks larger than max_size
+    """
+    for start in range(0, max(len(df), 1), chunk_rows):
+        pending = [df.iloc[start:start + chunk_rows]]
+        while pending:
+            chunk = pending.pop()
+            content = serialize(chunk)
+            if max_size is not None and len(chunk) > 1 and \
+                    _size(content) > max_size:
+                half = len(chunk) // 2
+                pending += [chunk.iloc[half:], chunk.iloc[:half]]
+            else:
+                yield content
+
+
+def _size(content):
+    return content.nbytes if hasattr(content, 'nbytes') else len(content)
+
+
+def _csv_parts(df, max_size, compress, filename, chunk_rows, **kwargs):
+    """Yield the CSV, possibly compressed, in parts of at most max_size"""
+    header = kwargs.pop('header', True)
+    encoding = kwargs.pop('encoding', None) or 'utf-8'
+    head = b''
+    if header is not False:
+        head = df.iloc[:0].to_csv(header=header, **kwargs).encode(encoding)
+    body_size = None if max_size is None else max(max_size - len(head), 1)
+    pieces = _row_chunks(
+        df, chunk_rows,
+        lambda chunk: chunk.to_csv(header=False, **kwargs).encode(encoding),
+        body_size)
+
+    part = _AttachmentBuffer(compress, filename)
+    part.write(head)
+    for piece in pieces:
+        if max_size is not None and part.n_pieces and \
+                part.size + len(piece) > max_size:
+            yield part.getvalue()
+            part = _AttachmentBuffer(compress, filename)
+            part.write(head)
+        part.write(piece)
+        part.n_pieces += 1
+    yield part.getvalue()
+
+
+class _AttachmentBuffer(object):
+    """
+    Gzip or zip file written piece by piece
+
+    Every piece is flushed through the compressor, so that ``size`` is the
+    exact size of the file so far and parts can be cut before exceeding a
+    limit.
+    """
+
+    # Final deflate block and the largest container overhead, without name
+    _OVERHEAD = 10 + 30 + 46 + 22
+
+    def __init__(self, compress, filename):
+        self.compress = compress
+        self.filename = filename.encode('utf-8')
+        self.n_pieces = 0
+        self._chunks = []
+        self._crc = 0
+        self._raw_size = 0
+        self._data_size = 0
+        if compress is not None:
+            self._compressor = zlib.compressobj(9, zlib.DEFLATED, -15)
+
+    @property
+    def size(self):
+        if self.compress is None:
+            return self._data_size
+        return self._data_size + self._OVERHEAD + 2 * len(self.filename)
+
+    def write(self, data):
+        if self.compress is not None:
+            self._crc = zlib.crc32(data, self._crc)
+            self._raw_size += len(data)
+            data = self._compressor.compress(data) + \
+                self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        self._chunks.append(data)
+        self._data_size += len(data)
+
+    def getvalue(self):
+        if self.compress is None:
+            return b''.join(self._chunks)
+        self._chunks.append(self._compressor.flush())
+        data = b''.join(self._chunks)
+        if self.compress == 'gzip':
+            return _gzip_file(data, self._crc, self._raw_size, self.filename)
+        return _zip_file(data, self._crc, self._raw_size, self.filename)
+
+
+def _gzip_file(data, crc, raw_size, filename):
+    """Gzip file of raw deflate data, see RFC 1952"""
+    header = b'\x1f\x8b\x08\x08' + struct.pack('<I', int(time.time())) + \
+        b'\x02\xff' + filename + b'\x00'
+    return header + data + struct.pack('<II', crc, raw_size & 0xffffffff)
+
+
+def _zip_file(data, crc, raw_size, filename):
+    """Zip archive of a single file of raw deflate data"""
+    now = datetime.now()
+    dos_time = now.hour << 11 | now.minute << 5 | now.second // 2
+    dos_date = (now.year - 1980) << 9 | now.month << 5 | now.day
+    fields = (8, dos_time, dos_date, crc, len(data), raw_size,
+              len(filename), 0)
+    local = struct.pack('<IHH' + 'HHHIIIHH', 0x04034b50, 20, 0x800,
+                        *fields) + filename
+    central = struct.pack('<IHHH' + 'HHHIIIHH' + 'HHHII', 0x02014b50, 20,
+                          20, 0x800, *fields, 0, 0, 0, 0, 0) + filename
+    end = struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, 1, 1, len(central),
+                      len(local) + len(data), 0)
+    return local + data + central + end
+
+
+def _parquet_parts(df, max_size, chunk_rows):
+    """Yield Parquet files of at most max_size, one row group per chunk"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    tables = _row_chunks(
+        df, chunk_rows,
+        lambda chunk: pa.Table.from_pandas(chunk, preserve_index=False),
+        max_size)
+    buffer, writer = None, None
+    for table in tables:
+        # The in-memory size of a table bounds its size in the file
+        if writer is not None and max_size is not None and \
+                buffer.tell() + table.nbytes > max_size:
+            writer.close()
+            yield buffer.getvalue()
+            writer = None
+        if writer is None:
+            buffer = io.BytesIO()
+            writer = pq.ParquetWriter(buffer, table.schema)
+        writer.write_table(table)
+    writer.close()
+    yield buffer.getvalue()
+
+
+class SMTPSession(object):
+    """
+    Reusable SMTP connection
+
+    The INI file is parsed once, and the connection (including STARTTLS and
+    login) is established on the first message and reused for the following
+    ones. If the connection turns out to be broken, e.g. closed by the
+    server after being idle, the session reconnects and resends.
+
+    .. code-block:: python
+
+        with SMTPSession('email.ini') as session:
+            for df in reports:
+                session.send_df(df)
+
+    Attributes
+    ----------
+    config_ini : str
+        Path and filename of INI file, as described in :func:`send_df`
+    max_retries : int (default 1)
+        Number of reconnection attempts per message
+    """
+
+    def __init__(self, config_ini, max_retries=1):
+        self.config_ini = config_ini
+        self.max_retries = max_retries
+        self.config = _read_config(config_ini)
+        self._server = None
+
+    def send(self, msg):
+        """
+        Send an email
+
+        Parameters
+        ----------
+        msg : email.message.Message
+            The message; sender and recipients are taken from its headers
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                if self._server is None:
+                    logger.info('Connecting to the email server')
+                    self._server = _connect(self.config)
+                self._server.send_message(msg)
+                return
+            except _connection_errors():
+                self._disconnect()
+                if attempt == self.max_retries:
+                    raise
+                logger.warning('Connection to the email server lost; '
+                               'reconnecting')
+
+    def send_df(self, df, **kwargs):
+        """
+        Send a pandas.DataFrame as described in :func:`send_df`
+
+        Parameters
+        ----------
+        df : pandas.DataFrame
+            Data to be sent
+        **kwargs :
+            passed to :func:`send_df`, e.g. ``compress`` or
+            ``max_attachment_size``, or to pandas.DataFrame.to_csv()
+        """
+        for msg in _df_messages(df, self.config, **kwargs):
+            self.send(msg)
+
+    def _disconnect(self):
+        if self._server is not None:
+            try:
+                self._server.close()
+            finally:
+                self._server = None
+
+    def close(self):
+        """Quit the connection, if open"""
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except _connection_errors():
+                pass
+            self._disconnect()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class SMTPSessionPool(object):
+    """
+    Bounded pool of :class:`SMTPSession` sending in parallel
+
+    Attributes
+    ----------
+    config_ini : str
+        Path and filename of INI file, as described in :func:`send_df`
+    size : int (default 4)
+        Number of sessions, i.e. of parallel connections
+    max_retries : int (default 1)
+        Passed to :class:`SMTPSession`
+    """
+
+    def __init__(self, config_ini, size=4, max_retries=1):
+        self.config_ini = config_ini
+        self.size = size
+        self._sessions = queue.Queue()
+        for _ in range(size):
+            self._sessions.put(SMTPSession(config_ini, max_retries))
+
+    def send(self, msg):
+        """Send an email using one of the sessions"""
+        session = self._sessions.get()
+        try:
+            session.send(msg)
+        finally:
+            self._sessions.put(session)
+
+    def send_many(self, msgs):
+        """
+        Send emails in parallel
+
+        ``msgs`` is consumed as the emails are sent: at most ``size`` of them
+        are waiting to be sent at a time, so a generator building the emails
+        keeps only these in memory.
+
+        Parameters
+        ----------
+        msgs : iterable
+            ``email.message.Message`` instances
+
+        Raises
+        ------
+        smtplib.SMTPException
+            The first error, once all other emails were sent
+        """
+        slots = threading.BoundedSemaphore(self.size)
+        errors = []
+
+        def sent(future):
+            if future.exception() is not None:
+                errors.append(future.exception())
+            slots.release()
+
+        with ThreadPoolExecutor(self.size) as executor:
+            for msg in msgs:
+                slots.acquire()
+                executor.submit(self.send, msg).add_done_callback(sent)
+        if errors:
+            raise errors[0]
+
+    def close(self):
+        """Close all sessions"""
+        for _ in range(self.size):
+            self._sessions.get().close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class OutboxClosed(Exception):
+    """Error of the emails not sent because the :class:`Outbox` closed"""
+
+
+class Outbox(object):
+    """
+    Send emails in the background, retrying failures
+
+    :meth:`put` and :meth:`send_df` return immediately; a background thread
+    sends the emails through an :class:`SMTPSession`. Temporary failures
+    (connection errors and 4xx replies) are retried with exponential backoff,
+    i.e. after ``backoff``, ``2 * backoff``, ``4 * backoff``, ... seconds.
+    Emails that fail permanently or too often are logged and kept in
+    ``failed``, as are the emails not sent when the outbox is closed.
+
+    With a ``spool_dir``, every email is written to ``<spool_dir>/*.eml``
+    before being queued and removed once sent, so that pending emails survive
+    a restart: emails found in ``spool_dir`` are queued again on creation.
+    Failed ones are moved to ``<spool_dir>/failed/``.
+
+    .. code-block:: python
+
+        outbox = Outbox('email.ini', spool_dir='outbox/')
+        outbox.send_df(df)
+        ...  # continue while the email is sent
+        outbox.drain()
+
+    Attributes
+    ----------
+    config_ini : str
+        Path and filename of INI file, as described in :func:`send_df`
+    spool_dir : str (optional)
+        Directory to persist pending emails in
+    max_retries : int (default 5)
+        Number of retries per email
+    backoff : float (default 1.)
+        Seconds to wait before the first retry
+    max_backoff : float (default 300.)
+        Maximal seconds to wait between retries
+    failed : list
+        Tuples of an email that could not be sent and the last error (an
+        :class:`OutboxClosed` if it was not tried before closing)
+    """
+
+    def __init__(self, config_ini, spool_dir=None, max_retries=5,
+                 backoff=1., max_backoff=300.):
+        self.config_ini = config_ini
+        self.spool_dir = spool_dir
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.failed = []
+        self._session = SMTPSession(config_ini, max_retries=0)
+        self._queue = queue.Queue()
+        self._pending = 0
+        self._idle = threading.Condition()
+        self._stopped = threading.Event()
+
+        if spool_dir is not None:
+            os.makedirs(os.path.join(spool_dir, 'failed'), exist_ok=True)
+            for filename in sorted(os.listdir(spool_dir)):
+                if filename.endswith('.eml'):
+                    filename = os.path.join(spool_dir, filename)
+                    with open(filename, 'rb') as eml_file:
+                        msg = email.message_from_binary_file(eml_file)
+                    self._enqueue(msg, filename)
+
+        self._worker = threading.Thread(target=self._work, daemon=True)
+        self._worker.start()
+
+    def put(self, msg):
+        """
+        Queue an email
+
+        Parameters
+        ----------
+        msg : email.message.Message
+            The message; sender and recipients are taken from its headers
+        """
+        if self._stopped.is_set():
+            raise ValueError('The outbox is closed')
+        filename = None
+        if self.spool_dir is not None:
+            filename = os.path.join(self.spool_dir, '{}_{}.eml'.format(
+                datetime.now().strftime('%Y%m%d%H%M%S%f'), uuid.uuid4().hex))
+            with open(filename + '.tmp', 'wb') as eml_file:
+                eml_file.write(msg.as_bytes())
+            os.replace(filename + '.tmp', filename)
+        self._enqueue(msg, filename)
+
+    def send_df(self, df, **kwargs):
+        """
+        Queue the email(s) of :func:`send_df`
+
+        Parameters
+        ----------
+        df : pandas.DataFrame
+            Data to be sent
+        **kwargs :
+            passed to :func:`send_df`
+        """
+        for msg in _df_messages(df, self._session.config, **kwargs):
+            self.put(msg)
+
+    def _enqueue(self, msg, filename):
+        with self._idle:
+            self._pending += 1
+        self._queue.put((msg, filename))
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            try:
+                if self._stopped.is_set():
+                    self._unsent(item[0], OutboxClosed(
+                        'The outbox was closed before sending'))
+                else:
+                    self._deliver(*item)
+            except Exception as error:
+                logger.exception('Could not send an email')
+                self.failed.append((item[0], error))
+            finally:
+                with self._idle:
+                    self._pending -= 1
+                    self._idle.notify_all()
+
+    def _deliver(self, msg, filename):
+        import smtplib
+        for attempt in range(self.max_retries + 1):
+            try:
+                self._session.send(msg)
+            except (smtplib.SMTPException, OSError) as error:
+                if not _is_temporary(error) or attempt == self.max_retries:
+                    logger.error('Could not send the email {!r}: {}'.format(
+                        msg['Subject'], error))
+                    self.failed.append((msg, error))
+                    if filename is not None:
+                        os.replace(filename, os.path.join(
+                            self.spool_dir, 'failed',
+                            os.path.basename(filename)))
+                    return
+                delay = min(self.backoff * 2 ** attempt, self.max_backoff)
+                logger.warning('Sending the email failed ({}); retrying in '
+                               '{:.1f} s'.format(error, delay))
+                if self._stopped.wait(delay):
+                    self._unsent(msg, error)
+                    return
+            else:
+                if filename is not None:
+                    os.remove(filename)
+                return
+
+    def _unsent(self, msg, error):
+        """Record an email not sent because of closing"""
+        # A spooled email is kept, to be sent after the restart
+        logger.error('The email {!r} was not sent before closing'.format(
+            msg['Subject']))
+        self.failed.append((msg, error))
+
+    def drain(self, timeout=None):
+        """
+        Wait until all queued emails are sent (or failed), then close
+
+        Parameters
+        ----------
+        timeout : float (optional)
+            Maximal seconds to wait
+
+        Returns
+        -------
+        bool
+            False if emails were still pending after ``timeout``. They are
+            not sent but added to ``failed`` (and stay in the spool
+            directory, if any).
+        """
+        with self._idle:
+            drained = self._idle.wait_for(lambda: self._pending == 0,
+                                          timeout)
+        self.close()
+        return drained
+
+    def close(self):
+        """
+        Stop the background thread without waiting for pending emails
+
+        The email being sent is finished; the pending ones are added to
+        ``failed`` without being sent. Spooled emails are kept.
+        """
+        if not self._stopped.is_set():
+            self._stopped.set()
+            self._queue.put(None)
+            self._worker.join()
+            self._session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.drain()
+
+
+def _connection_errors():
+    """Errors after which reconnecting may help"""
+    import socket
+    import smtplib
+    return smtplib.SMTPServerDisconnected, ConnectionError, socket.timeout
+
 
-    server.send_message(msg)
-    server.quit()
+def _is_temporary(error):
+    """Whether sending again may succeed"""
+    import smtplib
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    return not isinstance(error, smtplib.SMTPRecipientsRefused)
@@ -1,7 +1,35 @@
 from sklearn.base import BaseEstimator, TransformerMixin
 from sklearn.utils.validation import check_is_fitted
+import numpy as np
 import pandas as pd
 import pubdsutils as pdu
+from pubdsutils.instrumentation import instrumented
+from collections import OrderedDict
+import numbers
+
+# Building blocks of the SQL emitted by ``pipeline_to_sql``
+_SQL_DIALECTS = {
+    'mssql': {
+        'quote': '[{}]',
+        'ratio': 'CAST({numer} AS FLOAT) / NULLIF({denom}, 0)',
+        # DATEDIFF(day, ...) counts crossed midnights; the number of whole
+        # days (as in pandas) is derived from the seconds.
+        'days': 'CAST(FLOOR(DATEDIFF(second, {start}, {end}) / 86400.0) '
+                'AS INT)',
+        # 1900-01-01 is a Monday; independent of the DATEFIRST setting
+        'day_of_week': "(DATEDIFF(day, '19000101', {col}) % 7)",
+        'hour': 'DATEPART(hour, {col})',
+    },
+    'sqlite': {
+        'quote': '"{}"',
+        'ratio': 'CAST({numer} AS REAL) / NULLIF({denom}, 0)',
+        'days': "(CASE WHEN {seconds} >= 0 THEN {seconds} / 86400 "
+                "ELSE -((86399 - {seconds}) / 86400) END)",
+        'seconds': "(strftime('%s', {end}) - strftime('%s', {start}))",
+        'day_of_week': "((CAST(strftime('%w', {col}) AS INTEGER) + 6) % 7)",
+        'hour': "CAST(strftime('%H', {col}) AS INTEGER)",
+    },
+}
 
 
 class RatioBetweenColumns(BaseEstimator, TransformerMixin):
@@ -33,6 +61,7 @@ class RatioBetweenColumns(BaseEstimator, TransformerMixin):
         if self.feat_name is None:
             self.feat_name = "{}To{}Ratio".format(numer, denom)
 
+    @instrumented
     def transform(self, df, **transform_params):
         """
         Returns a copy of ``df`` with a new column (named ``feat_name``) and
@@ -45,6 +74,11 @@ class RatioBetweenColumns(BaseEstimator, TransformerMixin):
             raise ValueError("Non supported input")
         return df
 
+    def _sql_expression(self, column, dialect):
+        return dialect['ratio'].format(numer=column(self.numer),
+                                       denom=column(self.denom))
+
+    @instrumented
     def fit(self, df, y=None, **fit_params):
         """
         Doesn't do anything.
@@ -82,6 +116,7 @@ class RatioColumnToConst(BaseEstimator, TransformerMixin):
         if self.feat_name is None:
             self.feat_name = "{}To{}Ratio".format(self.col, str(self.const))
 
+    @instrumented
     def transform(self, df, **transform_params):
         """
         Returns a copy of ``df`` with a new column (named ``feat_name``) and
@@ -94,6 +129,11 @@ class RatioColumnToConst(BaseEstimator, TransformerMixin):
             raise ValueError("Non supported input")
         return df
 
+    def _sql_expression(self, column, dialect):
+        return dialect['ratio'].format(numer=column(self.col),
+                                       denom=_sql_number(self.const))
+
+    @instrumented
     def fit(self, df, y=None, **fit_params):
         """
         Doesn't do anything.
@@ -147,6 +187,7 @@ class RatioColumnToValue(BaseEstimator, TransformerMixin):
         if self.feat_name is None:
             self.feat_name = "{}_RatioTo_{}".format(self.col, self.func)
 
+    @instrumented
     def transform(self, df, **transform_params):
         """
         Compute the ratio between ``df[col]`` and the mean/median which
@@ -161,6 +202,7 @@ class RatioColumnToValue(BaseEstimator, TransformerMixin):
             raise ValueError("Non supported input")
         return df
 
+    @instrumented
     def fit(self, df, y=None, **fit_params):
         """
         Fits the instance to the mean/median of ``df[col]``
@@ -179,6 +221,33 @@ class RatioColumnToValue(BaseEstimator, TransformerMixin):
             )
         return self
 
+    @instrumented
+    def fit_on_sample(self, df, population_size=None, y=None, **fit_params):
+        """
+        Fits the instance on a random sample of ``df[col]``
+
+        In addition to fitting, estimates the standard error of ``const_``
+        and stores it in ``sample_error_``. For the median, the error is
+        the asymptotic one of normally distributed data.
+
+        Parameters
+        ----------
+        df : DataFrame
+            Random sample of the data, e.g. as fetched by
+            :func:`~pubdsutils.data_fetch.fetch_sample`
+        population_size : int (optional)
+            Number of rows the sample was drawn from. If provided, the error
+            is corrected for sampling from a finite population.
+        """
+        self.fit(df)
+        n = df[self.col].count()
+        error = df[self.col].std() / np.sqrt(n)
+        if self.func == 'median':
+            error *= np.sqrt(np.pi / 2)
+        self.sample_error_ = error * pdu._finite_population_correction(
+            n, population_size)
+        return self
+
 
 class DaysFromLaterToEarly(BaseEstimator, TransformerMixin):
     """
@@ -204,6 +273,7 @@ class DaysFromLaterToEarly(BaseEstimator, TransformerMixin):
         if self.feat_name is None:
             self.feat_name = "DaysFrom_{}_To_{}".format(self.start, self.end)
 
+    @instrumented
     def transform(self, df, **transform_params):
         """
         Returns a copy of ``df`` with a new column (named ``feat_name``) and
@@ -217,6 +287,14 @@ class DaysFromLaterToEarly(BaseEstimator, TransformerMixin):
             raise ValueError("Non supported input")
         return df
 
+    def _sql_expression(self, column, dialect):
+        start, end = column(self.start), column(self.end)
+        if 'seconds' in dialect:
+            return dialect['days'].format(seconds=dialect['seconds'].format(
+                start=start, end=end))
+        return dialect['days'].format(start=start, end=end)
+
+    @instrumented
     def fit(self, df, y=None, **fit_params):
         """
         Doesn't do anything.
@@ -246,6 +324,7 @@ class DayOfTheWeekForColumn(BaseEstimator, TransformerMixin):
         if self.feat_name is None:
             self.feat_name = "{}_DayOfTheWeek".format(col)
 
+    @instrumented
     def transform(self, df, **transform_params):
         """
         Returns a copy of ``df`` with a new column (named ``feat_name``) and
@@ -260,6 +339,12 @@ class DayOfTheWeekForColumn(BaseEstimator, TransformerMixin):
             raise ValueError("Non supported input")
         return df
 
+    _sql_dtype = 'category'
+
+    def _sql_expression(self, column, dialect):
+        return dialect['day_of_week'].format(col=column(self.col))
+
+    @instrumented
     def fit(self, df, y=None, **fit_params):
         """
         Doesn't do anything.
@@ -290,6 +375,7 @@ class HourOfTheDayForColumn(BaseEstimator, TransformerMixin):
         if self.feat_name is None:
             self.feat_name = "{}_HourOfTheDay".format(col)
 
+    @instrumented
     def transform(self, df, **transform_params):
         """
         Returns a copy of ``df`` with a new column (named ``feat_name``) and
@@ -304,6 +390,12 @@ class HourOfTheDayForColumn(BaseEstimator, TransformerMixin):
             raise ValueError("Non supported input")
         return df
 
+    _sql_dtype = 'category'
+
+    def _sql_expression(self, column, dialect):
+        return dialect['hour'].format(col=column(self.col))
+
+    @instrumented
     def fit(self, df, y=None, **fit_params):
         """
         Doesn't do anything.
@@ -327,6 +419,7 @@ class SelectColumns(BaseEstimator, TransformerMixin):
         pdu._is_cols_input_valid(cols)
         self.cols = cols
 
+    @instrumented
     def transform(self, df, **transform_params):
         """
         Returns a copy of ``df`` holding the columns defined in ``cols``
@@ -335,6 +428,7 @@ class SelectColumns(BaseEstimator, TransformerMixin):
         pdu._is_cols_subset_of_df_cols(self.cols, df)
         return df[self.cols].copy()
 
+    @instrumented
     def fit(self, df, y=None, **fit_params):
         """
         Doesn't do anything.
@@ -342,3 +436,121 @@ class SelectColumns(BaseEstimator, TransformerMixin):
         """
         pdu._is_cols_subset_of_df_cols(self.cols, df)
         return self
+
+
+def pipeline_to_sql(pipeline, base_query, dialect='mssql'):
+    """
+    Compile a pipeline of transformers into a single SQL query
+
+    The features of :class:`RatioBetweenColumns`,
+    :class:`RatioColumnToConst`, :class:`DaysFromLaterToEarly`,
+    :class:`DayOfTheWeekForColumn` and :class:`HourOfTheDayForColumn` are
+    computed by the database instead of by pandas. A :class:`SelectColumns`
+    step restricts the selected columns, hence only the needed columns are
+    fetched (e.g. with :func:`~pubdsutils.data_fetch.from_sql_sever`).
+
+    .. code-block:: python
+
+        sql = pipeline_to_sql(pipeline, 'SELECT * FROM orders')
+        df = pd.read_sql(sql, conn).astype(sql_feature_dtypes(pipeline))
+
+    The result matches ``pipeline.transform`` on the result of
+    ``base_query``, except that a division by zero results in ``NULL``
+    instead of ``inf``. Without :class:`SelectColumns`, the names of the
+    features must differ from the columns of ``base_query``.
+
+    Parameters
+    ----------
+    pipeline : sklearn.pipeline.Pipeline or list
+        Pipeline or list of the transformers above
+    base_query : str
+        Query providing the input columns of the pipeline. For MS SQL it must
+        not contain an ``ORDER BY`` clause.
+    dialect : str (default ``mssql``)
+        Either ``mssql`` or ``sqlite``
+
+    Returns
+    -------
+    str
+        SQL query
+    """
+    if dialect not in _SQL_DIALECTS:
+        raise ValueError(
+            "Unsupported dialect ({}). Can be either mssql or "
+            "sqlite".format(dialect))
+    dialect = _SQL_DIALECTS[dialect]
+    # SQL expression of every feature (or selected column) by name
+    features = OrderedDict()
+    # Columns of the result; None stands for all the columns of base_query
+    selected = None
+
+    def column(name):
+        if name in features:
+            return features[name]
+        if selected is not None:
+            raise ValueError(
+                "Column {} was removed by SelectColumns".format(name))
+        return 'base.' + dialect['quote'].format(name)
+
+    for step in _pipeline_steps(pipeline):
+        if isinstance(step, SelectColumns):
+            features = OrderedDict((col, column(col)) for col in step.cols)
+            selected = list(step.cols)
+            continue
+        if not hasattr(step, '_sql_expression'):
+            raise ValueError(
+                "{} cannot be expressed in SQL".format(type(step).__name__))
+        features[step.feat_name] = step._sql_expression(column, dialect)
+        if selected is not None and step.feat_name not in selected:
+            selected.append(step.feat_name)
+
+    if selected is None:
+        select = ['base.*'] + [
+            '{} AS {}'.format(expression, dialect['quote'].format(name))
+            for name, expression in features.items()]
+    else:
+        select = ['{} AS {}'.format(features[name],
+                                    dialect['quote'].format(name))
+                  for name in selected]
+    return 'SELECT {}\nFROM (\n{}\n) AS base'.format(
+        ',\n       '.join(select), base_query)
+
+
+def sql_feature_dtypes(pipeline):
+    """
+    The dtypes ``pipeline.transform`` assigns to the features
+
+    Use with ``DataFrame.astype`` on the result of the query compiled by
+    :func:`pipeline_to_sql`.
+
+    Returns
+    -------
+    dict
+    """
+    dtypes = {}
+    for step in _pipeline_steps(pipeline):
+        if isinstance(step, SelectColumns):
+            dtypes = {col: dtype for col, dtype in dtypes.items()
+                      if col in step.cols}
+        elif getattr(step, '_sql_dtype', None) is not None:
+            dtypes[step.feat_name] = step._sql_dtype
+        else:
+            dtypes.pop(getattr(step, 'feat_name', None), None)
+    return dtypes
+
+
+def _sql_number(value):
+    """SQL literal of a finite number (also of numpy scalars)"""
+    if not isinstance(value, (bool, np.bool_)):
+        if isinstance(value, numbers.Integral):
+            return str(int(value))
+        if isinstance(value, numbers.Real) and np.isfinite(value):
+            return repr(float(value))
+    raise ValueError("Only finite numbers can be translated to SQL, got "
+                     "{!r}".format(value))
+
+
+def _pipeline_steps(pipeline):
+    if hasattr(pipeline, 'steps'):
+        return [step for _, step in pipeline.steps]
+    return list(pipeline)
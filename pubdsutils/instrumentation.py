@@ -0,0 +1,573 @@
+"""
+Timing and memory hooks of the hot paths of pubdsutils
+
+Instrumentation is disabled by default, in which case an instrumented
+function only checks a global flag before being called. Once enabled (see
+:func:`enable`, or set the environment variable
+``PUBDSUTILS_INSTRUMENTATION=1``), every call of an instrumented function
+records its wall time, the rows processed, the bytes of the frame it returns
+and, optionally, its peak memory. The records are aggregated per function
+into histograms which can be exported as JSON or in the Prometheus text
+format:
+
+.. code-block:: python
+
+    from pubdsutils import instrumentation
+
+    instrumentation.enable()
+    pipeline.fit_transform(df)
+    with open('metrics.prom', 'w') as prom_file:
+        prom_file.write(instrumentation.to_prometheus())
+
+Instrumented are the ``fit``/``transform`` methods of the transformers,
+:func:`~pubdsutils.data_fetch.from_sql_sever`,
+:func:`~pubdsutils.data_fetch.persist_df` and
+:func:`~pubdsutils.email.send_df`.
+
+The memory of the steps of a pipeline (input and output frames, peak, copies
+and dtype changes) is measured by :func:`profile_pipeline_memory`.
+"""
+import os
+import json
+import time
+import threading
+import functools
+import tracemalloc
+from contextlib import contextmanager
+# pandas is imported within the functions using it, so that importing the
+# instrumented modules without pandas (pubdsutils.email) stays fast
+
+# Upper bounds of the histogram buckets
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1., 5., 10., 30.,
+                    60., 300., float('inf'))
+ROWS_BUCKETS = (0, 10, 100, 1000, 10000, 100000, 1000000, 10000000,
+                100000000, float('inf'))
+
+_enabled = os.environ.get('PUBDSUTILS_INSTRUMENTATION', '') not in ('', '0')
+_trace_memory = False
+_lock = threading.Lock()
+_metrics = {}
+_local = threading.local()
+# Counts of DataFrame copies running, sharing one patch of DataFrame.copy
+_copies_lock = threading.Lock()
+_copy_counters = {}
+_copy_patch = {}
+
+
+def enable(trace_memory=False):
+    """
+    Start recording the calls of instrumented functions
+
+    Parameters
+    ----------
+    trace_memory : boolean, default False
+        Also record the peak memory of the calls, with ``tracemalloc``. This
+        slows down all allocations considerably. On Python < 3.9 the peak of
+        nested calls can't be reset, and is that since the start of the
+        outermost call.
+    """
+    global _enabled, _trace_memory
+    _trace_memory = trace_memory
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    _enabled = True
+
+
+def disable():
+    """Stop recording (and tracing memory); the metrics are kept"""
+    global _enabled, _trace_memory
+    if _trace_memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    _enabled = False
+    _trace_memory = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def reset():
+    """Forget all recorded metrics"""
+    with _lock:
+        _metrics.clear()
+
+
+class Histogram(object):
+    """
+    Cumulative histogram as in Prometheus
+
+    Attributes
+    ----------
+    buckets : tuple
+        Upper bounds of the buckets, the last one infinite
+    counts : list
+        Number of observations per bucket (not cumulative)
+    sum : float
+        Sum of the observations
+    count : int
+        Number of observations
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        for number, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[number] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """Pairs of the upper bounds and the number of values up to them"""
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def to_dict(self):
+        return {'buckets': [[_format_bound(bound), count]
+                            for bound, count in self.cumulative()],
+                'sum': self.sum, 'count': self.count}
+
+
+class _FunctionMetrics(object):
+    """Aggregated records of one instrumented function"""
+
+    def __init__(self):
+        self.duration = Histogram(DURATION_BUCKETS)
+        self.rows = Histogram(ROWS_BUCKETS)
+        self.bytes_copied = 0
+        self.peak_memory = None
+        self.errors = 0
+
+    def record(self, duration, rows, bytes_copied, peak_memory, failed):
+        self.duration.observe(duration)
+        if rows is not None:
+            self.rows.observe(rows)
+        self.bytes_copied += bytes_copied
+        if peak_memory is not None:
+            self.peak_memory = max(self.peak_memory or 0, peak_memory)
+        self.errors += failed
+
+    def to_dict(self):
+        return {'calls': self.duration.count,
+                'errors': self.errors,
+                'duration_seconds': self.duration.to_dict(),
+                'rows': self.rows.to_dict(),
+                'rows_per_second': (self.rows.sum / self.duration.sum
+                                    if self.duration.sum else None),
+                'bytes_copied': self.bytes_copied,
+                'peak_memory_bytes': self.peak_memory}
+
+
+def instrumented(func=None, name=None):
+    """
+    Decorator recording the calls of a function, when enabled
+
+    The rows processed are the length of the first pandas argument (e.g.
+    ``df`` of ``transform``), or else of the returned frame. The bytes
+    copied are the (shallow) memory of the returned frame, if it is a new
+    one.
+
+    .. code-block:: python
+
+        @instrumented
+        def transform(self, df):
+            ...
+
+    Parameters
+    ----------
+    func : callable
+    name : str (optional)
+        Name of the metrics, by default the qualified name of ``func``, e.g.
+        ``SelectColumns.transform``
+    """
+    if func is None:
+        return functools.partial(instrumented, name=name)
+    name = name or func.__qualname__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _enabled:
+            return func(*args, **kwargs)
+        return _record(name, func, args, kwargs)
+    return wrapper
+
+
+def _record(name, func, args, kwargs):
+    depth = getattr(_local, 'depth', 0)
+    tracing = _trace_memory and tracemalloc.is_tracing()
+    if tracing:
+        start_memory = _reset_peak(clear=depth == 0)
+    _local.depth = depth + 1
+    result = None
+    failed = True
+    start = time.perf_counter()
+    try:
+        result = func(*args, **kwargs)
+        failed = False
+        return result
+    finally:
+        duration = time.perf_counter() - start
+        _local.depth = depth
+        peak_memory = _peak_since(start_memory) if tracing else None
+        rows, bytes_copied = _frame_stats(args, kwargs, result)
+        with _lock:
+            metrics = _metrics.setdefault(name, _FunctionMetrics())
+            metrics.record(duration, rows, bytes_copied, peak_memory, failed)
+
+
+def _reset_peak(clear):
+    """
+    Reset the peak of tracemalloc, or on Python < 3.9 clear the traces if
+    ``clear``; returns the currently traced memory
+    """
+    if hasattr(tracemalloc, 'reset_peak'):
+        tracemalloc.reset_peak()
+    elif clear:
+        tracemalloc.clear_traces()
+    return tracemalloc.get_traced_memory()[0]
+
+
+def _peak_since(start_memory):
+    """Peak memory on top of ``start_memory`` since :func:`_reset_peak`"""
+    return max(tracemalloc.get_traced_memory()[1] - start_memory, 0)
+
+
+def _frame_stats(args, kwargs, result):
+    """Rows processed and bytes of the returned frame"""
+    import pandas as pd
+    pandas_types = (pd.DataFrame, pd.Series)
+    inputs = [arg for arg in list(args) + list(kwargs.values())
+              if isinstance(arg, pandas_types)]
+    rows = None
+    if inputs:
+        rows = len(inputs[0])
+    elif isinstance(result, pandas_types):
+        rows = len(result)
+    bytes_copied = 0
+    if isinstance(result, pandas_types) and \
+            not any(arg is result for arg in inputs):
+        bytes_copied = int(result.memory_usage(index=True).sum())
+    return rows, bytes_copied
+
+
+def metrics():
+    """
+    The recorded metrics
+
+    Returns
+    -------
+    dict
+        Maps the name of each called function to its number of calls and
+        errors, histograms of durations and rows (``buckets`` are cumulative
+        counts per upper bound), rows per second, bytes copied and the peak
+        memory
+    """
+    with _lock:
+        return {name: function_metrics.to_dict()
+                for name, function_metrics in sorted(_metrics.items())}
+
+
+def to_json(**kwargs):
+    """
+    The metrics (see :func:`metrics`) as JSON
+
+    Parameters
+    ----------
+    **kwargs :
+        passed to json.dumps()
+    """
+    return json.dumps(metrics(), **kwargs)
+
+
+def to_prometheus(prefix='pubdsutils'):
+    """
+    The metrics in the Prometheus text exposition format
+
+    Parameters
+    ----------
+    prefix : str (default 'pubdsutils')
+        Prefix of the metric names
+
+    Returns
+    -------
+    str
+    """
+    with _lock:
+        items = sorted(_metrics.items())
+        lines = []
+        for metric, kind, help_text in [
+                ('call_duration_seconds', 'histogram',
+                 'Wall time of the calls'),
+                ('rows', 'histogram', 'Rows processed per call'),
+                ('call_errors_total', 'counter', 'Calls raising an error'),
+                ('bytes_copied_total', 'counter',
+                 'Bytes of the frames returned'),
+                ('peak_memory_bytes', 'gauge',
+                 'Maximal peak memory of a call')]:
+            full_name = '{}_{}'.format(prefix, metric)
+            lines += ['# HELP {} {}'.format(full_name, help_text),
+                      '# TYPE {} {}'.format(full_name, kind)]
+            for name, function_metrics in items:
+                label = 'function="{}"'.format(name)
+                if kind == 'histogram':
+                    histogram = function_metrics.duration \
+                        if metric == 'call_duration_seconds' \
+                        else function_metrics.rows
+                    for bound, count in histogram.cumulative():
+                        lines.append('{}_bucket{{{},le="{}"}} {}'.format(
+                            full_name, label, _format_bound(bound), count))
+                    lines.append('{}_sum{{{}}} {}'.format(
+                        full_name, label, histogram.sum))
+                    lines.append('{}_count{{{}}} {}'.format(
+                        full_name, label, histogram.count))
+                    continue
+                value = {'call_errors_total': function_metrics.errors,
+                         'bytes_copied_total': function_metrics.bytes_copied,
+                         'peak_memory_bytes': function_metrics.peak_memory
+                         }[metric]
+                if value is not None:
+                    lines.append('{}{{{}}} {}'.format(full_name, label,
+                                                      value))
+    return '\n'.join(lines) + '\n'
+
+
+def _format_bound(bound):
+    return '+Inf' if bound == float('inf') else repr(bound)
+
+
+# Allocation sites per step in the stacks of profile_pipeline_memory
+TOP_ALLOCATIONS = 20
+
+PIPELINE_PROFILE_COLUMNS = ['step', 'transformer', 'seconds', 'rows_in',
+                            'rows_out', 'memory_in', 'memory_out',
+                            'peak_memory', 'copies', 'dtype_changes',
+                            'columns_added', 'columns_removed']
+
+
+class PipelineMemoryProfile(object):
+    """
+    Memory used by the steps of a pipeline, see
+    :func:`profile_pipeline_memory`
+
+    Attributes
+    ----------
+    table : pandas.DataFrame
+        One row per step with:
+
+        - ``seconds``: wall time of the step (slowed down by tracing)
+        - ``rows_in`` and ``rows_out``: rows of the input and output frames
+        - ``memory_in`` and ``memory_out``: deep memory of the input and
+          output frames in bytes
+        - ``peak_memory``: peak of the memory allocated during the step on
+          top of the memory before it, in bytes
+        - ``copies``: number of deep ``DataFrame.copy`` calls (explicit or
+          within pandas) of at least half the size of the input frame.
+          ``DataFrame.copy`` is patched for the whole process during the
+          run, so copies made meanwhile by other threads are counted too
+        - ``dtype_changes``: list of the changed dtypes of the columns kept,
+          e.g. ``'v1: int64 -> float64'``
+        - ``columns_added`` and ``columns_removed``: lists of column names
+    stacks : list
+        Pairs of a call stack (tuple of frame names, outermost first) and
+        bytes, see :meth:`to_collapsed`
+    """
+
+    def __init__(self, table, stacks):
+        self.table = table
+        self.stacks = stacks
+
+    def to_collapsed(self):
+        """
+        The peak memory of the steps in the collapsed stack format of
+        flamegraph.pl or speedscope, e.g. ``pipeline;scale 1048576``
+
+        With ``traceback_frames``, the memory still allocated at the end of
+        each step is broken down by where it was allocated (the
+        ``TOP_ALLOCATIONS`` largest sites), the step keeping the remainder of
+        its peak.
+
+        Returns
+        -------
+        str
+        """
+        return ''.join('{} {}\n'.format(';'.join(stack), int(size))
+                       for stack, size in self.stacks if size > 0)
+
+
+def profile_pipeline_memory(pipeline, df, y=None, fit=True,
+                            traceback_frames=0):
+    """
+    Run a pipeline step by step, measuring the memory of each step
+
+    The steps are run as by ``pipeline.fit_transform(df, y)`` (or
+    ``pipeline.transform(df)``), hence fitted in place, while
+    ``tracemalloc`` traces the allocations.
+
+    .. code-block:: python
+
+        profile = profile_pipeline_memory(make_pipeline(...), df)
+        profile.table.sort_values('peak_memory')
+        with open('pipeline.folded', 'w') as folded:
+            folded.write(profile.to_collapsed())
+
+    Parameters
+    ----------
+    pipeline : sklearn.pipeline.Pipeline
+    df : pandas.DataFrame
+        Input of the first step
+    y : array-like (optional)
+        Passed to the ``fit`` of the steps
+    fit : boolean, default True
+        Fit the steps, or only transform with the fitted steps
+    traceback_frames : int, default 0
+        If positive, the number of frames stored per allocation, to break
+        down the memory held at the end of each step (see
+        :meth:`PipelineMemoryProfile.to_collapsed`)
+
+    Returns
+    -------
+    PipelineMemoryProfile
+    """
+    import pandas as pd
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start(max(traceback_frames, 1))
+    rows, stacks = [], []
+    try:
+        steps = [(name, step) for name, step in pipeline.steps
+                 if step is not None and step != 'passthrough']
+        for number, (name, step) in enumerate(steps):
+            is_last = number == len(steps) - 1
+            row, df, step_stacks = _profile_step(
+                name, step, df, y, fit, is_last, traceback_frames)
+            rows.append(row)
+            stacks += step_stacks
+    finally:
+        if started:
+            tracemalloc.stop()
+    return PipelineMemoryProfile(
+        pd.DataFrame(rows, columns=PIPELINE_PROFILE_COLUMNS), stacks)
+
+
+def _profile_step(name, step, df, y, fit, is_last, traceback_frames):
+    """Run a step; returns its row of the table, output and stacks"""
+    import pandas as pd
+    memory_in = _deep_memory(df)
+    threshold = 0.5 * _shallow_memory(df)
+    start_memory = _reset_peak(clear=True)
+    start = time.perf_counter()
+    with _counting_copies(threshold) as copies:
+        if not fit:
+            result = step.transform(df)
+        elif hasattr(step, 'fit_transform'):
+            result = step.fit_transform(df, y)
+        else:
+            result = step.fit(df, y)
+            result = None if is_last else step.transform(df)
+    seconds = time.perf_counter() - start
+    peak_memory = _peak_since(start_memory)
+
+    stacks = []
+    if traceback_frames > 0:
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, tracemalloc.__file__),
+             tracemalloc.Filter(False, __file__)])
+        # The largest sites, the rest is left to the step; the frames are
+        # ordered from the oldest since Python 3.7
+        for stat in snapshot.statistics('traceback')[:TOP_ALLOCATIONS]:
+            frames = tuple('{}:{}'.format(os.path.basename(frame.filename),
+                                          frame.lineno)
+                           for frame in stat.traceback)
+            stacks.append((('pipeline', name) + frames, stat.size))
+    held = sum(size for _, size in stacks)
+    stacks.insert(0, (('pipeline', name), max(peak_memory - held, 0)))
+
+    dtypes_in = getattr(df, 'dtypes', pd.Series([]))
+    dtypes_out = getattr(result, 'dtypes', pd.Series([]))
+    if not isinstance(dtypes_in, pd.Series):
+        dtypes_in = pd.Series([dtypes_in], index=[getattr(df, 'name', 0)])
+    if not isinstance(dtypes_out, pd.Series):
+        dtypes_out = pd.Series([dtypes_out],
+                               index=[getattr(result, 'name', 0)])
+    kept = [col for col in dtypes_out.index if col in dtypes_in.index]
+    row = [name, type(step).__name__, seconds, _length(df),
+           _length(result), memory_in, _deep_memory(result), peak_memory,
+           copies['count'],
+           ['{}: {} -> {}'.format(col, dtypes_in[col], dtypes_out[col])
+            for col in kept if dtypes_in[col] != dtypes_out[col]],
+           [col for col in dtypes_out.index if col not in dtypes_in.index],
+           [col for col in dtypes_in.index if col not in dtypes_out.index]]
+    return row, result, stacks
+
+
+@contextmanager
+def _counting_copies(threshold):
+    """
+    Count deep DataFrame copies of at least ``threshold`` bytes
+
+    ``DataFrame.copy`` is patched for the whole process while any count is
+    running, so copies made by other threads are counted too. The patch is
+    shared by concurrent counts and removed by the last one to finish.
+    """
+    import pandas as pd
+    counter = {'count': 0, 'threshold': threshold}
+    with _copies_lock:
+        if not _copy_counters:
+            _copy_patch['own'] = pd.DataFrame.__dict__.get('copy')
+            original = pd.DataFrame.copy
+
+            @functools.wraps(original)
+            def copy(self, deep=True):
+                if deep:
+                    size = _shallow_memory(self)
+                    with _copies_lock:
+                        for active in _copy_counters.values():
+                            if size >= active['threshold']:
+                                active['count'] += 1
+                return original(self, deep=deep)
+
+            pd.DataFrame.copy = copy
+        _copy_counters[id(counter)] = counter
+    try:
+        yield counter
+    finally:
+        with _copies_lock:
+            del _copy_counters[id(counter)]
+            if not _copy_counters:
+                own = _copy_patch.pop('own')
+                if own is None:
+                    del pd.DataFrame.copy
+                else:
+                    pd.DataFrame.copy = own
+
+
+def _length(obj):
+    import pandas as pd
+    return len(obj) if isinstance(obj, (pd.DataFrame, pd.Series)) else None
+
+
+def _shallow_memory(obj):
+    import pandas as pd
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(index=True).sum())
+    if isinstance(obj, pd.Series):
+        return int(obj.memory_usage(index=True))
+    return 0
+
+
+def _deep_memory(obj):
+    import pandas as pd
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(index=True, deep=True).sum())
+    if isinstance(obj, pd.Series):
+        return int(obj.memory_usage(index=True, deep=True))
+    return getattr(obj, 'nbytes', 0)
@@ -6,15 +6,14 @@ scikit-learn
 """
 
 from sklearn.base import BaseEstimator, TransformerMixin
-from sklearn.preprocessing import OneHotEncoder
-from sklearn.preprocessing import StandardScaler
-from sklearn.preprocessing import LabelEncoder
 from sklearn.exceptions import NotFittedError
 
 from sklearn.utils.validation import check_is_fitted
+import numpy as np
 import pandas as pd
 
 import pubdsutils as pdu
+from pubdsutils.instrumentation import instrumented
 
 
 class RemoveConstantColumns(TransformerMixin):
@@ -28,6 +27,7 @@ class RemoveConstantColumns(TransformerMixin):
         List may be of length 1.
     """
 
+    @instrumented
     def transform(self, df, **transform_params):
         """
         Returns a copy of ``df`` where the constant columns (as identified)
@@ -42,6 +42,7 @@ class RemoveConstantColumns(TransformerMixin):
         check_is_fitted(self, 'const_cols')
         return df.drop(self.const_cols, axis=1)
 
+    @instrumented
     def fit(self, df, y=None, **fit_params):
         """
         Identify the constant columns
@@ -87,8 +88,11 @@ class ColumnsOneHotEncoder(BaseEstimator, TransformerMixin):
         pdu._is_cols_input_valid(cols)
         self.cols = cols
         self.n_values = n_values
+        # Imported on use, sklearn.preprocessing takes long to import
+        from sklearn.preprocessing import OneHotEncoder
         self.ohe = OneHotEncoder(n_values=self.n_values)
 
+    @instrumented
     def transform(self, df, y=None, **trans_param):
         """
         Returns a copy of ``df`` where ``cols`` are replaced with their
@@ -109,6 +113,7 @@ class ColumnsOneHotEncoder(BaseEstimator, TransformerMixin):
         )
         return pd.concat([df.drop(self.cols, axis=1), ohe_cols_df], axis=1)
 
+    @instrumented
     def fit(self, df, y=None, **fit_params):
         """
         Fitting the instance on ``df``
@@ -147,9 +152,11 @@ class StandardizeFloatCols(BaseEstimator, TransformerMixin):
     def __init__(self, cols=None):
         pdu._is_cols_input_valid(cols)
         self.cols = cols
+        from sklearn.preprocessing import StandardScaler
         self.standard_scaler = StandardScaler()
         self._is_fitted = False
 
+    @instrumented
     def transform(self, df, **transform_params):
         """
         Scaling ``cols`` of ``df`` using the fitting
@@ -179,6 +186,7 @@ class StandardizeFloatCols(BaseEstimator, TransformerMixin):
         df = pd.concat([df, standartize_cols], axis=1)
         return df
 
+    @instrumented
     def fit(self, df, y=None, **fit_params):
         """
         Fitting the preprocessing
@@ -194,6 +202,36 @@ class StandardizeFloatCols(BaseEstimator, TransformerMixin):
         self._is_fitted = True
         return self
 
+    @instrumented
+    def fit_on_sample(self, df, population_size=None, y=None, **fit_params):
+        """
+        Fitting the preprocessing on a random sample of the data
+
+        In addition to fitting, estimates the standard errors of the fitted
+        means and standard deviations and stores them in ``sample_errors_``
+        (a DataFrame indexed by ``cols`` with the columns ``mean`` and
+        ``std``). The error of the standard deviation assumes normally
+        distributed data.
+
+        Parameters
+        ----------
+        df : DataFrame
+            Random sample of the data, e.g. as fetched by
+            :func:`~pubdsutils.data_fetch.fetch_sample`
+        population_size : int (optional)
+            Number of rows the sample was drawn from. If provided, the errors
+            are corrected for sampling from a finite population.
+        """
+        self.fit(df)
+        n = len(df)
+        std = df[self.cols].std()
+        fpc = pdu._finite_population_correction(n, population_size)
+        self.sample_errors_ = pd.DataFrame({
+            'mean': fpc * std / np.sqrt(n),
+            'std': fpc * std / np.sqrt(2 * (n - 1)),
+        }, columns=['mean', 'std'])
+        return self
+
 
 class LabelEncodingColoumns(BaseEstimator, TransformerMixin):
     """Label encoding selected columns
@@ -211,9 +249,11 @@ class LabelEncodingColoumns(BaseEstimator, TransformerMixin):
     def __init__(self, cols=None):
         pdu._is_cols_input_valid(cols)
         self.cols = cols
+        from sklearn.preprocessing import LabelEncoder
         self.les = {col: LabelEncoder() for col in cols}
         self._is_fitted = False
 
+    @instrumented
     def transform(self, df, **transform_params):
         """
         Label encoding ``cols`` of ``df`` using the fitting
@@ -244,6 +284,7 @@ class LabelEncodingColoumns(BaseEstimator, TransformerMixin):
             df[col] = labelenc_cols[col]
         return df
 
+    @instrumented
     def fit(self, df, y=None, **fit_params):
         """
         Fitting the preprocessing
@@ -259,3 +300,32 @@ class LabelEncodingColoumns(BaseEstimator, TransformerMixin):
             self.les[col].fit(df[col])
         self._is_fitted = True
         return self
+
+    @instrumented
+    def fit_on_sample(self, df, population_size=None, y=None, **fit_params):
+        """
+        Fitting the preprocessing on a random sample of the data
+
+        The vocabularies learned from a sample may miss rare labels, which
+        then can't be transformed. In addition to fitting, estimates for
+        every column the share of the rows in the complete data having a
+        label missing from the vocabulary (Good-Turing estimate: the share
+        of the sample's labels which occur exactly once). The estimates are
+        stored in ``sample_errors_`` (a Series indexed by ``cols``).
+
+        Parameters
+        ----------
+        df : DataFrame
+            Random sample of the data, e.g. as fetched by
+            :func:`~pubdsutils.data_fetch.fetch_sample`
+        population_size : int (optional)
+            Number of rows the sample was drawn from. If it equals the size
+            of the sample, no label can be missing.
+        """
+        self.fit(df)
+        fpc = pdu._finite_population_correction(len(df), population_size)
+        self.sample_errors_ = pd.Series({
+            col: fpc * (df[col].value_counts() == 1).sum() / len(df)
+            for col in self.cols
+        })[self.cols]
+        return self
@@ -0,0 +1,229 @@
+"""
+Column statistics of a DataFrame in one pass per column
+"""
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from pubdsutils.calcs import ValueCountsAccumulator, HyperLogLog, \
+    HeavyHitters
+
+PROFILE_COLUMNS = ['dtype', 'count', 'null_count', 'null_ratio', 'nunique',
+                   'constant', 'min', 'max', 'top', 'top_ratio']
+
+
+def profile_df(df, top=3, n_jobs=1):
+    """
+    Profile the columns of a DataFrame
+
+    Each column is factorized once; the null count, number of unique values,
+    minimum, maximum and most frequent values are all derived from its value
+    counts (see :class:`~pubdsutils.calcs.ValueCountsAccumulator`).
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+    top : int (default 3)
+        Number of most frequent values to report
+    n_jobs : int (default 1)
+        Number of columns profiled in parallel (threads)
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per column of ``df``, see :meth:`DataFrameProfiler.to_frame`
+    """
+    return DataFrameProfiler(top=top, n_jobs=n_jobs).update(df).to_frame()
+
+
+class DataFrameProfiler(object):
+    """
+    Profile a DataFrame given in chunks
+
+    Chunks of the same columns, e.g. from a streaming fetch, are added with
+    :meth:`update`; profilers of different chunks can be merged.
+
+    .. code-block:: python
+
+        profiler = DataFrameProfiler(exact=False)
+        for chunk in pd.read_sql(query, conn, chunksize=100000):
+            profiler.update(chunk)
+        profiler.to_frame()
+
+    Attributes
+    ----------
+    top : int (default 3)
+        Number of most frequent values to report
+    exact : boolean (default True)
+        Count exactly, i.e. keep the counts of all values of all columns. If
+        False, the memory is fixed per column: the number of unique values is
+        estimated by a :class:`~pubdsutils.calcs.HyperLogLog` and the most
+        frequent values by :class:`~pubdsutils.calcs.HeavyHitters`.
+    n_jobs : int (default 1)
+        Number of columns profiled in parallel (threads)
+    p : int (default 14)
+        Precision of the HyperLogLog if not ``exact``
+    k : int (default 100)
+        Number of values tracked by the HeavyHitters if not ``exact``
+    n_rows : int
+        Number of rows profiled
+    """
+
+    def __init__(self, top=3, exact=True, n_jobs=1, p=14, k=100):
+        self.top = top
+        self.exact = exact
+        self.n_jobs = n_jobs
+        self.p = p
+        self.k = k
+        self.n_rows = 0
+        self._columns = {}
+
+    def update(self, df):
+        """
+        Profile a chunk
+
+        Parameters
+        ----------
+        df : pandas.DataFrame
+
+        Returns
+        -------
+        self
+        """
+        for col in df.columns:
+            if col not in self._columns:
+                self._columns[col] = _ColumnProfile(
+                    df[col].dtype, self.exact, self.p, self.k)
+        updates = [(self._columns[col], df[col]) for col in df.columns]
+        if self.n_jobs == 1:
+            for profile, s in updates:
+                profile.update(s)
+        else:
+            with ThreadPoolExecutor(self.n_jobs) as executor:
+                list(executor.map(lambda args: args[0].update(args[1]),
+                                  updates))
+        self.n_rows += len(df)
+        return self
+
+    def merge(self, other):
+        """
+        Add the profile of another profiler (with the same ``exact``)
+
+        Returns
+        -------
+        self
+        """
+        if other.exact != self.exact:
+            raise ValueError('Only profilers with the same exact can be '
+                             'merged')
+        for col, profile in other._columns.items():
+            if col in self._columns:
+                self._columns[col].merge(profile)
+            else:
+                self._columns[col] = profile
+        self.n_rows += other.n_rows
+        return self
+
+    def to_frame(self):
+        """
+        The profile
+
+        Returns
+        -------
+        pandas.DataFrame
+            Indexed by the columns, with:
+
+            - ``dtype``: the data type (of the first chunk)
+            - ``count`` and ``null_count``: number of non-null and null values
+            - ``null_ratio``: ratio of null values
+            - ``nunique``: number of unique non-null values
+            - ``constant``: whether there is exactly one unique value, as
+              identified by
+              :class:`~pubdsutils.preprocessing.RemoveConstantColumns`
+            - ``min`` and ``max``: NaN if the values can't be compared
+            - ``top`` and ``top_ratio``: lists of the most frequent values
+              and their ratios of the non-null values, as by
+              :func:`~pubdsutils.calcs.value_counts_comb`
+        """
+        rows = [self._columns[col].summary(self.top) for col in self._columns]
+        return pd.DataFrame(rows, index=pd.Index(list(self._columns)),
+                            columns=PROFILE_COLUMNS)
+
+
+class _ColumnProfile(object):
+    """Value counts, or sketches, of a column"""
+
+    def __init__(self, dtype, exact, p, k):
+        self.dtype = dtype
+        self.exact = exact
+        self.n_null = 0
+        self.min = np.nan
+        self.max = np.nan
+        self.comparable = True
+        if exact:
+            self.counts = ValueCountsAccumulator()
+        else:
+            self.distinct = HyperLogLog(p)
+            self.hitters = HeavyHitters(k)
+
+    def update(self, s):
+        if self.exact:
+            self.counts.update(s)
+            return
+        self.n_null += int(s.isna().sum())
+        self.distinct.update(s)
+        self.hitters.update(s)
+        self._update_range(s)
+
+    def merge(self, other):
+        if self.exact:
+            self.counts.merge(other.counts)
+            return
+        self.n_null += other.n_null
+        self.distinct.merge(other.distinct)
+        self.hitters.merge(other.hitters)
+        self._update_range(pd.Series([other.min, other.max]))
+
+    def _update_range(self, values):
+        if not self.comparable:
+            return
+        values = pd.Series(values).dropna()
+        if len(values):
+            values = pd.concat([values,
+                                pd.Series([self.min, self.max]).dropna()])
+            self.min, self.max = _range(values)
+            self.comparable = not pd.isna(self.min)
+
+    def summary(self, top):
+        if self.exact:
+            counts = self.counts.to_series()
+            is_null = counts.index.isna()
+            n_null = int(counts[is_null].sum())
+            counts = counts[~is_null]
+            counts = counts[counts > 0]
+            n_values, nunique = int(counts.sum()), len(counts)
+            minimum, maximum = _range(counts.index)
+            top_frame = self.counts.to_frame().iloc[:top]
+        else:
+            n_null = self.n_null
+            n_values = int(self.hitters.n_rows)
+            nunique = self.distinct.count()
+            minimum, maximum = self.min, self.max
+            top_frame = self.hitters.to_frame(top)
+        n_rows = n_values + n_null
+        return [str(self.dtype), n_values, n_null,
+                n_null / n_rows if n_rows else np.nan, nunique,
+                nunique == 1, minimum, maximum, list(top_frame.index),
+                list(top_frame['Ratio'])]
+
+
+def _range(values):
+    """Minimum and maximum, NaN if the values are not comparable"""
+    if not len(values):
+        return np.nan, np.nan
+    if (isinstance(values.dtype, pd.CategoricalDtype)
+            and not values.dtype.ordered):
+        values = values.astype(object)
+    try:
+        return values.min(), values.max()
+    except (TypeError, ValueError):
+        return np.nan, np.nan
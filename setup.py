@@ -8,6 +8,7 @@ setup(name='pubdsutils',
       packages=['pubdsutils'],
       install_requires=[
           'flake8>=3.3.0',
+          'importlib_metadata; python_version < "3.8"',
           'numpy>=1.13.0',
           'pandas>=0.20.2',
           'pytest>=3.1.2',
@@ -16,5 +17,9 @@ setup(name='pubdsutils',
           'scipy>=0.19.0',
           'pytest'
       ],
+      extras_require={
+          'arrow': ['pyarrow>=0.17.0'],
+          'mssql': ['pymssql'],
+      },
       python_requires='>=3',
       zip_safe=False)
@@ -1,6 +1,8 @@
+import pickle
 import unittest
+import numpy as np
 import pandas as pd
-from pandas.testing import assert_frame_equal
+from pandas.testing import assert_frame_equal, assert_series_equal
 from pubdsutils import calcs as ca
 
 
@@ -31,3 +33,339 @@ class TestValueCounts(unittest.TestCase):
         ).sort_values('Ratio', ascending=False)
         print(ca.value_counts_comb(df.v1))
         assert_frame_equal(ca.value_counts_comb(df.v1), expected)
+
+    def test_value_counts_comb_like_value_counts(self):
+        s = pd.Series([3., 1., np.nan, 1., 2., 3., 3., np.nan, 3., 1., 3.])
+        for kwargs in [{}, {'dropna': False}, {'ascending': True},
+                       {'bins': 3}]:
+            expected = pd.concat(
+                [s.value_counts(normalize=True, **kwargs),
+                 s.value_counts(**kwargs)],
+                keys=['Ratio', 'Count'], axis=1)
+            assert_frame_equal(ca.value_counts_comb(s, **kwargs), expected)
+        assert_frame_equal(ca.value_counts_comb(s, sort=False).sort_index(),
+                           ca.value_counts_comb(s).sort_index())
+
+    def test_value_counts_comb_ties(self):
+        s = pd.Series(['b', 'c', 'a', 'c', 'a', 'b', 'd'])
+        self.assertEqual(list(ca.value_counts_comb(s).index),
+                         ['b', 'c', 'a', 'd'])
+        self.assertEqual(list(ca.value_counts_comb(s, ascending=True).index),
+                         ['d', 'b', 'c', 'a'])
+
+    def test_value_counts_comb_categorical(self):
+        s = pd.Series(pd.Categorical(['a', 'b', 'a'],
+                                     categories=['a', 'b', 'c']))
+        self.assertEqual(list(ca.value_counts_comb(s)['Count']), [2, 1, 0])
+
+        s = pd.Series(pd.Categorical(['c', None, 'a', 'c'],
+                                     categories=['a', 'b', 'c']))
+        for dropna in [True, False]:
+            counts = ca.value_counts_comb(s, sort=False, dropna=dropna)
+            self.assertIsInstance(counts.index, pd.CategoricalIndex)
+            self.assertEqual(counts.index.dtype, s.dtype)
+            assert_series_equal(counts['Count'],
+                                s.value_counts(sort=False, dropna=dropna),
+                                check_names=False)
+
+    def test_value_counts_comb_nan_ties(self):
+        # NaN in its order of appearance, like value_counts of pandas >= 2
+        s = pd.Series(['b', None, 'a', 'b', None, 'a', 'c'])
+        for sort in [True, False]:
+            counts = ca.value_counts_comb(s, sort=sort, dropna=False)
+            self.assertEqual(counts.index[:2].tolist(), ['b', np.nan])
+            self.assertEqual(counts.index[2:].tolist(), ['a', 'c'])
+
+
+class TestValueCountsCombDf(unittest.TestCase):
+
+    def setUp(self):
+        self.df = pd.DataFrame({
+            'country': ['DE', 'FR', 'DE', 'DE', None, 'FR'],
+            'kind': ['a', 'b', 'b', 'a', 'a', 'b'],
+            'n': [1, 2, 3, 1, 1, 2]
+        })
+
+    def test_single_columns(self):
+        result = ca.value_counts_comb_df(self.df)
+        self.assertEqual(list(result), ['country', 'kind', 'n'])
+        for col in ['country', 'n']:
+            assert_frame_equal(result[col],
+                               ca.value_counts_comb(self.df[col]),
+                               check_names=False)
+            self.assertEqual(result[col].index.name, col)
+
+    def test_one_column_combinations(self):
+        result = ca.value_counts_comb_df(self.df, [('kind',), ['country']])
+        self.assertEqual(list(result), [('kind',), ('country',)])
+        for key, col in [(('kind',), 'kind'), (('country',), 'country')]:
+            assert_frame_equal(result[key],
+                               ca.value_counts_comb(self.df[col]),
+                               check_names=False)
+            self.assertEqual(result[key].index.name, col)
+
+    def test_combinations(self):
+        result = ca.value_counts_comb_df(
+            self.df, ['kind', ('country', 'kind'), ['kind', 'n']])
+        self.assertEqual(list(result),
+                         ['kind', ('country', 'kind'), ('kind', 'n')])
+        expected = pd.DataFrame(
+            {'Ratio': [2 / 5, 2 / 5, 1 / 5], 'Count': [2, 2, 1]},
+            index=pd.MultiIndex.from_tuples(
+                [('DE', 'a'), ('FR', 'b'), ('DE', 'b')],
+                names=['country', 'kind']),
+            columns=['Ratio', 'Count'])
+        assert_frame_equal(result[('country', 'kind')], expected)
+        counts = self.df.groupby(['kind', 'n']).size()
+        assert_series_equal(result[('kind', 'n')]['Count'].sort_index(),
+                            counts, check_names=False)
+
+    def test_dropna(self):
+        result = ca.value_counts_comb_df(self.df, [('country', 'kind')],
+                                         dropna=False, sort=False)
+        combos = result[('country', 'kind')]
+        self.assertEqual(combos['Count'].sum(), 6)
+        self.assertTrue(pd.isna(combos.index.get_level_values(0)[3]))
+
+    def test_unknown_column(self):
+        with self.assertRaises(ValueError):
+            ca.value_counts_comb_df(self.df, [('country', 'foo')])
+
+
+class TestValueCountsAccumulator(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.s = pd.Series(rng.choice(['a', 'b', 'c', None, 'd'], 1000,
+                                      p=[.4, .3, .15, .1, .05]))
+        self.chunks = [self.s.iloc[start:start + 128]
+                       for start in range(0, len(self.s), 128)]
+
+    def test_chunks(self):
+        for dropna in [True, False]:
+            counts = ca.ValueCountsAccumulator(dropna=dropna)
+            for chunk in self.chunks:
+                counts.update(chunk)
+            self.assertEqual(counts.n_rows, 1000)
+            assert_frame_equal(counts.to_frame(),
+                               ca.value_counts_comb(self.s, dropna=dropna))
+            assert_frame_equal(
+                counts.to_frame(sort=False, ascending=True),
+                ca.value_counts_comb(self.s, sort=False, dropna=dropna))
+
+    def test_nan_position(self):
+        s = pd.Series(['b', 'a', 'c', None, 'd', 'a', None, 'e'])
+        expected = ca.value_counts_comb(s, sort=False, dropna=False)
+        counts = ca.ValueCountsAccumulator(dropna=False)
+        for chunk in [s.iloc[:2], s.iloc[2:5], s.iloc[5:]]:
+            counts.update(chunk)
+        assert_frame_equal(counts.to_frame(sort=False), expected)
+
+        merged = ca.ValueCountsAccumulator(dropna=False)
+        merged.merge(ca.ValueCountsAccumulator().update(s.iloc[:3]))
+        merged.merge(ca.ValueCountsAccumulator().update(s.iloc[3:]))
+        assert_frame_equal(merged.to_frame(sort=False), expected)
+
+        restored = ca.ValueCountsAccumulator.from_series(counts.to_series(),
+                                                         dropna=False)
+        assert_frame_equal(restored.to_frame(sort=False), expected)
+
+    def test_merge(self):
+        parts = [ca.ValueCountsAccumulator(), ca.ValueCountsAccumulator()]
+        for number, chunk in enumerate(self.chunks):
+            parts[number % 2].update(chunk.values)
+        parts.append(ca.ValueCountsAccumulator())
+        counts = ca.ValueCountsAccumulator()
+        for part in parts:
+            counts.merge(part)
+        assert_frame_equal(counts.to_frame(), ca.value_counts_comb(self.s))
+
+    def test_serialization(self):
+        counts = ca.ValueCountsAccumulator(dropna=False).update(self.s)
+        restored = pickle.loads(pickle.dumps(counts))
+        assert_frame_equal(restored.to_frame(), counts.to_frame())
+
+        series = counts.to_series()
+        self.assertEqual(series.sum(), 1000)
+        restored = ca.ValueCountsAccumulator.from_series(series,
+                                                         dropna=False)
+        assert_frame_equal(restored.to_frame(), counts.to_frame())
+
+    def test_mixed_dtypes(self):
+        counts = ca.ValueCountsAccumulator()
+        counts.update(pd.Series([1, 2, 2]))
+        counts.update(pd.Series([2.5, 1.0]))
+        self.assertEqual(counts.to_frame()['Count'].to_dict(),
+                         {2.0: 2, 1.0: 2, 2.5: 1})
+
+
+class TestSketches(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.s = pd.Series(rng.zipf(1.5, 200000))
+        self.halves = [self.s.iloc[:100000], self.s.iloc[100000:]]
+
+    def test_hyperloglog(self):
+        rng = np.random.RandomState(1)
+        for n in [10, 1000, 100000]:
+            values = rng.randint(0, 10 ** 12, n)
+            sketch = ca.HyperLogLog(p=12).update(values)
+            self.assertLess(abs(sketch.count() / n - 1),
+                            3 * sketch.relative_error)
+        strings = pd.Series(['a', 'b', None, 'a', 'c'])
+        self.assertEqual(ca.HyperLogLog().update(strings).count(), 3)
+
+    def test_hyperloglog_merge(self):
+        merged = ca.HyperLogLog().update(self.halves[0]).merge(
+            pickle.loads(pickle.dumps(
+                ca.HyperLogLog().update(self.halves[1]))))
+        np.testing.assert_array_equal(
+            merged.registers, ca.HyperLogLog().update(self.s).registers)
+        with self.assertRaises(ValueError):
+            merged.merge(ca.HyperLogLog(p=10))
+
+    def test_count_min_sketch(self):
+        sketch = ca.CountMinSketch(width=1024, depth=5).update(self.s)
+        counts = self.s.value_counts()
+        estimates = sketch.query(counts.index[:100])
+        self.assertTrue((estimates >= counts.values[:100]).all())
+        bound = np.e / sketch.width * sketch.n_rows
+        self.assertTrue((estimates <= counts.values[:100] + bound).all())
+
+        merged = ca.CountMinSketch(width=1024).update(self.halves[0]).merge(
+            ca.CountMinSketch(width=1024).update(self.halves[1]))
+        np.testing.assert_array_equal(merged.table, sketch.table)
+        with self.assertRaises(ValueError):
+            merged.merge(ca.CountMinSketch(width=512))
+
+    def test_heavy_hitters(self):
+        counts = self.s.value_counts()
+        for hitters in [ca.HeavyHitters(k=20).update(self.s),
+                        ca.HeavyHitters(k=20).update(self.halves[0]).merge(
+                            ca.HeavyHitters(k=20).update(self.halves[1]))]:
+            self.assertLessEqual(hitters.error, len(self.s) / 21)
+            top = hitters.to_frame(n=5)
+            self.assertEqual(list(top.index), list(counts.index[:5]))
+            true = counts.loc[top.index]
+            self.assertTrue((top['Count'] <= true).all())
+            self.assertTrue((top['Count'] + hitters.error >= true).all())
+            assert_series_equal(top['Ratio'], top['Count'] / len(self.s),
+                                check_names=False)
+
+
+class TestValueCountsCombBins(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.s = pd.Series(np.where(rng.rand(500) < .1, np.nan,
+                                    rng.lognormal(2, 1, 500)))
+
+    def expected(self, s, **kwargs):
+        return pd.concat([s.value_counts(normalize=True, **kwargs),
+                          s.value_counts(**kwargs)],
+                         axis=1, keys=['Ratio', 'Count'])
+
+    def test_like_value_counts(self):
+        for kwargs in [{'bins': 5}, {'bins': 20, 'ascending': True},
+                       {'bins': [0, 1, 10, 100]},
+                       {'bins': 3, 'dropna': False}]:
+            # Compared in bin order, as value_counts orders ties arbitrarily
+            binned = ca.value_counts_comb(self.s, **kwargs)
+            assert_frame_equal(binned.sort_index(),
+                               self.expected(self.s, **kwargs).sort_index())
+            unsorted = ca.value_counts_comb(self.s, sort=False, **kwargs)
+            assert_frame_equal(unsorted,
+                               self.expected(self.s, sort=False, **kwargs))
+            counts = unsorted['Count'].values
+            order = np.argsort(counts if kwargs.get('ascending') else -counts,
+                               kind='mergesort')
+            assert_frame_equal(binned, unsorted.iloc[order])
+        constant = pd.Series([2.5] * 4)
+        assert_frame_equal(ca.value_counts_comb(constant, bins=2),
+                           self.expected(constant, bins=2))
+
+    def test_ties_in_bin_order(self):
+        s = pd.Series([1, 2, 2, 3, 4, 4, 5, 6])
+        binned = ca.value_counts_comb(s, bins=[0, 2, 4, 6])
+        self.assertEqual([interval.right for interval in binned.index],
+                         [2, 4, 6])
+        self.assertEqual(list(binned['Count']), [3, 3, 2])
+        binned = ca.value_counts_comb(s, bins=[0, 1, 2, 4, 6],
+                                      ascending=True)
+        self.assertEqual([interval.right for interval in binned.index],
+                         [1, 2, 6, 4])
+        self.assertEqual(list(binned['Count']), [1, 2, 2, 3])
+
+    def test_fitted_edges(self):
+        edges = ca.bin_edges(self.s, 4)
+        np.testing.assert_allclose(
+            edges, pd.cut(self.s, 4, retbins=True)[1])
+        other = self.s.iloc[:100]
+        binned = ca.value_counts_comb(other, bins=edges, sort=False)
+        self.assertEqual(list(binned.index),
+                         list(ca.value_counts_comb(self.s, bins=4,
+                                                   sort=False).index))
+        assert_frame_equal(binned, self.expected(other, bins=edges,
+                                                 sort=False))
+
+    def test_weights(self):
+        weights = np.arange(len(self.s), dtype=float)
+        binned = ca.value_counts_comb(self.s, bins=4, weights=weights,
+                                      sort=False)
+        sums = pd.Series(weights).groupby(
+            pd.cut(self.s, 4, include_lowest=True)).sum()
+        np.testing.assert_allclose(binned['Count'], sums.values)
+        np.testing.assert_allclose(binned['Ratio'],
+                                   sums.values / weights.sum())
+
+        s = pd.Series(['a', 'b', 'a', None])
+        weighted = ca.value_counts_comb(s, weights=[1., 5., 2., 3.])
+        self.assertEqual(weighted['Count'].to_dict(), {'b': 5., 'a': 3.})
+        self.assertEqual(weighted['Ratio'].to_dict(),
+                         {'b': 5 / 8, 'a': 3 / 8})
+        with self.assertRaises(ValueError):
+            ca.value_counts_comb(s, weights=[1., 2.])
+
+    def test_non_numeric(self):
+        with self.assertRaises(TypeError):
+            ca.value_counts_comb(pd.Series(['a', 'b']), bins=2)
+
+
+class TestContingencyTable(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.df = pd.DataFrame({
+            'product': rng.randint(0, 50, 2000),
+            'warehouse': rng.choice(['BER', 'HAM', 'MUC', None], 2000),
+        })
+
+    def test_sparse(self):
+        matrix, products, warehouses = ca.contingency_table(
+            self.df, 'product', 'warehouse')
+        dense = pd.crosstab(self.df['product'], self.df['warehouse'])
+        self.assertEqual(list(products), list(dense.index))
+        self.assertEqual(list(warehouses), list(dense.columns))
+        np.testing.assert_array_equal(matrix.toarray(), dense.values)
+        self.assertEqual(matrix.nnz, np.count_nonzero(dense.values))
+
+    def test_sparse_with_nan(self):
+        matrix, products, warehouses = ca.contingency_table(
+            self.df, 'product', 'warehouse', dropna=False)
+        self.assertTrue(pd.isna(warehouses[-1]))
+        self.assertEqual(matrix.sum(), len(self.df))
+        np.testing.assert_array_equal(
+            np.asarray(matrix[:, -1].todense()).ravel(),
+            self.df[self.df['warehouse'].isna()].groupby('product').size()
+            .reindex(products, fill_value=0).values)
+
+    def test_frame(self):
+        result = ca.contingency_table(self.df, 'product', 'warehouse',
+                                      output='frame')
+        expected = ca.value_counts_comb_df(
+            self.df, [('product', 'warehouse')])[('product', 'warehouse')]
+        assert_frame_equal(result, expected)
+        with self.assertRaises(ValueError):
+            ca.contingency_table(self.df, 'product', 'warehouse',
+                                 output='dense')
@@ -0,0 +1,810 @@
+import os
+import json
+import time
+import shutil
+import sqlite3
+import asyncio
+import tempfile
+import unittest
+from datetime import date, datetime
+from decimal import Decimal
+from unittest import mock
+import numpy as np
+import pandas as pd
+from pandas.testing import assert_frame_equal
+from pubdsutils import data_fetch as dfe
+
+
+class TestHashDf(unittest.TestCase):
+
+    def setUp(self):
+        self.df = pd.DataFrame({
+            'v1': np.arange(10),
+            'v2': np.linspace(0, 1, 10),
+            's': list('abcdefghij'),
+            'd': pd.date_range('2017-06-27', periods=10),
+        })
+
+    def test_stable(self):
+        self.assertEqual(dfe.hash_df(self.df), dfe.hash_df(self.df.copy()))
+
+    def test_independent_of_chunking(self):
+        hasher = dfe._FrameHasher(block_rows=3)
+        hasher.update(self.df.iloc[:4]).update(self.df.iloc[4:])
+        self.assertEqual(hasher.hexdigest(), dfe.hash_df(self.df))
+        self.assertEqual(hasher.n_rows, 10)
+
+    def test_sensitive_to_content_and_schema(self):
+        reference = dfe.hash_df(self.df)
+        changed = self.df.copy()
+        changed.loc[3, 's'] = 'z'
+        self.assertNotEqual(dfe.hash_df(changed), reference)
+        self.assertNotEqual(
+            dfe.hash_df(self.df.astype({'v1': float})), reference)
+        self.assertNotEqual(
+            dfe.hash_df(self.df.rename(columns={'v1': 'foo'})), reference)
+        self.assertNotEqual(
+            dfe.hash_df(self.df.set_index(self.df.index + 1)), reference)
+
+    def test_object_types(self):
+        mixed = pd.DataFrame({'v': [1, 2, 'a']})
+        strings = pd.DataFrame({'v': ['1', '2', 'a']})
+        self.assertNotEqual(dfe.hash_df(mixed), dfe.hash_df(strings))
+        self.assertNotEqual(dfe.hash_df(mixed.set_index('v')),
+                            dfe.hash_df(strings.set_index('v')))
+        self.assertEqual(dfe.hash_df(mixed),
+                         dfe.hash_df(pd.DataFrame({'v': [1, 2, 'a']})))
+        self.assertEqual(
+            dfe.hash_df(pd.DataFrame({'v': ['a', None, np.int64(1)]})),
+            dfe.hash_df(pd.DataFrame({'v': ['a', np.nan, 1]})))
+
+        # Blocks of one or several kinds hash the values alike
+        df = pd.DataFrame({'v': ['a', 'b', 1, None, 2.5, np.nan, True, 3]})
+        for block_rows in [1, 2, 3]:
+            self.assertEqual(
+                dfe._FrameHasher(block_rows=block_rows).update(
+                    df).hexdigest(), dfe.hash_df(df))
+
+    def test_mismatching_chunks(self):
+        hasher = dfe._FrameHasher().update(self.df)
+        self.assertRaises(ValueError, hasher.update, self.df[['v1']])
+
+
+class TestPersistDf(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp() + os.sep
+        self.df = pd.DataFrame({'v1': [1, 2, 3], 'v2': ['a', 'b', 'c']})
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_filename_holds_hash(self):
+        dfe.persist_df(self.df, path=self.path, sql='SELECT 1')
+        files = sorted(os.listdir(self.path))
+        self.assertEqual(len(files), 2)
+        self.assertTrue(files[0].endswith(dfe.hash_df(self.df) + '.pickle'))
+        self.assertTrue(files[1].endswith('.sql'))
+
+    def test_returns_filename(self):
+        filename = dfe.persist_df(self.df, path=self.path)
+        assert_frame_equal(pd.read_pickle(filename), self.df)
+
+
+class TestLoadDf(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp() + os.sep
+        self.df = pd.DataFrame({
+            'v1': np.arange(10),
+            'v2': np.linspace(0, 1, 10),
+            's': list('abcdefghij'),
+        }, index=pd.Index(list('ABCDEFGHIJ'), name='key'))
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_round_trip(self):
+        for fmt, compression in [('pickle', None), ('pickle', 'gzip'),
+                                 ('parquet', None), ('parquet', 'gzip'),
+                                 ('feather', None), ('feather', 'lz4')]:
+            filename = dfe.persist_df(self.df, path=self.path, fmt=fmt,
+                                      compression=compression)
+            assert_frame_equal(dfe.load_df(filename), self.df)
+            assert_frame_equal(
+                dfe.load_df(filename, columns=['s', 'v1']),
+                self.df[['s', 'v1']])
+
+    def test_row_groups(self):
+        for fmt in ['parquet', 'feather']:
+            filename = dfe.persist_df(self.df, path=self.path, fmt=fmt,
+                                      row_group_size=4)
+            assert_frame_equal(
+                dfe.load_df(filename, columns=['v2'], row_groups=[1, 2]),
+                self.df[['v2']].iloc[4:])
+            assert_frame_equal(
+                dfe.load_df(filename, row_groups=[0], memory_map=False),
+                self.df.iloc[:4])
+
+    def test_range_index(self):
+        df = self.df.reset_index(drop=True)
+        filename = dfe.persist_df(df, path=self.path, fmt='feather')
+        assert_frame_equal(dfe.load_df(filename, columns=['v1']), df[['v1']])
+
+    def test_errors(self):
+        self.assertRaises(ValueError, dfe.persist_df, self.df,
+                          path=self.path, fmt='csv')
+        self.assertRaises(ValueError, dfe.persist_df, self.df,
+                          path=self.path, compression='lz4')
+        filename = dfe.persist_df(self.df, path=self.path)
+        self.assertRaises(ValueError, dfe.load_df, filename, row_groups=[0])
+
+    def test_range_index_of_row_groups(self):
+        df = self.df.reset_index(drop=True)
+        for fmt in ['parquet', 'feather']:
+            filename = dfe.persist_df(df, path=self.path, fmt=fmt,
+                                      row_group_size=4)
+            assert_frame_equal(
+                dfe.load_df(filename, row_groups=[0, 2]),
+                df.iloc[[0, 1, 2, 3, 8, 9]], check_index_type=False)
+
+
+class TestSnapshotCatalog(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp() + os.sep
+        self.catalog = dfe.SnapshotCatalog(self.path + 'catalog.sqlite')
+        self.df = pd.DataFrame({'v1': [1, 2, 3], 'v2': ['a', 'b', 'c']})
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_register_and_lookup(self):
+        filename = dfe.persist_df(self.df, path=self.path, sql='SELECT 1',
+                                  catalog=self.catalog)
+        entry = self.catalog.by_hash(dfe.hash_df(self.df))
+        self.assertEqual(entry['filename'], filename)
+        self.assertEqual(entry['n_rows'], 3)
+        self.assertEqual(entry['size'], os.path.getsize(filename))
+        self.assertEqual(entry['schema']['columns'],
+                         [['v1', 'int64'], ['v2', 'object']])
+        self.assertEqual(self.catalog.latest(sql='SELECT 1'), entry)
+        self.assertEqual(self.catalog.latest(prefix='raw_df'), entry)
+        self.assertIsNone(self.catalog.latest(sql='SELECT 2'))
+        self.assertIsNone(self.catalog.by_hash('foo'))
+
+    def test_skip_duplicates(self):
+        first = dfe.persist_df(self.df, path=self.path, catalog=self.catalog)
+        second = dfe.persist_df(self.df.copy(), path=self.path,
+                                catalog=self.catalog, fmt='parquet')
+        self.assertEqual(first, second)
+        self.assertEqual(len(self.catalog.entries()), 1)
+
+    def test_alias(self):
+        first = dfe.persist_df(self.df, path=self.path, sql='SELECT 1',
+                               catalog=self.catalog)
+        second = dfe.persist_df(self.df, path=self.path, sql='SELECT 2',
+                                prefix='other', catalog=self.catalog,
+                                meta={'foo': 1})
+        self.assertEqual(first, second)
+        entry = self.catalog.latest(sql='SELECT 2')
+        self.assertEqual(
+            (entry['filename'], entry['prefix'], entry['meta']),
+            (first, 'other', {'foo': 1}))
+        self.assertEqual(self.catalog.latest(sql='SELECT 1')['filename'],
+                         first)
+        self.assertEqual(len(self.catalog.entries()), 2)
+        # The file is only removed once no entry refers to it
+        newer = dfe.persist_df(self.df.iloc[:1], path=self.path,
+                               sql='SELECT 3', catalog=self.catalog)
+        self.assertEqual(self.catalog.cleanup(keep_last=1), [])
+        self.assertTrue(os.path.exists(first))
+        self.assertEqual(sorted(self.catalog.entries().filename),
+                         sorted([first, newer]))
+        self.assertIsNone(self.catalog.latest(sql='SELECT 1'))
+
+    def test_latest(self):
+        dfe.persist_df(self.df, path=self.path, sql='SELECT 1',
+                       catalog=self.catalog)
+        newer = dfe.persist_df(self.df.iloc[:2], path=self.path,
+                               sql='SELECT 1', catalog=self.catalog)
+        self.assertEqual(
+            self.catalog.latest(sql='SELECT 1')['filename'], newer)
+
+    def test_missing_files_are_dropped(self):
+        filename = dfe.persist_df(self.df, path=self.path,
+                                  catalog=self.catalog)
+        os.remove(filename)
+        self.assertIsNone(self.catalog.by_hash(dfe.hash_df(self.df)))
+        self.assertEqual(len(self.catalog.entries()), 0)
+
+    def test_cleanup(self):
+        filenames = [
+            dfe.persist_df(self.df.iloc[:n], path=self.path, sql='SELECT 1',
+                           catalog=self.catalog)
+            for n in [1, 2, 3]]
+        other = dfe.persist_df(self.df[['v2']], path=self.path,
+                               prefix='other',
+                               catalog=self.catalog)
+        self.assertEqual(sorted(self.catalog.cleanup(keep_last=1)),
+                         sorted(filenames[:2]))
+        self.assertFalse(os.path.exists(filenames[0]))
+        self.assertFalse(os.path.exists(filenames[0][:-7] + '.sql'))
+        self.assertEqual(sorted(self.catalog.entries().filename),
+                         sorted([filenames[2], other]))
+        self.assertEqual(
+            sorted(self.catalog.cleanup(max_age=pd.Timedelta(0))),
+            sorted([other, filenames[2]]))
+        self.assertEqual(os.listdir(self.path), ['catalog.sqlite'])
+
+
+class TestFetchToFile(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp() + os.sep
+        self.conn = sqlite3.connect(':memory:')
+        self.df = pd.DataFrame({
+            'order_id': np.arange(10),
+            'price': np.linspace(1, 2, 10),
+            'product': list('abcdefghij'),
+        })
+        self.df.to_sql('orders', self.conn, index=False)
+        self.query = 'SELECT * FROM orders ORDER BY order_id'
+
+    def tearDown(self):
+        self.conn.close()
+        shutil.rmtree(self.path)
+
+    def test_stream(self):
+        for fmt in ['parquet', 'feather']:
+            filename = dfe.fetch_to_file(self.conn, self.query,
+                                         path=self.path, fmt=fmt, chunksize=3)
+            res = dfe.load_df(filename)
+            assert_frame_equal(res, self.df)
+            self.assertTrue(filename.endswith(
+                '_{}.{}'.format(dfe.hash_df(self.df), fmt)))
+            self.assertEqual(len(dfe.load_df(filename, row_groups=[3])), 1)
+        self.assertEqual(
+            len([name for name in os.listdir(self.path)
+                 if name.endswith('.sql')]), 2)
+
+    def test_nulls_in_later_batch(self):
+        self.conn.execute("CREATE TABLE counts (v INTEGER, s TEXT, e TEXT, "
+                          "x, b REAL)")
+        self.conn.executemany(
+            "INSERT INTO counts VALUES (?, ?, ?, ?, ?)",
+            [(v, None, None, v, None) for v in range(6)] +
+            [(None, 'a', None, 1.5, 2.5), (8, 'b', None, 2, None)])
+        query = 'SELECT * FROM counts'
+        expected = pd.read_sql(query, self.conn)
+        for fmt in ['parquet', 'feather']:
+            for chunksize in [1, 3, 5, 6, 100]:
+                with self.subTest(fmt=fmt, chunksize=chunksize):
+                    filename = dfe.fetch_to_file(
+                        self.conn, query, path=self.path, fmt=fmt,
+                        chunksize=chunksize)
+                    assert_frame_equal(dfe.load_df(filename), expected)
+                    self.assertTrue(filename.endswith(
+                        '_{}.{}'.format(dfe.hash_df(expected), fmt)))
+        self.assertFalse(
+            any(name.endswith(('.tmp', '.old'))
+                for name in os.listdir(self.path)))
+
+    def test_ini_connection_closed(self):
+        ini_file = self.path + 'db.ini'
+        with open(ini_file, 'w') as ini:
+            ini.write('[Base]\ndriver = test\n')
+        conns = []
+
+        def connect(section):
+            conns.append(sqlite3.connect(':memory:'))
+            return conns[-1]
+
+        dfe.register_driver('test', connect)
+        try:
+            dfe.fetch_to_file(ini_file, 'SELECT 1 AS v', path=self.path)
+        finally:
+            dfe._DRIVERS.pop('test')
+        self.assertRaises(sqlite3.ProgrammingError, conns[0].execute,
+                          'SELECT 1')
+
+    def test_catalog(self):
+        catalog = dfe.SnapshotCatalog(self.path + 'catalog.sqlite')
+        persisted = dfe.persist_df(self.df, path=self.path, fmt='parquet',
+                                   catalog=catalog)
+        filename = dfe.fetch_to_file(self.conn, self.query, path=self.path,
+                                     chunksize=4, catalog=catalog)
+        self.assertEqual(filename, persisted)
+
+        filename = dfe.fetch_to_file(
+            self.conn, 'SELECT * FROM orders WHERE order_id < 5',
+            path=self.path, chunksize=4, catalog=catalog)
+        entry = catalog.latest(sql='SELECT * FROM orders WHERE order_id < 5')
+        self.assertEqual(entry['filename'], filename)
+        self.assertEqual(entry['n_rows'], 5)
+        self.assertFalse(
+            any(name.endswith('.tmp') for name in os.listdir(self.path)))
+
+    def test_empty_result(self):
+        filename = dfe.fetch_to_file(
+            self.conn, 'SELECT * FROM orders WHERE order_id < 0',
+            path=self.path, fmt='feather')
+        res = dfe.load_df(filename)
+        self.assertEqual(len(res), 0)
+        self.assertEqual(list(res.columns), list(self.df.columns))
+
+    def test_errors(self):
+        self.assertRaises(ValueError, dfe.fetch_to_file, self.conn,
+                          self.query, path=self.path, fmt='pickle')
+        self.assertRaises(Exception, dfe.fetch_to_file, self.conn,
+                          'SELECT * FROM foo', path=self.path)
+        self.assertEqual(os.listdir(self.path), [])
+
+
+class TestBulkInsert(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp() + os.sep
+        self.db = self.path + 'db.sqlite'
+        with sqlite3.connect(self.db) as conn:
+            conn.execute("CREATE TABLE scores (customer_id INTEGER, "
+                         "score REAL, segment TEXT, scored_at TIMESTAMP)")
+            conn.execute("INSERT INTO scores VALUES (-1, 0.5, 'x', NULL)")
+        self.df = pd.DataFrame({
+            'customer_id': np.arange(25),
+            'score': np.linspace(0, 1, 25),
+            'segment': ['a', None, 'c', 'd', 'e'] * 5,
+            'scored_at': pd.date_range('2017-06-27', periods=25, freq='60min'),
+        })
+        self.df.loc[3, 'scored_at'] = pd.NaT
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def connect(self):
+        return sqlite3.connect(self.db, timeout=30)
+
+    def read(self):
+        with self.connect() as conn:
+            return pd.read_sql(
+                "SELECT * FROM scores WHERE customer_id >= 0 "
+                "ORDER BY customer_id", conn, parse_dates=['scored_at'])
+
+    def count(self, table='scores'):
+        with self.connect() as conn:
+            return conn.execute(
+                "SELECT COUNT(*) FROM {}".format(table)).fetchone()[0]
+
+    def test_batches(self):
+        self.assertEqual(
+            dfe.bulk_insert(self.df, self.connect, 'scores', batch_size=4),
+            25)
+        assert_frame_equal(self.read(), self.df)
+        self.assertEqual(self.count(), 26)
+
+    def test_parallel(self):
+        dfe.bulk_insert(self.df, self.connect, 'scores', batch_size=3,
+                        n_jobs=3)
+        assert_frame_equal(self.read(), self.df)
+
+    def test_staging(self):
+        dfe.bulk_insert(self.df, self.connect, 'scores', batch_size=7,
+                        n_jobs=2, staging_table='scores_staging',
+                        replace=True)
+        assert_frame_equal(self.read(), self.df)
+        self.assertEqual(self.count(), 25)
+        self.assertRaises(sqlite3.OperationalError, self.count,
+                          'scores_staging')
+
+    def test_failed_staging_keeps_table(self):
+        df = self.df.rename(columns={'score': 'foo'})
+        self.assertRaises(sqlite3.OperationalError, dfe.bulk_insert, df,
+                          self.connect, 'scores', staging_table='staging',
+                          replace=True)
+        self.assertEqual(self.count(), 1)
+        self.assertRaises(sqlite3.OperationalError, self.count, 'staging')
+
+    def test_replace(self):
+        dfe.bulk_insert(self.df, self.connect, 'scores', replace=True)
+        self.assertEqual(self.count(), 25)
+
+
+class TestAsyncFetch(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp() + os.sep
+        self.db = self.path + 'db.sqlite'
+        with sqlite3.connect(self.db) as conn:
+            pd.DataFrame({'v1': [1, 2, 3]}).to_sql('t', conn, index=False)
+        self.queries = {
+            'slow': 'SELECT v1, sleep(0.4) AS s FROM t WHERE v1 = 1',
+            'fast': 'SELECT v1, sleep(0.1) AS s FROM t WHERE v1 = 2',
+            'medium': 'SELECT v1, sleep(0.2) AS s FROM t WHERE v1 = 3',
+        }
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def connect(self):
+        conn = sqlite3.connect(self.db, check_same_thread=False)
+        conn.create_function('sleep', 1, lambda secs: time.sleep(secs))
+        return conn
+
+    def test_as_completed(self):
+        async def collect(pool):
+            return [(key, df) async for key, df in
+                    dfe.fetch_as_completed(self.queries, pool)]
+
+        with dfe.ConnectionPool(self.connect, size=3) as pool:
+            loop = asyncio.new_event_loop()
+            start = time.perf_counter()
+            res = loop.run_until_complete(collect(pool))
+            elapsed = time.perf_counter() - start
+            loop.close()
+        self.assertEqual([key for key, _ in res], ['fast', 'medium', 'slow'])
+        self.assertEqual([df.v1[0] for _, df in res], [2, 3, 1])
+        self.assertLess(elapsed, 0.65)
+
+    def test_fetch_many(self):
+        res = dfe.fetch_many(self.queries, self.connect, max_concurrency=2)
+        self.assertEqual(list(res), ['slow', 'fast', 'medium'])
+        self.assertEqual([df.v1[0] for df in res.values()], [1, 2, 3])
+        res = dfe.fetch_many(list(self.queries.values()), self.connect)
+        self.assertEqual([df.v1[0] for df in res], [1, 2, 3])
+
+    def test_errors(self):
+        self.assertRaises(pd.io.sql.DatabaseError, dfe.fetch_many,
+                          ['SELECT * FROM foo'], self.connect)
+
+
+class TestConnectionPool(unittest.TestCase):
+
+    def setUp(self):
+        self.created = []
+
+    def connect(self):
+        conn = sqlite3.connect(':memory:', check_same_thread=False)
+        self.created.append(conn)
+        return conn
+
+    def test_reuse(self):
+        pool = dfe.ConnectionPool(self.connect, size=2)
+        with pool.connection() as first:
+            with pool.connection() as second:
+                self.assertIsNot(first, second)
+        with pool.connection() as third:
+            self.assertIn(third, [first, second])
+        self.assertEqual(len(self.created), 2)
+        pool.close()
+
+    def test_broken_connection_is_dropped(self):
+        pool = dfe.ConnectionPool(self.connect, size=1)
+        self.assertRaises(pd.io.sql.DatabaseError, pool.read_sql,
+                          'SELECT * FROM foo')
+        assert_frame_equal(pool.read_sql('SELECT 1 AS v'),
+                           pd.DataFrame({'v': [1]}))
+        self.assertEqual(len(self.created), 2)
+
+
+class TestConnectorFromIni(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.ini_file = os.path.join(self.path, 'db.ini')
+
+    def tearDown(self):
+        for name in ['test', 'plugin']:
+            dfe._DRIVERS.pop(name, None)
+        shutil.rmtree(self.path)
+
+    def write_ini(self, **base):
+        with open(self.ini_file, 'w') as ini:
+            ini.write('[Base]\n')
+            for key, value in base.items():
+                ini.write('{} = {}\n'.format(key, value))
+
+    def test_sqlite(self):
+        database = os.path.join(self.path, 'db.sqlite')
+        self.write_ini(driver='sqlite', database=database)
+        with dfe.ConnectionPool(self.ini_file) as pool:
+            assert_frame_equal(pool.read_sql('SELECT 1 AS v'),
+                               pd.DataFrame({'v': [1]}))
+
+    def test_registered_driver(self):
+        sections = []
+
+        def connect(section):
+            sections.append(dict(section))
+            return sqlite3.connect(':memory:')
+
+        dfe.register_driver('test', connect)
+        self.write_ini(driver='test', server='db.local')
+        dfe.connector_from_ini(self.ini_file).close()
+        self.assertEqual(sections, [{'driver': 'test',
+                                     'server': 'db.local'}])
+
+    def test_entry_point_driver(self):
+        class EntryPoint:
+            name = 'plugin'
+
+            def load(self):
+                return lambda section: sqlite3.connect(':memory:')
+
+        with mock.patch.object(dfe, '_entry_points',
+                               return_value=[EntryPoint()]) as entry_points:
+            self.write_ini(driver='plugin')
+            dfe.connector_from_ini(self.ini_file).close()
+        entry_points.assert_called_once_with('pubdsutils.drivers')
+        self.assertIn('plugin', dfe._DRIVERS)
+
+    def test_unknown_driver(self):
+        self.write_ini(driver='nodb')
+        with self.assertRaises(ValueError):
+            dfe.connector_from_ini(self.ini_file)
+
+
+class TestFetchIncremental(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp() + os.sep
+        self.catalog = dfe.SnapshotCatalog(self.path + 'catalog.sqlite')
+        self.conn = sqlite3.connect(':memory:')
+        self.orders = pd.DataFrame({
+            'order_id': [1, 2, 3],
+            'status': ['new', 'new', 'new'],
+            'updated_at': pd.to_datetime(
+                ['2017-06-01', '2017-06-02', '2017-06-03']),
+        })
+        self.orders.to_sql('orders', self.conn, index=False)
+        self.query = 'SELECT * FROM orders'
+
+    def tearDown(self):
+        self.conn.close()
+        shutil.rmtree(self.path)
+
+    def fetch(self, **kwargs):
+        filename = dfe.fetch_incremental(
+            self.conn, self.query, 'updated_at', self.catalog,
+            path=self.path, parse_dates=['updated_at'], **kwargs)
+        return filename, dfe.load_df(filename)
+
+    def test_append(self):
+        _, res = self.fetch()
+        assert_frame_equal(res, self.orders)
+        self.assertEqual(self.catalog.latest(sql=self.query)['meta'], {
+            'watermark_col': 'updated_at',
+            'watermark': '2017-06-03T00:00:00',
+            'watermark_type': 'datetime'})
+
+        self.conn.execute("INSERT INTO orders VALUES "
+                          "(4, 'new', '2017-06-04 00:00:00')")
+        _, res = self.fetch()
+        self.assertEqual(res.order_id.tolist(), [1, 2, 3, 4])
+        self.assertEqual(
+            self.catalog.latest(sql=self.query)['meta']['watermark'],
+            '2017-06-04T00:00:00')
+
+    def test_nothing_new(self):
+        first, _ = self.fetch()
+        second, _ = self.fetch()
+        self.assertEqual(first, second)
+        self.assertEqual(len(self.catalog.entries()), 1)
+
+    def test_upsert(self):
+        self.fetch(key=['order_id'])
+        self.conn.execute("UPDATE orders SET status = 'shipped', "
+                          "updated_at = '2017-06-05 00:00:00' "
+                          "WHERE order_id = 1")
+        _, res = self.fetch(key=['order_id'])
+        # Row 3 has the stored watermark and is fetched again
+        self.assertEqual(res.order_id.tolist(), [2, 1, 3])
+        self.assertEqual(res.status.tolist(), ['new', 'shipped', 'new'])
+
+    def test_integer_watermark(self):
+        filename = dfe.fetch_incremental(self.conn, self.query, 'order_id',
+                                         self.catalog, path=self.path)
+        self.assertEqual(self.catalog.latest(sql=self.query)['meta'], {
+            'watermark_col': 'order_id', 'watermark': 3,
+            'watermark_type': 'int'})
+        self.conn.execute("INSERT INTO orders VALUES "
+                          "(4, 'new', '2017-06-01 00:00:00')")
+        filename = dfe.fetch_incremental(self.conn, self.query, 'order_id',
+                                         self.catalog, path=self.path)
+        self.assertEqual(dfe.load_df(filename).order_id.tolist(),
+                         [1, 2, 3, 4])
+
+    def test_date_watermark(self):
+        conn = sqlite3.connect(':memory:',
+                               detect_types=sqlite3.PARSE_DECLTYPES)
+        conn.execute("CREATE TABLE days (day DATE, n INTEGER)")
+        conn.executemany("INSERT INTO days VALUES (?, ?)",
+                         [(date(2017, 6, day), day) for day in (1, 2)])
+        query = 'SELECT * FROM days'
+        dfe.fetch_incremental(conn, query, 'day', self.catalog,
+                              path=self.path)
+        self.assertEqual(self.catalog.latest(sql=query)['meta'], {
+            'watermark_col': 'day', 'watermark': '2017-06-02',
+            'watermark_type': 'date'})
+        conn.execute("INSERT INTO days VALUES (?, 3)", (date(2017, 6, 3),))
+        filename = dfe.fetch_incremental(conn, query, 'day', self.catalog,
+                                         path=self.path)
+        self.assertEqual(dfe.load_df(filename).n.tolist(), [1, 2, 3])
+        conn.close()
+
+    def test_watermark_types(self):
+        for watermark in [Decimal('12.50'), date(2017, 6, 1),
+                          datetime(2017, 6, 1, 12), b'\x00\x00\x07\xd1',
+                          3, 2.5, 'A-17']:
+            meta = json.loads(json.dumps(
+                dfe._dump_watermark('v', watermark)))
+            loaded = dfe._load_watermark(meta)
+            self.assertEqual(loaded, watermark)
+            self.assertIs(type(loaded), type(watermark))
+        with self.assertRaises(ValueError):
+            dfe._dump_watermark('v', object())
+
+
+class TestFetchSample(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = sqlite3.connect(':memory:')
+        pd.DataFrame({'v1': np.arange(1000)}).to_sql(
+            'orders', self.conn, index=False)
+        self.query = 'SELECT * FROM orders'
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_reservoir(self):
+        res = dfe.fetch_sample(self.conn, self.query, n=100, chunksize=64,
+                               random_state=0)
+        self.assertEqual(len(res), 100)
+        self.assertTrue(res.v1.is_unique)
+        self.assertTrue(res.v1.is_monotonic_increasing)
+        self.assertGreater(res.v1.max(), 900)
+        # The sample doesn't depend on the chunking
+        assert_frame_equal(
+            res, dfe.fetch_sample(self.conn, self.query, n=100,
+                                  chunksize=300, random_state=0))
+
+    def test_reservoir_smaller_result(self):
+        res = dfe.fetch_sample(self.conn, 'SELECT * FROM orders LIMIT 10',
+                               n=100, chunksize=3)
+        self.assertEqual(res.v1.tolist(), list(range(10)))
+
+    def test_uniform(self):
+        # Every row should be drawn with probability 1 / 10
+        counts = np.zeros(1000)
+        for seed in range(200):
+            counts[dfe.fetch_sample(self.conn, self.query, n=100,
+                                    chunksize=250, random_state=seed).v1] += 1
+        self.assertLess(abs(counts[:500].mean() - counts[500:].mean()), 2)
+
+    def test_bernoulli(self):
+        res = dfe.fetch_sample(self.conn, self.query, frac=0.2,
+                               method='bernoulli', chunksize=64,
+                               random_state=0)
+        self.assertTrue(150 < len(res) < 250)
+
+    def test_server_side(self):
+        res = dfe.fetch_sample(self.conn, self.query, n=50, server_frac=0.2)
+        self.assertEqual(len(res), 50)
+        res = dfe.fetch_sample(self.conn, self.query, frac=1.,
+                               method='bernoulli', server_frac=0.2)
+        self.assertTrue(120 < len(res) < 280)
+
+    def test_errors(self):
+        self.assertRaises(ValueError, dfe.fetch_sample, self.conn,
+                          self.query)
+        self.assertRaises(ValueError, dfe.fetch_sample, self.conn,
+                          self.query, method='bernoulli')
+        self.assertRaises(ValueError, dfe.fetch_sample, self.conn,
+                          self.query, n=1, method='foo')
+
+
+class TestBackgroundPersister(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp() + os.sep
+        self.df = pd.DataFrame({'v1': [1, 2, 3], 'v2': ['a', 'b', 'c']})
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_submit(self):
+        expected = self.df.copy()
+        with dfe.BackgroundPersister(path=self.path) as writer:
+            future = writer.submit(self.df, sql='SELECT 1')
+            # The snapshot is taken at submission
+            self.df.loc[0, 'v1'] = 100
+        filename = future.result()
+        self.assertIn(dfe.hash_df(expected), filename)
+        assert_frame_equal(dfe.load_df(filename), expected)
+        self.assertTrue(os.path.exists(filename[:-7] + '.sql'))
+
+    def test_flush(self):
+        writer = dfe.BackgroundPersister(max_backlog=1, path=self.path,
+                                         fmt='parquet')
+        futures = [writer.submit(self.df.iloc[:n], prefix='p{}'.format(n))
+                   for n in [1, 2, 3]]
+        filenames = writer.flush()
+        self.assertEqual(filenames, [future.result() for future in futures])
+        self.assertEqual(writer.flush(), [])
+        writer.close()
+        self.assertEqual(len(os.listdir(self.path)), 3)
+
+    def test_errors(self):
+        writer = dfe.BackgroundPersister(path=self.path, fmt='foo')
+        writer.submit(self.df)
+        self.assertRaises(ValueError, writer.close)
+
+
+class TestChunkStore(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp() + os.sep
+        self.store = dfe.ChunkStore(self.path, chunk_rows=4)
+        self.df = pd.DataFrame({
+            'v1': np.arange(10),
+            'v2': np.linspace(0, 1, 10),
+            's': pd.Categorical(list('abcabcabca')),
+            'd': pd.date_range('2017-06-27', periods=10, tz='Europe/Berlin'),
+        }, index=pd.Index(np.arange(10) * 2, name='key'))
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def n_chunks(self):
+        return sum(len(files) for _, _, files in
+                   os.walk(os.path.join(self.path, 'chunks')))
+
+    def test_round_trip(self):
+        name = self.store.put(self.df)
+        self.assertIn(dfe.hash_df(self.df), name)
+        assert_frame_equal(self.store.load(name), self.df)
+        assert_frame_equal(self.store.load(name, columns=['d', 'v1']),
+                           self.df[['d', 'v1']])
+        self.assertEqual(self.n_chunks(), 5 * 3)
+
+    def test_object_types(self):
+        mixed = pd.DataFrame({'v': [1, 2, 'a']})
+        strings = pd.DataFrame({'v': ['1', '2', 'a']})
+        self.store.put(mixed, name='mixed')
+        self.store.put(strings, name='strings')
+        assert_frame_equal(self.store.load('strings'), strings)
+        assert_frame_equal(self.store.load('mixed'), mixed)
+        self.assertEqual(self.store.load('mixed').v.map(type).tolist(),
+                         [int, int, str])
+
+    def test_deduplication(self):
+        first = self.store.put(self.df.iloc[:8], name='first')
+        self.assertEqual(self.n_chunks(), 5 * 2)
+        second = self.store.put(self.df, name='second')
+        # Only the last row chunk of every column is new
+        self.assertEqual(self.n_chunks(), 5 * 3)
+        self.assertEqual(self.store.names(), [first, second])
+        assert_frame_equal(self.store.load(first), self.df.iloc[:8])
+
+    def test_iter_chunks(self):
+        name = self.store.put(self.df)
+        chunks = list(self.store.iter_chunks(name, columns=['v2']))
+        self.assertEqual([len(chunk) for chunk in chunks], [4, 4, 2])
+        assert_frame_equal(pd.concat(chunks), self.df[['v2']])
+
+    def test_remove_and_gc(self):
+        self.store.put(self.df.iloc[:8], name='first')
+        self.store.put(self.df, name='second')
+        self.store.remove('second')
+        self.assertEqual(self.store.gc(), 5)
+        self.assertEqual(self.store.names(), ['first'])
+        assert_frame_equal(self.store.load('first'), self.df.iloc[:8])
+
+    def test_empty(self):
+        name = self.store.put(self.df.iloc[:0])
+        res = self.store.load(name)
+        self.assertEqual(list(res.columns), list(self.df.columns))
+        self.assertEqual(len(res), 0)
+
+    def test_errors(self):
+        name = self.store.put(self.df)
+        self.assertRaises(KeyError, self.store.load, name, columns=['foo'])
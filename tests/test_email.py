@@ -0,0 +1,430 @@
+import os
+import time
+import gzip
+import email
+import zipfile
+import shutil
+import tempfile
+import threading
+import smtplib
+import socketserver
+import unittest
+import pandas as pd
+from io import BytesIO, StringIO
+from pandas.testing import assert_frame_equal
+from pubdsutils import email as em
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    """Just enough of SMTP for smtplib"""
+
+    def reply(self, line):
+        self.wfile.write((line + '\r\n').encode())
+
+    def handle(self):
+        with self.server.lock:
+            self.server.connections += 1
+        self.reply('220 localhost stub')
+        sent = 0
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode().strip().upper()
+            if command.startswith(('EHLO', 'HELO')):
+                self.reply('250 localhost')
+            elif command.startswith(('MAIL', 'RCPT', 'RSET', 'NOOP')):
+                self.reply('250 OK')
+            elif command == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                data = []
+                for line in iter(self.rfile.readline, b''):
+                    if line == b'.\r\n':
+                        break
+                    data.append(line[1:] if line.startswith(b'..') else line)
+                with self.server.lock:
+                    if self.server.errors:
+                        self.reply(self.server.errors.pop(0))
+                        continue
+                    self.server.messages.append(
+                        email.message_from_bytes(b''.join(data)))
+                self.reply('250 OK')
+                sent += 1
+                if sent == self.server.drop_after:
+                    return
+            elif command == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Not implemented')
+
+
+class SMTPStub(socketserver.ThreadingTCPServer):
+    """Local SMTP server collecting the received messages"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, drop_after=None):
+        super().__init__(('127.0.0.1', 0), _SMTPHandler)
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.messages = []
+        # Close the connection after that many messages
+        self.drop_after = drop_after
+        # Replies rejecting the next messages
+        self.errors = []
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+CONFIG = """
+[server]
+EMAIL_HOST = 127.0.0.1
+EMAIL_HOST_USER =
+EMAIL_HOST_PASSWORD =
+EMAIL_PORT = {port}
+EMAIL_TTLS =
+
+[content]
+SUBJECT = Report
+FROM = sent@from.here
+TO = send.to@foo.bar
+BODY = See attached
+FILENAME = report.csv
+"""
+
+
+class EmailTestCase(unittest.TestCase):
+
+    drop_after = None
+
+    def setUp(self):
+        self.server = SMTPStub(drop_after=self.drop_after)
+        self.path = tempfile.mkdtemp()
+        self.config_ini = os.path.join(self.path, 'email.ini')
+        with open(self.config_ini, 'w') as cfg_file:
+            cfg_file.write(CONFIG.format(port=self.server.server_address[1]))
+        self.df = pd.DataFrame({'v1': [1, 2, 3], 'v2': ['a', 'b', 'c']})
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.path)
+
+    def attachments(self, msg):
+        return [part for part in msg.walk()
+                if part.get_filename() is not None]
+
+
+class TestSendDf(EmailTestCase):
+
+    def test_send_df(self):
+        em.send_df(self.df, self.config_ini, index=False)
+        self.assertEqual(self.server.connections, 1)
+        msg, = self.server.messages
+        self.assertEqual(msg['To'], 'send.to@foo.bar')
+        self.assertTrue(msg['Subject'].startswith('Report / Generated on'))
+        attachment, = self.attachments(msg)
+        self.assertEqual(attachment.get_filename(), 'report.csv')
+        csv = attachment.get_payload(decode=True).decode()
+        assert_frame_equal(pd.read_csv(StringIO(csv)), self.df)
+
+
+class TestAttachments(EmailTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.df = pd.DataFrame({'v1': range(1000),
+                                'v2': ['row {}'.format(i)
+                                       for i in range(1000)]})
+
+    def received(self, read):
+        frames = [read(attachment.get_payload(decode=True))
+                  for msg in self.server.messages
+                  for attachment in self.attachments(msg)]
+        return pd.concat(frames, ignore_index=True)
+
+    def test_gzip(self):
+        em.send_df(self.df, self.config_ini, compress='gzip', index=False,
+                   chunk_rows=100)
+        attachment, = self.attachments(self.server.messages[0])
+        self.assertEqual(attachment.get_filename(), 'report.csv.gz')
+        self.assertEqual(attachment.get_content_type(), 'application/gzip')
+        df = self.received(lambda data: pd.read_csv(
+            BytesIO(gzip.decompress(data))))
+        assert_frame_equal(df, self.df)
+
+    def test_zip(self):
+        em.send_df(self.df, self.config_ini, compress='zip', index=False)
+        attachment, = self.attachments(self.server.messages[0])
+        self.assertEqual(attachment.get_filename(), 'report.zip')
+        archive = zipfile.ZipFile(
+            BytesIO(attachment.get_payload(decode=True)))
+        self.assertIsNone(archive.testzip())
+        self.assertEqual(archive.namelist(), ['report.csv'])
+        assert_frame_equal(pd.read_csv(archive.open('report.csv')), self.df)
+
+    def test_split_attachments(self):
+        for compress in [None, 'gzip', 'zip']:
+            self.server.messages.clear()
+            em.send_df(self.df, self.config_ini, compress=compress,
+                       index=False, max_attachment_size=2000,
+                       chunk_rows=100)
+            msg, = self.server.messages
+            attachments = self.attachments(msg)
+            self.assertGreater(len(attachments), 1)
+            self.assertTrue(attachments[1].get_filename().startswith(
+                'report_part2.'))
+            sizes = [len(part.get_payload(decode=True))
+                     for part in attachments]
+            self.assertLessEqual(max(sizes), 2000)
+
+            def read(data):
+                if compress == 'gzip':
+                    data = gzip.decompress(data)
+                elif compress == 'zip':
+                    data = zipfile.ZipFile(BytesIO(data)).read('report.csv')
+                return pd.read_csv(BytesIO(data))
+            assert_frame_equal(self.received(read), self.df)
+
+    def test_encoding(self):
+        df = pd.DataFrame({'v': ['Größe {}'.format(i) for i in range(300)]})
+        em.send_df(df, self.config_ini, index=False, encoding='latin-1',
+                   max_attachment_size=1000)
+        attachments = self.attachments(self.server.messages[0])
+        self.assertGreater(len(attachments), 1)
+        self.assertEqual(attachments[0].get_content_charset(), 'iso-8859-1')
+        assert_frame_equal(self.received(lambda data: pd.read_csv(
+            BytesIO(data), encoding='latin-1')), df)
+
+    def test_split_messages(self):
+        em.send_df(self.df, self.config_ini, index=False,
+                   max_attachment_size=4000, max_message_size=9000)
+        self.assertGreater(len(self.server.messages), 1)
+        self.assertEqual(self.server.connections, 1)
+        for number, msg in enumerate(self.server.messages, 1):
+            self.assertTrue(msg['Subject'].endswith(
+                '(part {})'.format(number)))
+            self.assertLessEqual(
+                sum(len(part.get_payload(decode=True))
+                    for part in self.attachments(msg)), 9000)
+        df = self.received(lambda data: pd.read_csv(BytesIO(data)))
+        assert_frame_equal(df, self.df)
+
+    def test_parquet(self):
+        em.send_df(self.df, self.config_ini, attachment_format='parquet',
+                   max_attachment_size=5000, chunk_rows=200)
+        attachments = self.attachments(self.server.messages[0])
+        self.assertGreater(len(attachments), 1)
+        self.assertEqual(attachments[0].get_filename(),
+                         'report_part1.parquet')
+        df = self.received(lambda data: pd.read_parquet(BytesIO(data)))
+        assert_frame_equal(df, self.df)
+
+    def test_invalid_options(self):
+        with self.assertRaises(ValueError):
+            em.send_df(self.df, self.config_ini, compress='bz2')
+        with self.assertRaises(ValueError):
+            em.send_df(self.df, self.config_ini, attachment_format='xlsx')
+        self.assertEqual(self.server.connections, 0)
+
+
+class TestSendDfByGroup(EmailTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.df = pd.DataFrame({'country': ['DE', 'FR', 'DE', 'NL', 'FR'],
+                                'v1': [1, 2, 3, 4, 5]})
+        self.recipients = {'DE': 'de@foo.bar',
+                           'FR': ['fr@foo.bar', 'eu@foo.bar']}
+
+    def received(self):
+        result = {}
+        for msg in self.server.messages:
+            attachment, = self.attachments(msg)
+            csv = attachment.get_payload(decode=True).decode()
+            result[msg['To']] = (msg['Subject'],
+                                 pd.read_csv(StringIO(csv), index_col=0))
+        return result
+
+    def check(self):
+        received = self.received()
+        self.assertEqual(sorted(received),
+                         ['de@foo.bar', 'fr@foo.bar, eu@foo.bar'])
+        subject, df = received['de@foo.bar']
+        self.assertTrue(subject.startswith('Report - DE / Generated on'))
+        assert_frame_equal(df, self.df.loc[[0, 2]])
+        assert_frame_equal(received['fr@foo.bar, eu@foo.bar'][1],
+                           self.df.loc[[1, 4]])
+
+    def test_single_session(self):
+        em.send_df_by_group(self.df, self.config_ini, 'country',
+                            self.recipients)
+        self.check()
+        self.assertEqual(self.server.connections, 1)
+
+    def test_pool(self):
+        with em.SMTPSessionPool(self.config_ini, size=2) as pool:
+            em.send_df_by_group(self.df, None, 'country', self.recipients,
+                                pool=pool)
+        self.check()
+
+    def test_several_columns(self):
+        self.df['kind'] = ['a', 'a', 'b', 'a', 'a']
+        em.send_df_by_group(self.df, self.config_ini, ['country', 'kind'],
+                            {('DE', 'b'): 'de@foo.bar'}, index=False)
+        msg, = self.server.messages
+        self.assertTrue(msg['Subject'].startswith('Report - DE / b /'))
+
+    def test_missing(self):
+        with self.assertRaises(ValueError):
+            em.send_df_by_group(self.df, self.config_ini, 'country',
+                                self.recipients, missing='raise')
+        self.assertEqual(self.server.connections, 0)
+
+
+class TestSMTPSession(EmailTestCase):
+
+    def test_reuse_connection(self):
+        with em.SMTPSession(self.config_ini) as session:
+            for _ in range(5):
+                session.send_df(self.df)
+            em.send_df(self.df, self.config_ini, session=session)
+            em.send_df(self.df, self.config_ini, session=session,
+                       compress='gzip', max_attachment_size=100,
+                       max_message_size=100)
+        self.assertEqual(len(self.server.messages), 7)
+        self.assertEqual(self.server.connections, 1)
+
+    def test_pool(self):
+        with em.SMTPSessionPool(self.config_ini, size=3) as pool:
+            session = em.SMTPSession(self.config_ini)
+            msgs = [msg for n in range(12)
+                    for msg in em._df_messages(self.df.iloc[:n],
+                                               session.config)]
+            pool.send_many(msgs)
+        self.assertEqual(len(self.server.messages), 12)
+        self.assertLessEqual(self.server.connections, 3)
+
+    def test_pool_consumes_lazily(self):
+        ahead = []
+
+        def msgs(session):
+            for n in range(20):
+                ahead.append(n - len(self.server.messages))
+                yield from em._df_messages(self.df, session.config)
+
+        with em.SMTPSessionPool(self.config_ini, size=2) as pool:
+            pool.send_many(msgs(em.SMTPSession(self.config_ini)))
+        self.assertEqual(len(self.server.messages), 20)
+        # The email being built and those being sent
+        self.assertLessEqual(max(ahead), 2)
+
+    def test_pool_error(self):
+        self.server.errors = ['554 Rejected']
+        with em.SMTPSessionPool(self.config_ini, size=2) as pool:
+            session = em.SMTPSession(self.config_ini)
+            msgs = [msg for _ in range(4)
+                    for msg in em._df_messages(self.df, session.config)]
+            with self.assertRaises(smtplib.SMTPException):
+                pool.send_many(msgs)
+        self.assertEqual(len(self.server.messages), 3)
+
+
+class TestSMTPSessionReconnect(EmailTestCase):
+
+    drop_after = 2
+
+    def test_reconnect(self):
+        with em.SMTPSession(self.config_ini) as session:
+            for _ in range(5):
+                session.send_df(self.df)
+        self.assertEqual(len(self.server.messages), 5)
+        self.assertEqual(self.server.connections, 3)
+
+    def test_give_up(self):
+        session = em.SMTPSession(self.config_ini, max_retries=0)
+        session.send_df(self.df)
+        session.send_df(self.df)
+        with self.assertRaises(smtplib.SMTPServerDisconnected):
+            session.send_df(self.df)
+        session.close()
+
+
+class TestOutbox(EmailTestCase):
+
+    def spooled(self, *subdir):
+        return [filename for filename in
+                os.listdir(os.path.join(self.spool_dir, *subdir))
+                if filename.endswith('.eml')]
+
+    def setUp(self):
+        super().setUp()
+        self.spool_dir = os.path.join(self.path, 'outbox')
+
+    def test_send(self):
+        with em.Outbox(self.config_ini) as outbox:
+            for _ in range(3):
+                outbox.send_df(self.df)
+        self.assertEqual(len(self.server.messages), 3)
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual(outbox.failed, [])
+
+    def test_retry(self):
+        self.server.errors = ['451 Try again later'] * 2
+        outbox = em.Outbox(self.config_ini, spool_dir=self.spool_dir,
+                           backoff=0.01)
+        outbox.send_df(self.df)
+        self.assertTrue(outbox.drain(timeout=10))
+        self.assertEqual(len(self.server.messages), 1)
+        self.assertEqual(self.spooled(), [])
+        self.assertEqual(outbox.failed, [])
+
+    def test_permanent_failure(self):
+        self.server.errors = ['554 Rejected']
+        outbox = em.Outbox(self.config_ini, spool_dir=self.spool_dir,
+                           backoff=0.01)
+        outbox.send_df(self.df)
+        outbox.send_df(self.df)
+        outbox.drain()
+        self.assertEqual(len(self.server.messages), 1)
+        (msg, error), = outbox.failed
+        self.assertEqual(error.smtp_code, 554)
+        self.assertEqual(len(self.spooled('failed')), 1)
+        self.assertEqual(self.spooled(), [])
+
+    def test_close_while_retrying(self):
+        self.server.errors = ['451 Try again later'] * 10
+        outbox = em.Outbox(self.config_ini, backoff=60)
+        for _ in range(4):
+            outbox.send_df(self.df)
+        start = time.perf_counter()
+        self.assertFalse(outbox.drain(timeout=0.2))
+        self.assertLess(time.perf_counter() - start, 5)
+        self.assertEqual(self.server.messages, [])
+        self.assertEqual(len(outbox.failed), 4)
+        self.assertEqual(outbox.failed[0][1].smtp_code, 451)
+        self.assertTrue(all(isinstance(error, em.OutboxClosed)
+                            for _, error in outbox.failed[1:]))
+
+    def test_spool_survives_restart(self):
+        self.server.errors = ['421 Busy'] * 10
+        outbox = em.Outbox(self.config_ini, spool_dir=self.spool_dir,
+                           backoff=60)
+        outbox.send_df(self.df, index=False)
+        self.assertFalse(outbox.drain(timeout=0.5))
+        self.assertEqual(len(self.spooled()), 1)
+        with self.assertRaises(ValueError):
+            outbox.send_df(self.df)
+
+        self.server.errors = []
+        with em.Outbox(self.config_ini, spool_dir=self.spool_dir) as outbox:
+            pass
+        msg, = self.server.messages
+        attachment, = self.attachments(msg)
+        csv = attachment.get_payload(decode=True).decode()
+        assert_frame_equal(pd.read_csv(StringIO(csv)), self.df)
+        self.assertEqual(self.spooled(), [])
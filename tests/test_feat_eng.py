@@ -395,3 +395,23 @@ class TestSelectColumns(unittest.TestCase):
         self.assertRaises(ValueError, fe.SelectColumns)
         sc = fe.SelectColumns(cols=['v1', 'v2'])
         self.assertRaises(ValueError, sc.transform, self.df)
+
+
+class TestRatioColumnToValueFitOnSample(unittest.TestCase):
+
+    def setUp(self):
+        self.df = pd.DataFrame({
+            'v1': np.random.RandomState(0).normal(10, 2, 400)})
+
+    def test_mean(self):
+        op = fe.RatioColumnToValue(col='v1', func='mean').fit_on_sample(
+            self.df)
+        self.assertEqual(op.const_, self.df.v1.mean())
+        self.assertAlmostEqual(op.sample_error_, 2 / np.sqrt(400), places=2)
+
+    def test_median(self):
+        op = fe.RatioColumnToValue(col='v1', func='median').fit_on_sample(
+            self.df, population_size=800)
+        self.assertAlmostEqual(
+            op.sample_error_,
+            1.2533 * 2 / np.sqrt(400) * np.sqrt(400 / 799), places=2)
@@ -1,4 +1,6 @@
+import sqlite3
 import unittest
+import numpy as np
 import pandas as pd
 from pandas.testing import assert_frame_equal
 from pubdsutils import features_engineering as fe
@@ -54,3 +56,81 @@ class TestSimplePipeline(unittest.TestCase):
         ))
         assert_frame_equal(res, expected_res)
         assert_frame_equal(self.df, df_copy)
+
+
+class TestPipelineToSql(unittest.TestCase):
+
+    def setUp(self):
+        self.df = pd.DataFrame(OrderedDict(
+            {
+                "v1": [2, 4, 6, 5],
+                "v2": [10, 20, 30, 7],
+                "d1": pd.to_datetime([
+                    '2017-06-27 23:00', '2017-06-24 10:30',
+                    '2017-05-01 00:00', '2017-04-29 12:00']),
+                "d2": pd.to_datetime([
+                    '2017-06-20 01:00', '2017-06-20 11:00',
+                    '2017-04-30 00:00', '2017-05-02 06:00']),
+            })
+        )
+        self.conn = sqlite3.connect(':memory:')
+        self.df.to_sql('orders', self.conn, index=False)
+        self.pipeline = make_pipeline(
+            fe.RatioColumnToConst(col='v1', const=2, feat_name='v1_to_2'),
+            fe.RatioBetweenColumns(numer='v2', denom='v1_to_2'),
+            fe.DaysFromLaterToEarly(start='d2', end='d1'),
+            fe.DaysFromLaterToEarly(start='d1', end='d2', feat_name='neg'),
+            fe.DayOfTheWeekForColumn(col='d1'),
+            fe.HourOfTheDayForColumn(col='d2'),
+        )
+
+    def tearDown(self):
+        self.conn.close()
+
+    def from_sql(self, pipeline):
+        sql = fe.pipeline_to_sql(pipeline, 'SELECT * FROM orders',
+                                 dialect='sqlite')
+        return pd.read_sql(sql, self.conn, parse_dates=['d1', 'd2']).astype(
+            fe.sql_feature_dtypes(pipeline))
+
+    def test_matches_pandas(self):
+        assert_frame_equal(self.from_sql(self.pipeline),
+                           self.pipeline.transform(self.df))
+
+    def test_select_columns(self):
+        self.pipeline.steps.append(
+            ('select', fe.SelectColumns(cols=['v2', 'v2Tov1_to_2Ratio'])))
+        self.pipeline.steps.append(
+            ('ratio', fe.RatioColumnToConst(col='v2', const=10)))
+        res = self.from_sql(self.pipeline)
+        self.assertEqual(list(res.columns),
+                         ['v2', 'v2Tov1_to_2Ratio', 'v2To10Ratio'])
+        assert_frame_equal(res, self.pipeline.transform(self.df))
+
+    def test_mssql(self):
+        sql = fe.pipeline_to_sql(self.pipeline, 'SELECT * FROM orders')
+        self.assertIn('CAST(base.[v1] AS FLOAT) / NULLIF(2, 0) AS [v1_to_2]',
+                      sql)
+        self.assertIn("DATEPART(hour, base.[d2]) AS [d2_HourOfTheDay]", sql)
+
+    def test_numpy_const(self):
+        pipeline = [fe.RatioColumnToConst(col='v1', const=np.float64(1.19)),
+                    fe.RatioColumnToConst(col='v2', const=np.int64(3))]
+        sql = fe.pipeline_to_sql(pipeline, 'SELECT * FROM orders')
+        self.assertIn('NULLIF(1.19, 0)', sql)
+        self.assertIn('NULLIF(3, 0)', sql)
+
+    def test_errors(self):
+        self.assertRaises(ValueError, fe.pipeline_to_sql, self.pipeline,
+                          'SELECT 1', dialect='oracle')
+        self.assertRaises(
+            ValueError, fe.pipeline_to_sql,
+            [fe.RatioColumnToValue(col='v1', func='mean')], 'SELECT 1')
+        self.assertRaises(
+            ValueError, fe.pipeline_to_sql,
+            [fe.SelectColumns(cols=['v1']),
+             fe.RatioColumnToConst(col='v2', const=1)], 'SELECT 1')
+        for const in ['1', np.inf, True]:
+            self.assertRaises(
+                ValueError, fe.pipeline_to_sql,
+                [fe.RatioColumnToConst(col='v1', const=const)], 'SELECT 1')
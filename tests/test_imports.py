@@ -0,0 +1,34 @@
+import sys
+import subprocess
+import unittest
+
+# Modules only imported once used, per module of pubdsutils
+LAZY = {
+    'data_fetch': ['pymssql', 'pyarrow', 'sklearn', 'smtplib'],
+    'preprocessing': ['sklearn.preprocessing', 'smtplib', 'pymssql'],
+    'features_engineering': ['sklearn.preprocessing', 'smtplib', 'pymssql'],
+    'email': ['pandas', 'smtplib', 'email.mime'],
+    'calcs': ['scipy.sparse', 'sklearn'],
+    'instrumentation': ['pandas'],
+}
+
+
+def imported(module, names):
+    """Which of ``names`` are imported along with ``module``"""
+    code = ('import sys, {}; print(",".join(name for name in {!r} '
+            'if name in sys.modules))'.format(module, names))
+    output = subprocess.check_output([sys.executable, '-c', code])
+    return [name for name in output.decode().strip().split(',') if name]
+
+
+class TestLazyImports(unittest.TestCase):
+
+    def test_lazy(self):
+        # Modules pandas imports itself, such as pyarrow in recent versions,
+        # are only checked for the modules that do not import pandas
+        along_pandas = imported('pandas', sorted(set(sum(LAZY.values(), []))))
+        for module, names in LAZY.items():
+            if 'pandas' not in names:
+                names = [name for name in names if name not in along_pandas]
+            with self.subTest(module=module):
+                self.assertEqual(imported('pubdsutils.' + module, names), [])
@@ -0,0 +1,170 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.pipeline import make_pipeline
+from pubdsutils import instrumentation as ins
+from pubdsutils import features_engineering as fe
+from pubdsutils import data_fetch as dfe
+
+
+class InstrumentationTestCase(unittest.TestCase):
+
+    def setUp(self):
+        ins.reset()
+        self.df = pd.DataFrame({'v1': np.arange(1, 1001),
+                                'v2': np.arange(1000, 0, -1)})
+        self.pipeline = make_pipeline(
+            fe.RatioBetweenColumns(numer='v1', denom='v2', feat_name='r'),
+            fe.SelectColumns(cols=['r']))
+
+    def tearDown(self):
+        ins.disable()
+        ins.reset()
+
+
+class TestInstrumented(InstrumentationTestCase):
+
+    def test_disabled(self):
+        self.pipeline.fit_transform(self.df)
+        self.assertEqual(ins.metrics(), {})
+
+    def test_transformers(self):
+        ins.enable()
+        for _ in range(3):
+            self.pipeline.fit_transform(self.df)
+        metrics = ins.metrics()
+        self.assertEqual(sorted(metrics), [
+            'RatioBetweenColumns.fit', 'RatioBetweenColumns.transform',
+            'SelectColumns.fit', 'SelectColumns.transform'])
+        transform = metrics['SelectColumns.transform']
+        self.assertEqual(transform['calls'], 3)
+        self.assertEqual(transform['rows']['sum'], 3000)
+        result = self.pipeline.transform(self.df)
+        self.assertEqual(transform['bytes_copied'],
+                         3 * result.memory_usage(index=True).sum())
+        self.assertGreater(transform['rows_per_second'], 0)
+        self.assertEqual(metrics['SelectColumns.fit']['bytes_copied'], 0)
+        self.assertIsNone(transform['peak_memory_bytes'])
+        buckets = transform['duration_seconds']['buckets']
+        self.assertEqual(buckets[-1], ['+Inf', 3])
+
+    def test_peak_memory(self):
+        ins.enable(trace_memory=True)
+
+        @ins.instrumented(name='allocate')
+        def allocate(n):
+            return pd.DataFrame({'v': np.ones(n)})
+
+        allocate(100000)
+        self.assertGreaterEqual(ins.metrics()['allocate']['peak_memory_bytes'],
+                                800000)
+
+    def test_errors(self):
+        ins.enable()
+        with self.assertRaises(ValueError):
+            fe.SelectColumns(cols=['foo']).transform(self.df)
+        metrics = ins.metrics()['SelectColumns.transform']
+        self.assertEqual((metrics['calls'], metrics['errors']), (1, 1))
+
+    def test_persist_df(self):
+        path = tempfile.mkdtemp() + os.sep
+        try:
+            ins.enable()
+            dfe.persist_df(self.df, path=path)
+        finally:
+            shutil.rmtree(path)
+        self.assertEqual(ins.metrics()['persist_df']['rows']['sum'], 1000)
+
+
+class Halve(BaseEstimator, TransformerMixin):
+
+    def fit(self, df, y=None):
+        return self
+
+    def transform(self, df):
+        return df.assign(v1=df['v1'] / 2)
+
+
+class TestProfilePipelineMemory(InstrumentationTestCase):
+
+    def test_table(self):
+        pipeline = make_pipeline(
+            Halve(), *[step for _, step in self.pipeline.steps])
+        profile = ins.profile_pipeline_memory(pipeline, self.df)
+        table = profile.table.set_index('step')
+        self.assertEqual(list(table.columns),
+                         ins.PIPELINE_PROFILE_COLUMNS[1:])
+        self.assertEqual(list(table.index),
+                         ['halve', 'ratiobetweencolumns', 'selectcolumns'])
+        self.assertEqual(table.loc['halve', 'dtype_changes'],
+                         ['v1: int64 -> float64'])
+        self.assertEqual(table.loc['halve', 'copies'], 1)
+        self.assertEqual(table.loc['ratiobetweencolumns', 'columns_added'],
+                         ['r'])
+        self.assertEqual(table.loc['selectcolumns', 'columns_removed'],
+                         ['v1', 'v2'])
+        self.assertEqual(table.loc['halve', 'memory_in'],
+                         self.df.memory_usage(index=True, deep=True).sum())
+        self.assertEqual(table['memory_out'].iloc[-1],
+                         pipeline.transform(self.df).memory_usage(
+                             index=True, deep=True).sum())
+        self.assertTrue((table['peak_memory'] > 0).all())
+        self.assertTrue((table['rows_out'] == 1000).all())
+        self.assertFalse(ins.tracemalloc.is_tracing())
+        self.assertNotIn('copy', pd.DataFrame.__dict__)
+
+    def test_overlapping_copy_counts(self):
+        # two profiles whose runs overlap, the first finishing first
+        small, large = self.df.iloc[:10], self.df
+        first = ins._counting_copies(large.memory_usage(index=True).sum())
+        second = ins._counting_copies(0)
+        first_counts = first.__enter__()
+        second_counts = second.__enter__()
+        small.copy()
+        large.copy()
+        first.__exit__(None, None, None)
+        large.copy()
+        self.assertIn('copy', pd.DataFrame.__dict__)
+        second.__exit__(None, None, None)
+        self.assertEqual(first_counts['count'], 1)
+        self.assertEqual(second_counts['count'], 3)
+        self.assertNotIn('copy', pd.DataFrame.__dict__)
+
+    def test_collapsed(self):
+        profile = ins.profile_pipeline_memory(self.pipeline, self.df,
+                                              traceback_frames=5)
+        lines = profile.to_collapsed().splitlines()
+        stacks = [line.rsplit(' ', 1)[0].split(';') for line in lines]
+        self.assertIn(['pipeline', 'ratiobetweencolumns'], stacks)
+        self.assertTrue(any(len(stack) > 2 for stack in stacks))
+        self.assertTrue(all(int(line.rsplit(' ', 1)[1]) > 0
+                            for line in lines))
+
+
+class TestExport(InstrumentationTestCase):
+
+    def setUp(self):
+        super().setUp()
+        ins.enable()
+        self.pipeline.fit_transform(self.df)
+
+    def test_json(self):
+        self.assertEqual(json.loads(ins.to_json()), ins.metrics())
+
+    def test_prometheus(self):
+        lines = ins.to_prometheus().splitlines()
+        self.assertIn('# TYPE pubdsutils_call_duration_seconds histogram',
+                      lines)
+        self.assertIn('pubdsutils_call_duration_seconds_bucket{function='
+                      '"SelectColumns.transform",le="+Inf"} 1', lines)
+        self.assertIn('pubdsutils_rows_sum{function='
+                      '"SelectColumns.transform"} 1000', lines)
+        self.assertIn('pubdsutils_bytes_copied_total{function='
+                      '"SelectColumns.fit"} 0', lines)
+        self.assertFalse(any(line.startswith('pubdsutils_peak_memory_bytes{')
+                             for line in lines))
@@ -248,3 +248,38 @@ class TestLabelEncodingColoumns(unittest.TestCase):
             lec.transform(in_df),
             out_df
         )
+
+
+class TestFitOnSample(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.df = pd.DataFrame({
+            'v1': rng.normal(10, 2, 400),
+            'v2': rng.normal(0, 1, 400),
+            'l1': ['a'] * 390 + list('bcdefghijk'),
+        })
+
+    def test_standardize(self):
+        op = pp.StandardizeFloatCols(cols=['v1', 'v2']).fit_on_sample(
+            self.df)
+        assert_array_equal(op.transform(self.df).values,
+                           pp.StandardizeFloatCols(cols=['v1', 'v2']).fit(
+                               self.df).transform(self.df).values)
+        self.assertEqual(list(op.sample_errors_.index), ['v1', 'v2'])
+        self.assertAlmostEqual(op.sample_errors_.loc['v1', 'mean'],
+                               2 / np.sqrt(400), places=2)
+        self.assertAlmostEqual(op.sample_errors_.loc['v2', 'std'],
+                               1 / np.sqrt(2 * 399), places=2)
+
+    def test_finite_population(self):
+        op = pp.StandardizeFloatCols(cols=['v1']).fit_on_sample(
+            self.df, population_size=400)
+        assert_array_equal(op.sample_errors_.values, [[0., 0.]])
+        self.assertRaises(ValueError, op.fit_on_sample, self.df,
+                          population_size=10)
+
+    def test_label_encoding(self):
+        op = pp.LabelEncodingColoumns(cols=['l1']).fit_on_sample(self.df)
+        self.assertAlmostEqual(op.sample_errors_['l1'], 10 / 400)
+        op.transform(self.df)
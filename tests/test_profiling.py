@@ -0,0 +1,79 @@
+import unittest
+import numpy as np
+import pandas as pd
+from pandas.testing import assert_frame_equal
+from pubdsutils import calcs as ca
+from pubdsutils import preprocessing as pp
+from pubdsutils.profiling import profile_df, DataFrameProfiler
+
+
+class TestProfiling(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        n = 1000
+        self.df = pd.DataFrame({
+            'price': np.where(rng.rand(n) < .1, np.nan,
+                              rng.lognormal(3, 1, n).round(1)),
+            'country': rng.choice(['DE', 'FR', 'NL', None], n,
+                                  p=[.5, .3, .15, .05]),
+            'grade': pd.Categorical(rng.choice(['A', 'B', 'C'], n)),
+            'shop': 'rebuy',
+            'ordered_at': pd.Timestamp('2017-01-01') + pd.to_timedelta(
+                rng.randint(0, 365, n), unit='D'),
+        })
+
+    def test_profile(self):
+        profile = profile_df(self.df, top=2)
+        self.assertEqual(list(profile.index), list(self.df.columns))
+        for col in self.df.columns:
+            s = self.df[col]
+            row = profile.loc[col]
+            self.assertEqual(row['dtype'], str(s.dtype))
+            self.assertEqual(row['count'], s.count())
+            self.assertEqual(row['null_count'], s.isna().sum())
+            self.assertAlmostEqual(row['null_ratio'], s.isna().mean())
+            self.assertEqual(row['nunique'], s.nunique())
+            counts = ca.value_counts_comb(s)
+            self.assertEqual(row['top'], list(counts.index[:2]))
+            self.assertEqual(row['top_ratio'], list(counts['Ratio'].iloc[:2]))
+        for col in ['price', 'country', 'ordered_at']:
+            values = self.df[col].dropna()
+            self.assertEqual(profile.loc[col, 'min'], values.min())
+            self.assertEqual(profile.loc[col, 'max'], values.max())
+        self.assertEqual(
+            list(profile.index[profile['constant'].astype(bool)]),
+            list(pp.RemoveConstantColumns().fit(self.df).const_cols))
+
+    def test_chunks_and_threads(self):
+        expected = profile_df(self.df)
+        profiler = DataFrameProfiler(n_jobs=3)
+        for start in range(0, len(self.df), 300):
+            profiler.update(self.df.iloc[start:start + 300])
+        self.assertEqual(profiler.n_rows, len(self.df))
+        assert_frame_equal(profiler.to_frame(), expected)
+
+        halves = [DataFrameProfiler().update(self.df.iloc[:500]),
+                  DataFrameProfiler().update(self.df.iloc[500:])]
+        assert_frame_equal(halves[0].merge(halves[1]).to_frame(), expected)
+
+    def test_approximate(self):
+        expected = profile_df(self.df)
+        halves = [DataFrameProfiler(exact=False).update(self.df.iloc[:500]),
+                  DataFrameProfiler(exact=False).update(self.df.iloc[500:])]
+        profile = halves[0].merge(halves[1]).to_frame()
+        for col in ['dtype', 'count', 'null_count', 'null_ratio', 'constant',
+                    'min', 'max']:
+            self.assertEqual(list(profile[col]), list(expected[col]))
+        np.testing.assert_allclose(profile['nunique'].astype(float),
+                                   expected['nunique'].astype(float),
+                                   rtol=.05)
+        self.assertEqual(profile.loc['country', 'top'],
+                         expected.loc['country', 'top'])
+        with self.assertRaises(ValueError):
+            halves[0].merge(DataFrameProfiler())
+
+    def test_not_comparable(self):
+        profile = profile_df(pd.DataFrame({'mixed': [1, 'a', None]}))
+        self.assertTrue(pd.isna(profile.loc['mixed', 'min']))
+        self.assertEqual(profile.loc['mixed', 'nunique'], 2)